@@ -1,11 +1,16 @@
 import cv2
-import matplotlib.pyplot as plt
-import numpy as np
 import os
-import tkinter as tk
-from tkinter import filedialog
+
+# the medical_image_analysis package shared with the other pipelines: pip install -e ../03_image_enhancement_tool
+from medical_image_analysis.contours import contour_analysis
+from medical_image_analysis.loader import ImageLoader
 
 def analyze_images():
+    # the dialog and the figures are the only users of tkinter and Matplotlib, loaded here and not at import
+    import matplotlib.pyplot as plt
+    import tkinter as tk
+    from tkinter import filedialog
+
     root = tk.Tk()
     root.withdraw()
     print("Select Images")
@@ -17,30 +22,21 @@ def analyze_images():
     
     if image_paths:
         print(f"Images selected: {len(image_paths)}")
-        for i, image_path in enumerate(image_paths):
+        # images are read and decoded in the background while the previous figure is shown
+        loaded = ImageLoader().prefetch(image_paths, decode='color')
+        for i, (image_path, _, original_image) in enumerate(loaded):
             print(f"Analyzing {i+1}/{len(image_paths)}: {os.path.basename(image_path)}")
             
-            original_image = cv2.imread(image_path)
             if original_image is not None:
                 print(f"ANALYZING MEDICAL IMAGE: {os.path.basename(image_path)}")
 
-                gray_cell = cv2.cvtColor(original_image, cv2.COLOR_BGR2GRAY)
-    
-                adaptive_binary = cv2.adaptiveThreshold(
-                     gray_cell, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
-                )
-
-                kernel = np.ones((2,2), np.uint8)
-                cleaned_cells = cv2.morphologyEx(adaptive_binary, cv2.MORPH_OPEN, kernel)
-                cell_contours, _ = cv2.findContours(cleaned_cells, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                cell_count = len([cnt for cnt in cell_contours if cv2.contourArea(cnt) > 20])
-
-                clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-                clahe_enhanced = clahe.apply(gray_cell)
-
-                edges = cv2.Canny(clahe_enhanced, 30, 100)
-                edge_contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                edge_count = len([cnt for cnt in edge_contours if cv2.contourArea(cnt) > 25])
+                analysis = contour_analysis(original_image)
+                gray_cell = analysis['gray_cell']
+                adaptive_binary = analysis['adaptive_binary']
+                clahe_enhanced = analysis['clahe_enhanced']
+                edges = analysis['edges']
+                cell_contours, edge_contours = analysis['cell_contours'], analysis['edge_contours']
+                cell_count, edge_count = analysis['cell_count'], analysis['edge_count']
 
                 cell_image = original_image.copy()
                 cv2.drawContours(cell_image, cell_contours, -1, (0, 255, 0), 2)
@@ -102,4 +98,5 @@ def analyze_images():
     else:
         print("No images selected")        
 
-analyze_images()
+if __name__ == "__main__":
+    analyze_images()
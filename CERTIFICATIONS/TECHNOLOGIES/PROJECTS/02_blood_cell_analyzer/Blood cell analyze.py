@@ -1,102 +1,281 @@
 #CLAHE medical grade enhancement
+import argparse
+import csv
 import cv2
-import matplotlib.pyplot as plt
 import os
 import numpy as np
-print("IMAGE ENHANCEMENT INITIATED!")
+import time
+import xml.etree.ElementTree as ET
+
+# the medical_image_analysis package shared with the other pipelines: pip install -e ../03_image_enhancement_tool
+from medical_image_analysis.features import label_perimeters
+from medical_image_analysis.intensity_stats import IntensityStats, collect_intensity_stats
+from medical_image_analysis.stage_graph import StageGraph, common_stages, object_outlines
 
 dataset_path = r"E:\BIOMEDICAL IMAGE ANALYSIS\WEEK 2 Image_processing\blood_cells_data\BCCD_Dataset-master\BCCD"
-images_path = os.path.join(dataset_path, "JPEGImages")
-blood_cell_images = [f for f in os.listdir(images_path) if f.endswith('.jpg')]
 
-first_image_path = os.path.join(images_path, blood_cell_images[0])
-blood_cell = cv2.imread(first_image_path)
-gray_cell = cv2.cvtColor(blood_cell, cv2.COLOR_BGR2GRAY)
-print(f"Processing: {blood_cell_images[1]}")
+def enhancement_demo(dataset_path):
+    # Matplotlib is only needed for the figures, so it is not loaded at import
+    import matplotlib.pyplot as plt
+
+    print("IMAGE ENHANCEMENT INITIATED!")
+    images_path = os.path.join(dataset_path, "JPEGImages")
+    blood_cell_images = sorted(f for f in os.listdir(images_path) if f.endswith('.jpg'))
+
+    first_image_path = os.path.join(images_path, blood_cell_images[0])
+    blood_cell = cv2.imread(first_image_path)
+    # grayscale, equalized, CLAHE, edge and contour images, each computed once
+    stages = StageGraph(common_stages(), image=blood_cell)
+    gray_cell = stages['gray']
+    print(f"Processing: {blood_cell_images[0]}")
+
+    #regular histogram equalization
+    regular_enhnced = stages['equalized']
+
+    #CLAHE
+    clahe_enhanced = stages['clahe']
+    plt.figure(figsize=(15, 10))
+
+    plt.subplot(2, 3, 1)
+    plt.imshow(gray_cell, cmap='gray')
+    plt.title("Original cell")
+    plt.axis('off')
+
+    plt.subplot(2, 3, 2)
+    plt.imshow(regular_enhnced, cmap='gray')
+    plt.title("Regular histogram eqalization")
+    plt.axis('off')
+
+    plt.subplot(2, 3, 3)
+    plt.imshow(clahe_enhanced, cmap='gray')
+    plt.title("CLAHE enhancement")
+    plt.axis('off')
+
+    #histograms, binned once and drawn from the bins
+    histograms = IntensityStats()
+    histograms.add_images({'gray': gray_cell, 'equalized': regular_enhnced, 'clahe': clahe_enhanced})
+
+    plt.subplot(2, 3, 4)
+    histograms.plot(plt.gca(), 'gray', color='black')
+    plt.title("Original Histogram")
+
+    plt.subplot(2, 3, 5)
+    histograms.plot(plt.gca(), 'equalized', color='blue')
+    plt.title("Regular equalized histogram")
+
+    plt.subplot(2, 3, 6)
+    histograms.plot(plt.gca(), 'clahe', color='red')
+    plt.title("CLAHE histogram")
+
+    # plt.tight_layout()
+    # plt.show()
+    print("CLAHE ENHANCEMENT COMPLETE!")
+
+    #CANNY EDGE DETECTION + CONTOURS
+    print("Canny Edge Detection and contours initiated!")
+
+    #using clahe enhanced image for better edge detction
+    enhanced_for_edges = clahe_enhanced
+
+    edges = stages['edges']
+
+    #realistic cells: boundaries enclosing more than 25 px, counted and measured as whole arrays
+    cells, boundary_labels = stages['edge_objects']
+    print(f"Detected {boundary_labels.max()} individual cell boundaries")
 
-#regular histogram equalization
-regular_enhnced = cv2.equalizeHist(gray_cell)
+    #creating visualization
+    cell_contours = object_outlines(stages['edge_objects'])
+    edge_analysis = blood_cell.copy()
+    cv2.drawContours(edge_analysis, cell_contours, -1, (0, 255, 0), 2)
 
-#CLAHE
-clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-clahe_enhanced = clahe.apply(gray_cell)
-plt.figure(figsize=(15, 10))
+    #Measuring cell properties
+    print("Image analysis Report:")
+    perimeters = label_perimeters(boundary_labels, boundary_labels.max() + 1)[cells['Label']]
+    for i, (area, perimeter) in enumerate(zip(cells['Area'][:5], perimeters[:5])): #shows first 5 cells
+        print(f"Cell {i+1}: Area={area: .1f}, Perimeter={perimeter: .1f}")
 
-plt.subplot(2, 3, 1)
-plt.imshow(gray_cell, cmap='gray')
-plt.title("Original cell")
-plt.axis('off')
+    plt.figure(figsize=(15, 5))
 
-plt.subplot(2, 3, 2)
-plt.imshow(regular_enhnced, cmap='gray')
-plt.title("Regular histogram eqalization")
-plt.axis('off')
+    plt.subplot(1, 3, 1)
+    plt.imshow(enhanced_for_edges, cmap='gray')
+    plt.title("CLAHE ENHANCED IMAGE")
+    plt.axis('off')
 
-plt.subplot(2, 3, 3)
-plt.imshow(clahe_enhanced, cmap='gray')
-plt.title("CLAHE enhancement")
-plt.axis('off')
+    plt.subplot(1, 3, 2)
+    plt.imshow(edges, cmap='gray')
+    plt.title("Canny edge detection")
+    plt.axis('off')
 
-#histograms
-plt.subplot(2, 3, 4)
-plt.hist(gray_cell.ravel(), 256, [0,256], color='black')
-plt.title("Original Histogram")
+    plt.subplot(1, 3, 3)
+    plt.imshow(cv2.cvtColor(edge_analysis, cv2.COLOR_BGR2RGB))
+    plt.title(f"Cell boundary Analysis {len(cells['Label'])} cells mapped")
+    plt.axis('off')
 
-plt.subplot(2, 3, 5)
-plt.hist(regular_enhnced.ravel(), 256, [0,256], color='blue')
-plt.title("Regular equalized histogram")
+    plt.tight_layout()
+    plt.show()
+    print("CANNY EDGE DETECTION + CONTOURS COMPLETE")
 
-plt.subplot(2, 3, 6)
-plt.hist(clahe_enhanced.ravel(), 256, [0,256], color='red')
-plt.title("CLAHE histogram")
+#DATASET RUNNER
+# Streams every image of a BCCD-layout directory (JPEGImages/*.jpg with VOC XML boxes in Annotations/)
+# through the analysis pipeline on a process pool and scores the watershed cells and the Canny contours
+# against the annotated boxes.
 
-# plt.tight_layout()
-# plt.show()
-print("CLAHE ENHANCEMENT COMPLETE!")
+def parse_voc_annotation(xml_path, classes=None):
+    # annotated boxes as an (n, 4) array of xmin, ymin, xmax, ymax, optionally only the given classes
+    boxes = []
+    for item in ET.parse(xml_path).getroot().iter('object'):
+        if classes and item.findtext('name', '').strip() not in classes:
+            continue
+        box = item.find('bndbox')
+        boxes.append([float(box.findtext(side)) for side in ('xmin', 'ymin', 'xmax', 'ymax')])
+    return np.array(boxes, np.float64).reshape(-1, 4)
 
-#CANNY EDGE DETECTION + CONTOURS
-print("Canny Edge Detection and contours initiated!")
+def match_detections(points, boxes):
+    # true positives: detections (x, y) paired one-to-one with a box containing them, closest to its centre first
+    if not len(points) or not len(boxes):
+        return 0
+    x, y = points[:, :1], points[:, 1:]
+    inside = (x >= boxes[:, 0]) & (x <= boxes[:, 2]) & (y >= boxes[:, 1]) & (y <= boxes[:, 3])
+    distance = (x - (boxes[:, 0] + boxes[:, 2]) / 2) ** 2 + (y - (boxes[:, 1] + boxes[:, 3]) / 2) ** 2
+    distance[~inside] = np.inf
 
-#using clahe enhanced image for better edge detction
-enhanced_for_edges = clahe_enhanced
+    used_points, used_boxes = set(), set()
+    for flat in np.argsort(distance, axis=None):
+        point, box = np.unravel_index(flat, distance.shape)
+        if not np.isfinite(distance[point, box]):
+            break
+        if point not in used_points and box not in used_boxes:
+            used_points.add(point)
+            used_boxes.add(box)
+    return len(used_points)
 
-edges = cv2.Canny(enhanced_for_edges, threshold1=30, threshold2=100)
+def detection_scores(true_positives, detections, annotated):
+    precision = true_positives / detections if detections else 0.0
+    recall = true_positives / annotated if annotated else 0.0
+    return precision, recall
 
-contours, heirarchy = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+def score_image(result, boxes):
+    # per-image counts, precision and recall of both detectors
+    features = result['features']
+    detectors = {
+        'watershed': np.column_stack([features['Centroid_Col'], features['Centroid_Row']]),
+        'contour': result['edge_centroids'],
+    }
+    row = {'annotated': len(boxes), 'watershed_count': result['cell_count'], 'contour_count': result['edge_count']}
+    for name, points in detectors.items():
+        true_positives = match_detections(points, boxes)
+        precision, recall = detection_scores(true_positives, len(points), len(boxes))
+        row.update({f'{name}_detections': len(points), f'{name}_tp': true_positives,
+                    f'{name}_precision': precision, f'{name}_recall': recall})
+    return row
 
-#Filtering realistic cell contours.
-cell_contours = [cnt for cnt in contours if cv2.contourArea(cnt) > 25 and cv2.contourArea(cnt)]
-print(f"Detected {len(contours)} individual cell boundaries")
+def run_dataset(dataset_path, workers=None, classes=None, output_csv=None, limit=None):
+    from medical_image_analysis.analyzer import medical_image_analyzer
+    from medical_image_analysis.result_store import ResultStore
 
-#creating visualization
-edge_analysis = blood_cell.copy()
-cv2.drawContours(edge_analysis, cell_contours, -1, (0, 255, 0), 2)
+    images_path = os.path.join(dataset_path, "JPEGImages")
+    annotations_path = os.path.join(dataset_path, "Annotations")
+    image_paths = sorted(os.path.join(images_path, f) for f in os.listdir(images_path) if f.endswith('.jpg'))
+    if limit:
+        image_paths = image_paths[:limit]
+    if not image_paths:
+        print(f"Error! No images found in {images_path}")
+        return []
+    workers = workers or os.cpu_count() or 1
+    print(f"BCCD DATASET RUN: {len(image_paths)} images on {workers} worker(s)")
 
-#Measuring cell properties
-print("Image analysis Report:")
-for i, contour in enumerate(cell_contours[:5]): #shows first 5 cells
-    area = cv2.contourArea(contour)
-    perimeter = cv2.arcLength(contour, True)
-    print(f"Cell {i+1}: Area={area: .1f}, Perimeter={perimeter: .1f}")
+    # only counts, features and centroids come back from the workers
+    analyzer = medical_image_analyzer(store=ResultStore('slim'),
+                                      extra_stages=('edge_count', 'edge_centroids'))
+    rows = []
+    start = time.perf_counter()
+    for done, (image_path, result) in enumerate(analyzer.iter_batch_results(image_paths, workers), 1):
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        xml_path = os.path.join(annotations_path, name + '.xml')
+        if result is None or not os.path.isfile(xml_path):
+            print(f"[{done}/{len(image_paths)}] {name} skipped (no result or no annotation)")
+            continue
+        rows.append({'image': name, **score_image(result, parse_voc_annotation(xml_path, classes))})
+        if done % 50 == 0 or done == len(image_paths):
+            print(f"[{done}/{len(image_paths)}] {done / (time.perf_counter() - start):.1f} images/s")
+    elapsed = time.perf_counter() - start
 
-plt.figure(figsize=(15, 5))
+    if output_csv and rows:
+        with open(output_csv, 'w', newline='') as handle:
+            writer = csv.DictWriter(handle, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Per-image results written to {output_csv}")
 
-plt.subplot(1, 3, 1)
-plt.imshow(enhanced_for_edges, cmap='gray')
-plt.title("CLAHE ENHANCED IMAGE")
-plt.axis('off')
+    print("\n" + "-"*70)
+    print("BCCD DATASET REPORT")
+    print("-"*70)
+    print(f"    > Images scored: {len(rows)} in {elapsed:.1f} s ({len(image_paths) / elapsed:.1f} images/s)")
+    annotated = sum(row['annotated'] for row in rows)
+    print(f"    > Annotated cells: {annotated}")
+    for name in ('watershed', 'contour'):
+        detections = sum(row[f'{name}_detections'] for row in rows)
+        true_positives = sum(row[f'{name}_tp'] for row in rows)
+        precision, recall = detection_scores(true_positives, detections, annotated)
+        count_error = np.mean([abs(row[f'{name}_count'] - row['annotated']) for row in rows]) if rows else 0
+        print(f"    > {name.capitalize()}: {detections} detections, precision {precision:.3f}, "
+              f"recall {recall:.3f}, mean count error {count_error:.1f} per image")
+    print("-"*70)
+    return rows
 
-plt.subplot(1, 3, 2)
-plt.imshow(edges, cmap='gray')
-plt.title("Canny edge detection")
-plt.axis('off')
+def dataset_histograms(dataset_path, workers=None, output=None, previous=None, figure=None, limit=None):
+    # intensity statistics of the whole dataset before and after enhancement;
+    # previous: an .npz from an earlier run to add to, output: where to save the running aggregate
+    images_path = os.path.join(dataset_path, "JPEGImages")
+    image_paths = sorted(os.path.join(images_path, f) for f in os.listdir(images_path) if f.endswith('.jpg'))
+    if limit:
+        image_paths = image_paths[:limit]
+    print(f"INTENSITY STATISTICS: {len(image_paths)} images")
+    start = time.perf_counter()
+    stats = IntensityStats.load(previous) if previous else None
+    stats = collect_intensity_stats(image_paths, workers=workers, stats=stats)
+    elapsed = time.perf_counter() - start
 
-plt.subplot(1, 3, 3)
-plt.imshow(cv2.cvtColor(edge_analysis, cv2.COLOR_BGR2RGB))
-plt.title(f"Cell boundary Analysis {len(cell_contours)} cells mapped")
-plt.axis('off')
+    print("\n" + "-"*70)
+    print(f"INTENSITY REPORT ({stats.images} images, {len(image_paths) / elapsed:.1f} images/s this run)")
+    print("-"*70)
+    for name, values in stats.summary().items():
+        print(f"    > {name}: mean {values['mean']:.1f}, std {values['std']:.1f}, "
+              f"p5/p50/p95 {values['p5']}/{values['p50']}/{values['p95']}")
+    print("-"*70)
+    if output:
+        stats.save(output)
+        print(f"Histograms saved to {output}")
+    if figure:
+        import matplotlib.pyplot as plt
+        fig, axes = plt.subplots(1, 3, figsize=(15, 4))
+        for ax, name, color in zip(axes, ('gray', 'equalized', 'clahe'), ('black', 'blue', 'red')):
+            stats.plot(ax, name, color=color)
+            ax.set_title(f"{name} ({stats.images} images)")
+        fig.savefig(figure)
+    return stats
 
-plt.tight_layout()
-plt.show()
-print("CANNY EDGE DETECTION + CONTOURS COMPLETE")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Blood cell enhancement demo and BCCD dataset scoring")
+    parser.add_argument('dataset', nargs='?', default=dataset_path, help="BCCD directory (JPEGImages, Annotations)")
+    parser.add_argument('--score', action='store_true',
+                        help="analyze every image and score it against the annotations instead of the demo")
+    parser.add_argument('--histograms', action='store_true',
+                        help="collect dataset-wide intensity histograms before and after enhancement")
+    parser.add_argument('--histogram-file', default=None,
+                        help="save the histograms here (.npz); an existing file is added to, not replaced")
+    parser.add_argument('--histogram-figure', default=None, help="save histogram plots to this image file")
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('--classes', nargs='+', default=None,
+                        help="annotation classes to score against, e.g. RBC (default: all)")
+    parser.add_argument('--output', default=None, help="write per-image scores to this CSV file")
+    parser.add_argument('--limit', type=int, default=None, help="only the first N images")
+    args = parser.parse_args()
 
+    if args.histograms:
+        previous = args.histogram_file if args.histogram_file and os.path.exists(args.histogram_file) else None
+        dataset_histograms(args.dataset, args.workers, args.histogram_file, previous, args.histogram_figure, args.limit)
+    elif args.score:
+        run_dataset(args.dataset, args.workers, args.classes, args.output, args.limit)
+    else:
+        enhancement_demo(args.dataset)
@@ -0,0 +1,230 @@
+# Benchmark suite for the analysis pipelines on synthetic blood-smear images.
+# Times every medical_image_analyzer stage and the contour path of analyze_images() separately,
+# reports throughput and peak memory, writes the results as JSON and compares them with an earlier run,
+# so slowdowns and changed cell counts show up between versions. Scenes whose cells are all drawn apart must also
+# count them within --count-tolerance of the synthetic ground truth; the run exits 1 otherwise.
+#
+#   python benchmark.py --sizes 512 2048 --cells 100 800 --overlap 0 0.3 --output bench.json
+#   python benchmark.py ... --compare bench.json
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from medical_image_analysis.analyzer import medical_image_analyzer
+from medical_image_analysis.contours import contour_analysis
+
+ANALYZER_STAGES = ('grayscale', 'adaptive_threshold', 'morphological_op', 'watershed_segmentation',
+                   'feature_extraction', 'template_match')
+
+def synthetic_smear(size, cells, overlap=0.0, noise=8.0, radius=12, seed=0):
+    # bright discs on a dark background with a one-pixel checker texture. The pipeline segments what the adaptive
+    # threshold keeps after a 3x3 opening: the texture is removed, the discs stay whole, so separate cells are
+    # counted one by one. `overlap` of the cells are placed touching an earlier one, the others apart from
+    # every cell placed so far as far as the image has room. Returns the BGR image, the number of cells drawn
+    # and the number of separate objects (touching cells count once).
+    rng = np.random.default_rng(seed)
+    height, width = (size, size) if np.isscalar(size) else size
+    image = np.full((height, width), 70, np.float32)
+    background = np.ones((height, width), np.uint8)
+    drawn = np.zeros((height, width), np.uint8)
+    centres = []
+    for index in range(cells):
+        cell_radius = max(3, int(round(radius * rng.uniform(0.9, 1.1))))
+        if centres and rng.random() < overlap:
+            # touching an earlier cell, centres 1.2-1.8 radii apart
+            base_x, base_y, _ = centres[rng.integers(len(centres))]
+            angle = rng.uniform(0, 2 * np.pi)
+            distance = cell_radius * rng.uniform(1.2, 1.8)
+            x, y = base_x + distance * np.cos(angle), base_y + distance * np.sin(angle)
+        else:
+            for _ in range(100):
+                x, y = rng.uniform(cell_radius, width - cell_radius), rng.uniform(cell_radius, height - cell_radius)
+                if all((x - cx) ** 2 + (y - cy) ** 2 > (cell_radius + cr + 4) ** 2 for cx, cy, cr in centres):
+                    break
+        x = float(np.clip(x, cell_radius, width - cell_radius - 1))
+        y = float(np.clip(y, cell_radius, height - cell_radius - 1))
+        centres.append((x, y, cell_radius))
+        cv2.circle(image, (int(x), int(y)), cell_radius, 190, -1)
+        cv2.circle(background, (int(x), int(y)), cell_radius + 2, 0, -1)
+        cv2.circle(drawn, (int(x), int(y)), cell_radius, 1, -1)
+
+    # blurred noise varies too slowly to flip the adaptive threshold inside a cell
+    image += rng.normal(0, noise, image.shape).astype(np.float32)
+    image = cv2.GaussianBlur(image, (0, 0), 1.5)
+    rows, cols = np.indices((height, width))
+    image += np.where(background > 0, np.where((rows + cols) % 2 == 0, 25, -25), 0).astype(np.float32)
+    gray = np.clip(image, 0, 255).astype(np.uint8)
+    # a faint tint, the pipelines convert to grayscale first anyway
+    bgr = cv2.merge([gray, np.clip(gray.astype(np.int16) - 10, 0, 255).astype(np.uint8), gray])
+    return bgr, cells, cv2.connectedComponents(drawn)[0] - 1
+
+def _timed(function, repeats):
+    # median wall time over repeats, plus the last return value
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        value = function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), value
+
+def _peak_bytes(function):
+    # peak Python/NumPy allocation while function runs (OpenCV's own buffers are not traced)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark_image(analyzer, contour_analysis, image, repeats=3, measure_memory=True):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    adaptive = analyzer.adaptive_threshold(gray)
+    cleaned = analyzer.morphological_op(adaptive)
+    markers, _ = analyzer.watershed_segmentation(cleaned)
+
+    stage_calls = {
+        'grayscale': lambda: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY),
+        'adaptive_threshold': lambda: analyzer.adaptive_threshold(gray),
+        'morphological_op': lambda: analyzer.morphological_op(adaptive),
+        'watershed_segmentation': lambda: analyzer.watershed_segmentation(cleaned),
+        'feature_extraction': lambda: analyzer.classify_cells(analyzer.feature_table(markers, gray)),
+        'template_match': lambda: analyzer.template_match(gray),
+        'contour_path': lambda: contour_analysis(image, overlay=False),
+    }
+    stages = {}
+    outputs = {}
+    for name, call in stage_calls.items():
+        seconds, outputs[name] = _timed(call, repeats)
+        stages[name] = {'seconds': seconds}
+        if measure_memory:
+            stages[name]['peak_bytes'] = _peak_bytes(call)
+
+    features = outputs['feature_extraction']
+    counts = {
+        'watershed_cells': int(len(np.unique(markers)) - 1),
+        'feature_cells': int(len(features['Cell_ID'])),
+        'abnormal_cells': int(np.count_nonzero(features['Diagnosis'] == 'Abnormal')),
+        'template_detections': {name: int(count) for name, count in outputs['template_match'].items()},
+        'contour_cells': int(outputs['contour_path']['cell_count']),
+        'contour_boundaries': int(outputs['contour_path']['edge_count']),
+    }
+    return stages, counts
+
+def run_suite(sizes, cell_counts, overlaps, noises, repeats=3, seed=0, measure_memory=True):
+    analyzer = medical_image_analyzer()
+
+    cases = []
+    for size in sizes:
+        for cells in cell_counts:
+            for overlap in overlaps:
+                for noise in noises:
+                    image, truth, separate = synthetic_smear(size, cells, overlap, noise, seed=seed)
+                    stages, counts = benchmark_image(analyzer, contour_analysis, image, repeats, measure_memory)
+                    analyzer_seconds = sum(stages[name]['seconds'] for name in ANALYZER_STAGES)
+                    megapixels = image.shape[0] * image.shape[1] / 1e6
+                    case = {
+                        'size': size, 'cells': cells, 'overlap': overlap, 'noise': noise, 'seed': seed,
+                        'ground_truth_cells': truth,
+                        'separate_cells': separate,
+                        'stages': stages,
+                        'analyzer_seconds': analyzer_seconds,
+                        'images_per_second': 1 / analyzer_seconds if analyzer_seconds else None,
+                        'megapixels_per_second': megapixels / analyzer_seconds if analyzer_seconds else None,
+                        'contour_megapixels_per_second': megapixels / stages['contour_path']['seconds'],
+                        'counts': counts,
+                    }
+                    cases.append(case)
+                    print(f"{size}px, {cells} cells, overlap {overlap}, noise {noise}: "
+                          f"{case['images_per_second']:.2f} images/s, {case['megapixels_per_second']:.2f} MP/s, "
+                          f"{counts['feature_cells']} cells found (truth {truth}" +
+                          (")" if separate == truth else f", {separate} separate)"))
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeats': repeats,
+        },
+        'cases': cases,
+    }
+
+def _case_key(case):
+    return case['size'], case['cells'], case['overlap'], case['noise'], case['seed']
+
+def _case_label(case):
+    return "{}px/{} cells/overlap {}/noise {}".format(*_case_key(case)[:4])
+
+def count_errors(results, tolerance=0.05):
+    # separable cases (every cell drawn apart) whose cell count is off the ground truth by more than tolerance.
+    # Touching and crowded scenes measure how the watershed splits cells; their counts are only compared between
+    # runs, since merged blobs raise the slide-wide sure-foreground level and can hide small cells
+    problems = []
+    for case in results['cases']:
+        truth, found = case['ground_truth_cells'], case['counts']['feature_cells']
+        if case['separate_cells'] == truth and abs(found - truth) > tolerance * truth:
+            problems.append(f"{_case_label(case)}: {found} cells found, truth {truth}")
+    return problems
+
+def compare(current, baseline, tolerance=0.2):
+    # list of regressions: stages slower than baseline by more than tolerance, and any changed count
+    previous = {_case_key(case): case for case in baseline['cases']}
+    problems = []
+    for case in current['cases']:
+        old = previous.get(_case_key(case))
+        if old is None:
+            continue
+        label = _case_label(case)
+        for name, stage in case['stages'].items():
+            old_seconds = old['stages'].get(name, {}).get('seconds')
+            if old_seconds and stage['seconds'] > old_seconds * (1 + tolerance):
+                problems.append(f"{label}: {name} {old_seconds * 1e3:.1f} ms -> {stage['seconds'] * 1e3:.1f} ms")
+        if case['counts'] != old['counts']:
+            problems.append(f"{label}: counts changed {old['counts']} -> {case['counts']}")
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipelines on synthetic smears")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--cells', type=int, nargs='+', default=[100, 400])
+    parser.add_argument('--overlap', type=float, nargs='+', default=[0.0, 0.3])
+    parser.add_argument('--noise', type=float, nargs='+', default=[8.0])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="skip the traced peak-memory runs")
+    parser.add_argument('--output', default=os.path.join(tempfile.gettempdir(), 'benchmark_results.json'))
+    parser.add_argument('--compare', default=None, help="earlier results file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown before a stage is flagged")
+    parser.add_argument('--count-tolerance', type=float, default=0.05,
+                        help="allowed relative cell count error on scenes whose cells are all apart")
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes, args.cells, args.overlap, args.noise, args.repeats, args.seed,
+                        not args.no_memory)
+    with open(args.output, 'w') as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Results written to {args.output}")
+
+    failures = count_errors(results, args.count_tolerance)
+    for failure in failures:
+        print(f"COUNT ERROR: {failure}")
+    if args.compare:
+        with open(args.compare) as handle:
+            problems = compare(results, json.load(handle), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        print(f"{len(problems)} regression(s) against {args.compare}")
+        failures += problems
+    sys.exit(1 if failures else 0)
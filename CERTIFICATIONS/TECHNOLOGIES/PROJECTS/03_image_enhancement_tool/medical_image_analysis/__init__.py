@@ -0,0 +1,43 @@
+# Blood smear analysis library shared by the three portfolio projects.
+# Importing the package loads nothing heavy: the names below are imported from their modules on first
+# access, and the modules themselves need only OpenCV and NumPy until a figure, file dialog, tiled stitch,
+# FFT template match or watershed flood actually runs.
+import importlib
+
+_EXPORTS = {
+    'medical_image_analyzer': 'analyzer',
+    'collect_image_paths': 'analyzer',
+    'DEFAULT_PARAMS': 'analyzer',
+    'contour_analysis': 'contours',
+    'StageGraph': 'stage_graph',
+    'common_stages': 'stage_graph',
+    'COMMON_PARAMS': 'stage_graph',
+    'ImageLoader': 'loader',
+    'TemplateBank': 'template_bank',
+    'StageMetrics': 'metrics',
+    'ResultCache': 'result_cache',
+    'ResultStore': 'result_store',
+    'IntensityStats': 'intensity_stats',
+    'collect_intensity_stats': 'intensity_stats',
+    'ReportSink': 'report_sink',
+    'DatasetAggregate': 'report_sink',
+    'CellRule': 'classification',
+    'ClassificationPolicy': 'classification',
+    'rescore_report': 'classification',
+    'TriagePolicy': 'triage',
+    'VideoStream': 'video_stream',
+    'AnalysisService': 'analysis_service',
+    'serve': 'analysis_service',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{_EXPORTS[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,320 @@
+# Local HTTP analysis service.
+# One long-running process keeps a pool of worker processes whose analyzers are built, and whose OpenCV,
+# scikit-image and SciPy code paths are warmed up on a synthetic smear, before the first request arrives.
+# Requests wait in a bounded queue (full queue: 503 with Retry-After, so clients back off instead of piling
+# up; a list of paths is queued whole or not at all); a dispatcher thread groups whatever arrives within a few
+# milliseconds into one batch per worker call.
+#   POST /analyze   raw image bytes, or JSON {"path": ...} / {"paths": [...]}; ?features=0 leaves out the table
+#   GET  /metrics   queue depth, batches, request counts and latency percentiles, plus the workers' stage metrics
+#                   when the analyzer records them (--metrics)
+#   GET  /health
+import json
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from .metrics import HISTOGRAM_EDGES
+
+# per worker process: the analyzer every batch runs on
+_service_analyzer = None
+
+def _warm_up_image():
+    # a small synthetic smear, enough to take every stage through its first (slow) call
+    image = np.full((128, 128, 3), 220, np.uint8)
+    for center in ((30, 30), (80, 40), (60, 90), (100, 100)):
+        cv2.circle(image, center, 12, (120, 60, 150), -1)
+    return image
+
+def _init_service_worker(analyzer_type, analyzer_config):
+    global _service_analyzer
+    cv2.setNumThreads(1)
+    _service_analyzer = analyzer_type.from_worker_config(analyzer_config)
+    _service_analyzer.analyze_single_image('warm-up', intermediates=False, image=_warm_up_image())
+    # the warm-up is not a request, its stage records are dropped
+    _service_analyzer.metrics.drain()
+
+def _warm_up():
+    # runs in a worker, so the pool has started and initialized it; held briefly so that every worker,
+    # not one quick worker, takes one of these
+    time.sleep(0.2)
+    return os.getpid()
+
+def _json_column(values):
+    # a feature column as a JSON list; NaN (the columns triage leaves unmeasured) and inf become null
+    return [None if isinstance(value, float) and not math.isfinite(value) else value
+            for value in np.asarray(values).tolist()]
+
+def result_json(result, features=True):
+    # JSON-ready counts (and feature columns) of one analysis result
+    rate = (result['abnormal_cells'] / result['cell_count'] * 100) if result['cell_count'] > 0 else 0
+    response = {
+        'cell_count': int(result['cell_count']),
+        'normal_cells': int(result['normal_cells']),
+        'abnormal_cells': int(result['abnormal_cells']),
+        'abnormality_rate': rate,
+        'template_matching_results': {name: int(count)
+                                      for name, count in result['template_matching_results'].items()},
+    }
+    if 'triage' in result:
+        response['uncertain_cells'] = int(result.get('uncertain_cells', 0))
+        response['triage'] = result['triage']
+    if features:
+        response['features'] = {name: _json_column(values) for name, values in result['features'].items()}
+    return response
+
+def _analyze_batch(items, features):
+    # items: (name, encoded bytes or None, path or None); returns (response, HTTP status, compute seconds) per
+    # item, and the stage metrics recorded meanwhile, which travel back to the parent like a batch worker's
+    responses = []
+    for name, data, path in items:
+        start = time.perf_counter()
+        try:
+            data = np.frombuffer(data, np.uint8) if data is not None else None
+            result = _service_analyzer.analyze_single_image(path or name, intermediates=False, data=data)
+            # an image that cannot be read or decoded is the client's error, not the service's
+            response, status = (result_json(result, features), 200) if result else ({'error': 'LOADING FAILED'}, 422)
+        except Exception as error:
+            response, status = {'error': str(error)}, 500
+        responses.append((response, status, time.perf_counter() - start))
+    return responses, _service_analyzer.metrics.drain()
+
+class _LatencyHistogram:
+    # fixed-size histogram over HISTOGRAM_EDGES (seconds), like the stage latencies in metrics.py
+    def __init__(self):
+        self.counts = np.zeros(len(HISTOGRAM_EDGES) + 1, np.int64)
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[np.searchsorted(HISTOGRAM_EDGES, seconds)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def summary(self):
+        cumulative = np.cumsum(self.counts)
+        count = int(cumulative[-1])
+
+        def percentile(q):
+            position = int(np.searchsorted(cumulative, q / 100 * count))
+            return min(float(HISTOGRAM_EDGES[min(position, len(HISTOGRAM_EDGES) - 1)]), self.max) * 1000
+
+        return {'count': count, 'mean_ms': self.total / count * 1000 if count else 0.0,
+                'p50_ms': percentile(50) if count else 0.0, 'p95_ms': percentile(95) if count else 0.0,
+                'max_ms': self.max * 1000}
+
+class _Request:
+    __slots__ = ('item', 'features', 'received', 'dispatched', 'done', 'response', 'status', 'compute')
+
+    def __init__(self, item, features):
+        self.item = item
+        self.features = features
+        self.received = time.perf_counter()
+        self.dispatched = None
+        self.done = threading.Event()
+        self.response = None
+        self.status = None
+        self.compute = 0.0
+
+class AnalysisService:
+    def __init__(self, analyzer, workers=None, max_queue=64, batch_size=8, batch_wait=0.005):
+        # batch_size / batch_wait: at most this many requests, collected for at most this many seconds after
+        # the first one, go to a worker together; at most two batches per worker are in flight
+        self.analyzer = analyzer
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.requests = queue.Queue(max_queue)
+        # held while a request's items are queued, so they are queued all together or not at all
+        self.submitting = threading.Lock()
+        self.in_flight = threading.BoundedSemaphore(2 * self.workers)
+        self.lock = threading.Lock()
+        self.counters = {'received': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'batches': 0}
+        self.latency = {name: _LatencyHistogram() for name in ('queue', 'compute', 'total')}
+        self.pool = None
+        self.started = None
+
+    def start(self):
+        # starts and warms every worker, then the dispatcher
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_service_worker,
+                                        initargs=(type(self.analyzer), self.analyzer.worker_config()))
+        start = time.perf_counter()
+        warmed = {future.result() for future in [self.pool.submit(_warm_up) for _ in range(self.workers)]}
+        print(f"{len(warmed)} worker(s) warmed up in {time.perf_counter() - start:.1f} s")
+        threading.Thread(target=self._dispatch, daemon=True).start()
+        self.started = time.time()
+
+    def submit(self, items, features=True):
+        # queues one request per item, None (and nothing queued) when the queue has no room for all of them;
+        # only submitters put and the dispatcher only takes, so room found under the lock is still there
+        with self.submitting:
+            if self.requests.maxsize - self.requests.qsize() < len(items):
+                with self.lock:
+                    self.counters['rejected'] += len(items)
+                return None
+            requests = [_Request(item, features) for item in items]
+            for request in requests:
+                self.requests.put_nowait(request)
+        with self.lock:
+            self.counters['received'] += len(requests)
+        return requests
+
+    def _dispatch(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.requests.get(timeout=max(0.0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+            # one feature setting per worker call; requests asking otherwise go in their own call
+            for features in {request.features for request in batch}:
+                group = [request for request in batch if request.features == features]
+                self.in_flight.acquire()
+                now = time.perf_counter()
+                for request in group:
+                    request.dispatched = now
+                future = self.pool.submit(_analyze_batch, [request.item for request in group], features)
+                future.add_done_callback(lambda future, group=group: self._finish(group, future))
+                with self.lock:
+                    self.counters['batches'] += 1
+
+    def _finish(self, group, future):
+        self.in_flight.release()
+        try:
+            responses, records = future.result()
+        except Exception as error:
+            responses, records = [({'error': str(error)}, 500, 0.0)] * len(group), []
+        now = time.perf_counter()
+        with self.lock:
+            self.analyzer.metrics.merge(records)
+            for request, (response, status, compute) in zip(group, responses):
+                request.response, request.status, request.compute = response, status, compute
+                self.counters['failed' if 'error' in response else 'completed'] += 1
+                self.latency['queue'].add(request.dispatched - request.received)
+                self.latency['compute'].add(compute)
+                self.latency['total'].add(now - request.received)
+        for request in group:
+            request.done.set()
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'uptime_s': time.time() - self.started if self.started else 0.0,
+                'workers': self.workers,
+                'queue_depth': self.requests.qsize(),
+                'queue_capacity': self.requests.maxsize,
+                **self.counters,
+                'latency': {name: histogram.summary() for name, histogram in self.latency.items()},
+                **({'stages': self.analyzer.metrics.summary()} if self.analyzer.metrics.enabled else {}),
+            }
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(cancel_futures=True)
+
+def _handler(service, timeout):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body, headers=()):
+            # strict JSON: a NaN or inf that slipped through is an error here, not unparseable output for the client
+            data = json.dumps(body, allow_nan=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/health':
+                self._send(200, {'status': 'ok'})
+            elif path == '/metrics':
+                self._send(200, service.metrics())
+            else:
+                self._send(404, {'error': f"unknown endpoint {path}"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/analyze':
+                self._send(404, {'error': f"unknown endpoint {url.path}"})
+                return
+            features = parse_qs(url.query).get('features', ['1'])[0] not in ('0', 'false', 'no')
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                try:
+                    request = json.loads(body)
+                except ValueError as error:
+                    self._send(400, {'error': f"invalid JSON: {error}"})
+                    return
+                many = isinstance(request, dict) and 'paths' in request
+                paths = request['paths'] if many else [request.get('path') if isinstance(request, dict) else None]
+                if not isinstance(paths, list) or not paths or not all(isinstance(path, str) for path in paths):
+                    self._send(400, {'error': "expected {\"path\": ...} or {\"paths\": [...]} "
+                                              "with at least one path"})
+                    return
+                if len(paths) > service.requests.maxsize:
+                    self._send(413, {'error': f"{len(paths)} paths, the service queues at most "
+                                              f"{service.requests.maxsize}"})
+                    return
+                items = [(path, None, path) for path in paths]
+            elif body:
+                items, many = [(self.headers.get('X-Image-Name', 'upload'), body, None)], False
+            else:
+                self._send(400, {'error': "empty request"})
+                return
+
+            requests = service.submit(items, features)
+            if requests is None:
+                self._send(503, {'error': "service busy, retry later", 'queue_depth': service.requests.qsize()},
+                           [('Retry-After', '1')])
+                return
+            results = []
+            for (name, _, _), request in zip(items, requests):
+                if not request.done.wait(timeout):
+                    self._send(504, {'error': f"no result for {name} within {timeout} s"})
+                    return
+                results.append({'image': name, **request.response,
+                                'timing_ms': {'queue': (request.dispatched - request.received) * 1000,
+                                              'compute': request.compute * 1000}})
+            # a list carries each image's status; the response's is the worst of them
+            if many:
+                for result, request in zip(results, requests):
+                    result['status'] = request.status
+            self._send(max(request.status for request in requests), results if many else results[0])
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+class _Server(ThreadingHTTPServer):
+    # bursts of clients wait in the listen backlog until the bounded request queue turns them away with 503,
+    # rather than having their connections reset
+    request_queue_size = 256
+    daemon_threads = True
+
+def serve(analyzer, host='127.0.0.1', port=8765, workers=None, max_queue=64, batch_size=8, batch_wait=0.005,
+          timeout=120):
+    # runs until interrupted
+    service = AnalysisService(analyzer, workers, max_queue, batch_size, batch_wait)
+    service.start()
+    server = _Server((host, port), _handler(service, timeout))
+    print(f"Analysis service listening on http://{host}:{port} (POST /analyze, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return service
@@ -0,0 +1,863 @@
+# The analyzer: segmentation, features, template matching, batch / tiled / sweep / stream drivers and reports.
+# Only OpenCV and NumPy are loaded with it; Matplotlib (figures), tkinter (file dialog) and scikit-image
+# (watershed flooding, rarely needed) are imported by the methods that use them, on first use.
+import csv
+import glob
+import hashlib
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from itertools import islice
+
+import cv2
+import numpy as np
+
+from .classification import ClassificationPolicy, rescore_report
+from .features import build_feature_table, feature_records, label_moments, label_perimeters
+from .loader import ImageLoader
+from .metrics import NO_METRICS, StageMetrics
+from .report_sink import DatasetAggregate, abnormality_rate
+from .result_cache import ResultCache, data_digest, fingerprint
+from .result_store import ResultStore
+from .stage_graph import COMMON_PARAMS, COMMON_STAGE_PARAMS, StageGraph, common_stages, stage_keys
+from .sweep import grid_configs, parameter_sweep, random_configs, summarize_sweep
+from .template_bank import TemplateBank
+from .tiling import tiled_analysis
+from .triage import TriagePolicy, estimate_table
+from .video_stream import VideoStream
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.jfif', '.png')
+
+# every tunable of the segmentation and classification stages
+DEFAULT_PARAMS = {
+    'adaptive_block_size': 11,
+    'adaptive_c': 2,
+    'morph_kernel_size': 3,
+    'sure_fg_ratio': 0.5,
+    'min_cell_area': 50,
+    'normal_min_circularity': 0.7,
+    'normal_min_area': 50,
+    'normal_max_area': 1000,
+}
+
+# parameters each cached stage depends on, those of upstream stages included; the cache keeps the measurements,
+# not the Diagnosis, so they stay valid whatever the classification policy
+STAGE_PARAMS = {
+    'segmentation': ('adaptive_block_size', 'adaptive_c', 'morph_kernel_size', 'sure_fg_ratio'),
+    'measurements': ('adaptive_block_size', 'adaptive_c', 'morph_kernel_size', 'sure_fg_ratio', 'min_cell_area'),
+}
+
+# parameters each stage of the analyzer's stage graph reads itself (see stage_graph.stage_keys)
+GRAPH_STAGE_PARAMS = {
+    **COMMON_STAGE_PARAMS,
+    'cleaned': ('morph_kernel_size',),
+    'markers': ('sure_fg_ratio',),
+    'measurements': ('min_cell_area',),
+    'features': ('normal_min_circularity', 'normal_min_area', 'normal_max_area'),
+}
+
+def collect_image_paths(inputs, recursive=False):
+    # expand files, directories and glob patterns into a de-duplicated list of image paths
+    image_paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, '**', '*') if recursive else os.path.join(item, '*')
+            candidates = [p for p in glob.glob(pattern, recursive=recursive)
+                          if p.lower().endswith(IMAGE_EXTENSIONS)]
+        else:
+            candidates = glob.glob(item, recursive=recursive) or [item]
+        image_paths.extend(sorted(p for p in candidates if not os.path.isdir(p)))
+    return list(dict.fromkeys(image_paths))
+
+def figure_path(output_dir, image_name):
+    # <output_dir>/<image>_<hash>_analysis.png; the hash of the full path keeps img1.jpg and img1.png, or equal
+    # names from different folders, from writing the same figure (as in ResultStore.spill_path)
+    digest = hashlib.sha1(os.path.abspath(image_name).encode('utf-8')).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(image_name))[0]
+    return os.path.join(output_dir, f"{name}_{digest}_analysis.png")
+
+# each worker process keeps its own analyzer for the whole batch
+_worker_analyzer = None
+
+def _init_batch_worker(analyzer_config):
+    global _worker_analyzer
+    # one OpenCV thread per process so the pool, not OpenCV, spreads work over the cores
+    cv2.setNumThreads(1)
+    _worker_analyzer = medical_image_analyzer.from_worker_config(analyzer_config)
+
+def _analyze_in_worker(image_path, render_dir=None, data=None):
+    # data: the file bytes, already read by the parent's prefetching loader;
+    # render and slim/spill where the arrays already live instead of shipping them back first,
+    # stage metrics recorded here travel back with the result
+    result = _worker_analyzer.analyze_single_image(image_path, intermediates=True if render_dir else None, data=data)
+    return _worker_analyzer.finish_result(image_path, result, render_dir), _worker_analyzer.metrics.drain()
+
+def _render_in_worker(record, image_name, output_dir):
+    return _worker_analyzer.render_results(_worker_analyzer.store.load(image_name, record), image_name, output_dir)
+
+class medical_image_analyzer:
+    def __init__(self, template_bank=None, store=None, params=None, cache=None, metrics=None, extra_stages=(),
+                 loader=None, sink=None, triage=None, policy=None):
+        self.results = {}
+        # templates are built once per analyzer, not on every template_match call
+        self.template_bank = template_bank or TemplateBank()
+        # decides how much of each result stays in self.results (see result_store.py)
+        self.store = store or ResultStore()
+        # the shared stages' parameters (CLAHE, Canny, contour filters) are tunable through params as well
+        self.params = {**COMMON_PARAMS, **DEFAULT_PARAMS, **(params or {})}
+        # optional on-disk cache of stage results (see result_cache.py)
+        self.cache = cache
+        # per-stage timings and sizes (see metrics.py), no-ops unless a StageMetrics is given
+        self.metrics = metrics or NO_METRICS
+        # stages computed for every image (see stage_graph.py) and stored in its result under their names
+        self.extra_stages = tuple(extra_stages)
+        self.stages = self.stage_table()
+        # reads and decodes images, ahead of the analysis in batch runs (see loader.py)
+        self.loader = loader or ImageLoader()
+        # optional streaming report output (see report_sink.py); batch results then go to its files and
+        # aggregate instead of staying in self.results
+        self.sink = sink
+        # optional TriagePolicy (see triage.py): results without intermediates settle their verdicts from the
+        # segmentation where they can, the others escalate to the full analysis
+        self.triage = triage
+        # Normal/Abnormal rule and patient thresholds (see classification.py), applied to the measured features
+        self.policy = policy or ClassificationPolicy()
+
+    def worker_config(self):
+        # everything a worker process needs to rebuild an equivalent analyzer
+        return {'template_bank': self.template_bank, 'store': self.store.config(), 'params': self.params,
+                'cache': self.cache.config() if self.cache else None, 'metrics': self.metrics.config(),
+                'extra_stages': self.extra_stages, 'loader': self.loader.config(),
+                'triage': self.triage.config() if self.triage else None, 'policy': self.policy}
+
+    @classmethod
+    def from_worker_config(cls, config):
+        return cls(template_bank=config['template_bank'], store=ResultStore(*config['store']),
+                   params=config['params'], cache=ResultCache(*config['cache']) if config['cache'] else None,
+                   metrics=StageMetrics.from_config(config['metrics']), extra_stages=config['extra_stages'],
+                   loader=ImageLoader(*config['loader']),
+                   triage=TriagePolicy(*config['triage']) if config.get('triage') else None,
+                   policy=config.get('policy'))
+
+    def select_images(self):
+        import tkinter as tk
+        from tkinter import filedialog
+        root = tk.Tk()
+        root.withdraw()
+        print("Select images")
+
+        image_paths = filedialog.askopenfilenames(
+            title="SELECT IMAGES",
+            filetypes=[
+                ("IMAGES", "*.jpg *.jpeg *.jfif *.png"),
+                ("All files", "*.*")
+            ]
+        )
+        return list(image_paths)
+    
+    def adaptive_threshold(self, gray):
+        binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                       self.params['adaptive_block_size'], self.params['adaptive_c'])
+        return binary
+    
+    def morphological_op(self, binary_image):
+        # Ensure input is uint8
+        if binary_image.dtype != np.uint8:
+            binary_image = np.uint8(binary_image)
+        
+        kernel_size = self.params['morph_kernel_size']
+        kernel = np.ones((kernel_size, kernel_size), np.uint8)
+        opened = cv2.morphologyEx(binary_image, cv2.MORPH_OPEN, kernel)
+        closed = cv2.morphologyEx(opened, cv2.MORPH_CLOSE, kernel)
+        
+        # Ensure output is binary (0 and 255)
+        _, closed = cv2.threshold(closed, 127, 255, cv2.THRESH_BINARY)
+        return closed
+    
+    def distance_map(self, cleaned_image):
+        # Ensure the image is binary and of the correct type
+        if len(cleaned_image.shape) > 2:
+            cleaned_image = cv2.cvtColor(cleaned_image, cv2.COLOR_BGR2GRAY)
+        
+        # Make sure the image is binary (0 and 255)
+        _, binary = cv2.threshold(cleaned_image, 127, 255, cv2.THRESH_BINARY)
+        
+        # Calculate distance transform
+        distance_transform = cv2.distanceTransform(binary, cv2.DIST_L2, 5)
+        return binary, distance_transform
+
+    def watershed_segmentation(self, cleaned_image, sure_fg_threshold=None, distance=None):
+        # sure_fg_threshold replaces sure_fg_ratio * max distance, e.g. with a slide-wide value when processing tiles;
+        # distance: distance_map(cleaned_image) when it is already computed
+        binary, distance_transform = distance if distance is not None else self.distance_map(cleaned_image)
+        
+        # Find sure foreground
+        if sure_fg_threshold is None:
+            sure_fg_threshold = self.params['sure_fg_ratio'] * distance_transform.max()
+        _, sure_fg = cv2.threshold(distance_transform, sure_fg_threshold, 255, 0)
+        sure_fg = np.uint8(sure_fg)
+
+        # Find connected components
+        _, markers = cv2.connectedComponents(sure_fg)
+
+        # Add 1 to all markers so that background is 1, not 0 (in place, markers stay int32)
+        markers += 1
+
+        # Mark the background region (where binary image is 0) as 0
+        markers[binary == 0] = 0
+
+        # Apply watershed blob by blob: flooding never crosses from one 4-connected foreground component
+        # to another, so only blobs with unlabelled pixels are flooded, each within its bounding box
+        n_blobs, blobs, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=4)
+        unlabelled = np.bincount(blobs[(markers == 0) & (binary > 0)], minlength=n_blobs)
+        crops = []
+        for blob in np.flatnonzero(unlabelled[1:]) + 1:
+            col, row, width, height = stats[blob, :4]
+            window = np.s_[row:row + height, col:col + width]
+            mask = blobs[window] == blob
+            labels = np.unique(markers[window][mask])
+            labels = labels[labels > 0]
+            if len(labels) == 1:
+                # a single marker floods the whole blob
+                markers[window][mask] = labels[0]
+            elif len(labels) > 1:
+                crops.append((window, mask))
+
+        def flood(crop):
+            from skimage import segmentation
+            window, mask = crop
+            return segmentation.watershed(-distance_transform[window], np.where(mask, markers[window], 0), mask=mask)
+
+        # touching cells: crops flooded in parallel, on as many threads as OpenCV may use in this process
+        threads = min(len(crops), cv2.getNumThreads())
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                flooded = list(pool.map(flood, crops))
+        else:
+            flooded = [flood(crop) for crop in crops]
+        for (window, mask), labels in zip(crops, flooded):
+            markers[window][mask] = labels[mask]
+
+        return markers, distance_transform
+
+    def carry_track_ids(self, markers, previous_markers=None, previous_ids=None):
+        # stable IDs for the cells of a video frame: ids[label] is the ID of that label of markers. A cell (label
+        # above 1) takes the ID of the previous frame's cell it overlaps most, new or split cells take IDs above
+        # any used before. markers keep their compact 1..n labels, so per-label arrays stay the size of the frame's
+        # cell count however long the stream runs; only the IDs grow
+        n_labels = max(int(markers.max()), 1) + 1
+        if previous_markers is None or previous_markers.shape != markers.shape:
+            return np.arange(n_labels, dtype=np.int64)
+        overlap = (markers > 1) & (previous_markers > 1)
+        current, previous = markers[overlap].astype(np.int64), previous_markers[overlap].astype(np.int64)
+        base = max(int(previous_markers.max()), 1) + 1
+        pairs, counts = np.unique(current * base + previous, return_counts=True)
+
+        ids = np.arange(n_labels, dtype=np.int64)
+        assigned, taken = np.zeros(n_labels, bool), set()
+        assigned[:2] = True
+        for index in np.argsort(-counts, kind='stable'):
+            label, cell = divmod(int(pairs[index]), base)
+            if not assigned[label] and cell not in taken:
+                ids[label], assigned[label] = previous_ids[cell], True
+                taken.add(cell)
+        unassigned = np.flatnonzero(~assigned)
+        ids[unassigned] = max(int(previous_ids.max()), 1) + 1 + np.arange(len(unassigned))
+        return ids
+
+    def label_count(self, markers):
+        # distinct labels, background excluded
+        return int(np.count_nonzero(np.bincount(np.clip(markers, 0, None).ravel()))) - 1
+
+    def feature_table(self, markers, original_gray=None):
+        # columnar measurements of every label at once: dict of equal-length numpy arrays, no Diagnosis yet
+        markers = np.asarray(markers)
+        if markers.dtype.kind != 'i' or markers.min(initial=0) < 0:
+            markers = np.clip(markers, 0, None).astype(np.int64)
+        areas = np.bincount(markers.ravel())
+        perimeters = label_perimeters(markers, len(areas))
+        centroid_rows, centroid_cols, eccentricities = label_moments(markers, areas)
+        intensity_sums = (np.bincount(markers.ravel(), weights=original_gray.ravel(), minlength=len(areas))
+                          if original_gray is not None else None)
+        return build_feature_table(areas, perimeters, centroid_rows, centroid_cols, eccentricities, self.params,
+                                   intensity_sums)
+
+    def classify_cells(self, table):
+        # the classification stage: Diagnosis from this analyzer's policy
+        return self.policy.classify(table, self.params)
+
+    def feature_extraction(self, markers, original_gray):
+        return feature_records(self.classify_cells(self.feature_table(markers, original_gray)))
+
+    def template_match(self, gray_image):
+        # one count per matched cell (after non-maximum suppression), not per pixel above the threshold
+        return self.template_bank.match(gray_image)
+
+    def stage_table(self):
+        # the shared stages plus this analyzer's segmentation, feature and template stages
+        return {
+            **common_stages(self.params),
+            'adaptive': (('gray',), self.adaptive_threshold),
+            'cleaned': (('adaptive',), self.morphological_op),
+            'distance': (('cleaned',), self.distance_map),
+            'dist_transform': (('distance',), lambda distance: distance[1]),
+            'markers': (('cleaned', 'distance'),
+                        lambda cleaned, distance: self.watershed_segmentation(cleaned, distance=distance)[0]),
+            'watershed_count': (('markers',), self.label_count),
+            'measurements': (('markers', 'gray'), self.feature_table),
+            'features': (('measurements',), self.classify_cells),
+            'templates': (('gray',), self.template_match),
+        }
+
+    def stage_graph(self, image, image_name=None, shared=None, **values):
+        # shared: results of the same image under other parameters, reused where this analyzer's inputs match
+        keys = stage_keys(self.stages, GRAPH_STAGE_PARAMS, self.params) if shared is not None else None
+        return StageGraph(self.stages, image_name, self.metrics, shared, keys, image=image, **values)
+
+    def stage_fingerprints(self, gray=False):
+        # gray: the image is decoded straight to grayscale. Every stage is downstream of the read, whose decode
+        # settings change the pixels (a grayscale PNG decode may differ by one grey level, a reduced decode is
+        # smaller), so they are part of every fingerprint
+        read = {'gray_decode': gray, 'reduction': self.loader.reduction}
+        fingerprints = {stage: fingerprint({**read, **{name: self.params[name] for name in names}})
+                        for stage, names in STAGE_PARAMS.items()}
+        fingerprints['templates'] = fingerprint({**read, **self.template_bank.settings})
+        return fingerprints
+
+    def analyze_single_image(self, image_path, intermediates=None, data=None, image=None):
+        # intermediates: keep the full-size images in the result (default: unless retention is slim);
+        # data / image: the file bytes and decoded image when a prefetching loader already has them
+        print(f"INITIALIZING ANALYSIS: {os.path.basename(image_path)}")
+        if intermediates is None:
+            intermediates = self.store.retention != 'slim'
+        # the colour image is only needed for the intermediates
+        gray = self.loader.gray_decode and not intermediates
+
+        if data is None and image is None:
+            with self.metrics.stage(image_path, 'read') as span:
+                data = self.loader.read(image_path)
+                if data is not None:
+                    span.output(data)
+
+        # cached stages are looked up by file content, so renamed or copied images hit as well
+        cache_keys = {}
+        summary = template_matching_results = None
+        if self.cache and data is not None:
+            with self.metrics.stage(image_path, 'cache_lookup'):
+                image_digest = data_digest(data)
+                cache_keys = {stage: self.cache.key(image_digest, stage, stage_fingerprint)
+                              for stage, stage_fingerprint in self.stage_fingerprints(gray).items()}
+                summary = self.cache.get(cache_keys['measurements'])
+                template_matching_results = self.cache.get(cache_keys['templates'])
+            if (summary is not None and template_matching_results is not None and not intermediates
+                    and not self.extra_stages):
+                print("Cached result reused")
+                return self._assemble_result(self._classified(summary), template_matching_results)
+
+        img = image
+        if img is None:
+            with self.metrics.stage(image_path, 'decode') as span:
+                img = self.loader.decode(data, gray=gray)
+                if img is not None:
+                    span.output(img)
+        if img is None:
+            print(f"LOADING FAILED: {image_path}")
+            return None
+
+        # every intermediate below is computed at most once, on first use
+        graph = self.stage_graph(img, image_path)
+        if intermediates or summary is None:
+            stages = self.cache.get(cache_keys['segmentation']) if cache_keys else None
+            if stages is not None:
+                graph.update(**stages)
+            elif cache_keys:
+                self.cache.put(cache_keys['segmentation'],
+                               {key: graph[key] for key in ('adaptive', 'cleaned', 'markers')})
+
+        triage = None
+        if self.triage and summary is None and not intermediates:
+            cell_count = graph['watershed_count']
+            with self.metrics.stage(image_path, 'triage'):
+                table = estimate_table(graph['markers'], self.params, self.policy.rule.area_decides)
+                uncertain = int(np.count_nonzero(table['Diagnosis'] == 'Uncertain'))
+                triage = self.triage.assess(cell_count, len(table['Diagnosis']) - uncertain, uncertain)
+            low, high = triage['abnormality_range']
+            if not triage['escalated']:
+                print(f"Triage: settled at {low:.1f}-{high:.1f}% abnormal")
+                result = self._assemble_result({'features': table, 'cell_count': cell_count}, {})
+                result.update({stage: graph[stage] for stage in self.extra_stages})
+                result.update({'uncertain_cells': uncertain, 'triage': triage})
+                return result
+            print(f"Triage: escalated to the full analysis, {triage['reason']}")
+
+        if summary is None:
+            summary = {'features': graph['measurements'], 'cell_count': graph['watershed_count']}
+            if cache_keys:
+                self.cache.put(cache_keys['measurements'], summary)
+        if template_matching_results is None:
+            template_matching_results = graph['templates']
+            if cache_keys:
+                self.cache.put(cache_keys['templates'], template_matching_results)
+
+        result = self._assemble_result(self._classified(summary), template_matching_results)
+        result.update({stage: graph[stage] for stage in self.extra_stages})
+        if triage:
+            result['triage'] = triage
+        if intermediates:
+            result.update({'image': img, 'grayCell': graph['gray'],
+                           **{key: graph[key] for key in ('adaptive', 'cleaned', 'markers', 'dist_transform')}})
+        return result
+
+    def _classified(self, summary):
+        return {**summary, 'features': self.classify_cells(summary['features'])}
+
+    def _assemble_result(self, summary, template_matching_results):
+        features = summary['features']
+        return {
+            'features': features,
+            'template_matching_results': template_matching_results,
+            'cell_count': summary['cell_count'],
+            'normal_cells': int(np.count_nonzero(features['Diagnosis'] == 'Normal')),
+            'abnormal_cells': int(np.count_nonzero(features['Diagnosis'] == 'Abnormal'))
+        }
+
+    def draw_results(self, fig, result, image_name):
+        # draws the 12-panel report onto fig; every label-coloured map comes from one lookup over markers
+        features = result['features']
+        markers = result['markers']
+        axes = [fig.add_subplot(3, 4, i) for i in range(1, 13)]
+
+        # Row 1: basic processing
+        axes[0].imshow(cv2.cvtColor(result['image'], cv2.COLOR_BGR2RGB))
+        axes[0].set_title(f"Original: {os.path.basename(image_name)}", fontweight='bold', fontsize=10)
+        axes[0].axis('off')
+
+        axes[1].imshow(result['adaptive'], cmap='gray')
+        axes[1].set_title("Adaptive Thresholding", fontweight='bold', fontsize=10)
+        axes[1].axis('off')
+
+        axes[2].imshow(result['cleaned'], cmap='gray')
+        axes[2].set_title("Morphological cleaning", fontweight='bold', fontsize=10)
+        axes[2].axis('off')
+
+        axes[3].imshow(result['dist_transform'], cmap='hot')
+        axes[3].set_title("Distance transform", fontweight='bold', fontsize=10)
+        axes[3].axis('off')
+
+        # Row 2 Advanced analysis.
+        watershed_viz = result['image'].copy()
+        watershed_viz[markers == -1] = [255, 0, 0]
+        axes[4].imshow(cv2.cvtColor(watershed_viz, cv2.COLOR_BGR2RGB))
+        axes[4].set_title("Watershed segmentation(Red boundaries)", fontweight='bold', fontsize=12)
+        axes[4].axis('off')
+
+        # feature visualization area
+        area_lut = np.zeros(max(int(markers.max()), 0) + 1)
+        area_lut[features['Label']] = features['Area']
+        area_map = axes[5].imshow(area_lut[np.clip(markers, 0, None)], cmap='viridis')
+        axes[5].set_title("Feature Map: Cell Area", fontweight='bold', fontsize=12)
+        fig.colorbar(area_map, ax=axes[5])
+        axes[5].axis('off')
+
+        has_cells = len(features['Cell_ID']) > 0
+        # circularity histogram
+        if has_cells:
+            axes[6].hist(features['Circularity'], bins=15, alpha=0.7, color='green')
+            axes[6].set_title("Circularity Distribution", fontweight='bold', fontsize=12)
+            axes[6].set_xlabel("Circularity")
+            axes[6].set_ylabel("Frequency")
+            # the threshold line only means something under the default rule
+            if self.policy.rule.area_decides:
+                axes[6].axvline(self.params['normal_min_circularity'], color='red', linestyle='--',
+                                label='Normal threshold')
+                axes[6].legend()
+
+        # template matching results
+        template_names = list(result['template_matching_results'].keys())
+        template_counts = list(result['template_matching_results'].values())
+        axes[7].bar(template_names, template_counts, color=['green', 'red'])
+        axes[7].set_title("Template Matching results", fontweight='bold', fontsize=12)
+        axes[7].tick_params(axis='x', rotation=45)
+        axes[7].set_ylabel("Detections")
+
+        # Row 3 summary and diagnostics
+        diagnostic_img = result['image'].copy()
+        # coloured by the cells' Diagnosis, so the overview agrees with the report whatever the classification policy
+        normal_cells = features['Diagnosis'] == 'Normal'
+        for x, y, is_normal in zip(features['Centroid_Col'].astype(int), features['Centroid_Row'].astype(int),
+                                   normal_cells):
+            cv2.circle(diagnostic_img, (int(x), int(y)), 3, (0, 255, 0) if is_normal else (255, 0, 0), -1)
+        axes[8].imshow(cv2.cvtColor(diagnostic_img, cv2.COLOR_BGR2RGB))
+        axes[8].set_title("Diagnostic Overview", fontweight='bold', fontsize=12)
+        axes[8].axis('off')
+
+        # statistics
+        if has_cells:
+            axes[9].hist(features['Area'], bins=15, alpha=0.7, color='blue', edgecolor='black')
+            axes[9].set_title("Cell Area Distribution", fontweight='bold', fontsize=12)
+            axes[9].set_xlabel("Area(pixels)")
+            axes[9].set_ylabel("Frequency")
+
+        # scatter plot
+        if has_cells:
+            colors = np.where(features['Diagnosis'] == 'Normal', 'green', 'red')
+            axes[10].scatter(features['Area'], features['Circularity'], c=colors, alpha=0.6)
+            axes[10].set_title("Areas Vs Circularity", fontweight='bold', fontsize=12)
+            axes[10].set_xlabel("Area")
+            axes[10].set_ylabel("Circularity")
+
+        # Report
+        normal_count = result['normal_cells']
+        abnormal_count = result['abnormal_cells']
+        total_cells = normal_count + abnormal_count
+        abnormality_rate = (abnormal_count / total_cells * 100) if total_cells > 0 else 0
+
+        report = axes[11]
+        report.text(0.1, 0.9, "IMAGE ANALYSIS REPORT", fontweight='bold', fontsize=14, color='blue')
+        report.text(0.1, 0.7, f"Image: {os.path.basename(image_name)}", fontsize=10)
+        report.text(0.1, 0.6, f"Total Cells: {total_cells}", fontsize=10)
+        report.text(0.1, 0.5, f"Normal Cells: {normal_count}", fontsize=10, color='green')
+        report.text(0.1, 0.4, f"Abnormal Cells: {abnormal_count}", fontsize=10, color='red')
+        report.text(0.1, 0.3, f"Abnormality Rate: {abnormality_rate:.1f}%", fontsize=10,
+                    color='red' if abnormality_rate > self.policy.moderate_threshold else 'green', fontweight='bold')
+        report.text(0.1, 0.2, f"Template Detections: {sum(result['template_matching_results'].values())}", fontsize=10)
+        report.text(0.1, 0.1, "ANALYSIS COMPLETE!", fontweight='bold', fontsize=10, color='green')
+        report.axis('off')
+
+        fig.tight_layout()
+        return fig
+
+    def analyze_tiled(self, image_path, tile_size=2048, overlap=64, workers=None, markers_path=None):
+        # whole-slide mode: tiles with overlap on a process pool, labels stitched across seams (see tiling.py);
+        # returns counts and features, the stitched label image only when markers_path is given
+        print(f"INITIALIZING TILED ANALYSIS: {os.path.basename(image_path)}")
+        try:
+            with self.metrics.stage(image_path, 'tiled_analysis'):
+                return tiled_analysis(self, image_path, tile_size, overlap, workers, markers_path)
+        except IOError as error:
+            print(error)
+            return None
+
+    def visualize_results(self, results, image_name):
+        import matplotlib.pyplot as plt
+        fig = plt.figure(figsize=(25, 15))
+        self.draw_results(fig, self.store.load(image_name, results[image_name]), image_name)
+        plt.show()
+
+    def render_results(self, result, image_name, output_dir):
+        # off-screen render to figure_path(output_dir, image_name), safe without a display and from worker threads
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=(25, 15))
+        FigureCanvasAgg(fig)
+        self.draw_results(fig, result, image_name)
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = figure_path(output_dir, image_name)
+        fig.savefig(output_path)
+        return output_path
+
+    def render_batch(self, results, output_dir, workers=None):
+        # renders every result to PNG on a process pool, returns {image_name: png_path}
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            return {name: self.render_results(self.store.load(name, record), name, output_dir)
+                    for name, record in results.items()}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(self.worker_config(),)) as pool:
+            futures = {pool.submit(_render_in_worker, record, name, output_dir): name
+                       for name, record in results.items()}
+            return {futures[future]: future.result() for future in as_completed(futures)}
+
+    def generate_report(self, results):
+        aggregate = DatasetAggregate(image_threshold=self.policy.image_threshold)
+        for image_name, result in results.items():
+            aggregate.add(image_name, result)
+        self.print_report(aggregate)
+
+    def print_report(self, aggregate, images_path=None):
+        # aggregate: a DatasetAggregate; images_path: where the per-image rows went when they were not kept
+        print("\n" + "-"*70)
+        print("IMAGE ANALYSIS REPORT")
+        print("-"*70)
+
+        percentage_abnormality = aggregate.abnormality_rate()
+
+        print("SUMMARY OF FINDINGS")
+        print(f"    > Images analyzed: {aggregate.images}")
+        print(f"    > Total Cells: {aggregate.cells}")
+        print(f"    > Normal Cells: {aggregate.normal}")
+        print(f"    > Abnormal Cells: {aggregate.abnormal}")
+        print(f"    > Percentage Abnormality: {percentage_abnormality:.1f}%")
+        # triaged results, from this run or a re-scored report, leave some cells unclassified
+        triaged = self.triage is not None or aggregate.uncertain > 0
+        if triaged:
+            low, high = aggregate.abnormality_range()
+            print(f"    > Settled by triage: {aggregate.triaged_images} of {aggregate.images} images "
+                  f"({aggregate.uncertain} cells left unclassified, abnormality {low:.1f}-{high:.1f}%)")
+
+        print(f"\n INDIVIDUAL IMAGE RESULTS")
+        if aggregate.image_rows is None:
+            print(f"    > {aggregate.flagged_images} of {aggregate.images} images need immediate attention, "
+                  f"per-image results in {images_path}")
+        else:
+            for image_name, cell_count, abnormal_cells, uncertain_cells in aggregate.image_rows:
+                rate = abnormality_rate(abnormal_cells, cell_count)
+                settled = (f" (triaged, at most {abnormality_rate(abnormal_cells + uncertain_cells, cell_count):.1f}%)"
+                           if uncertain_cells else "")
+                print(f"    > {os.path.basename(image_name)}: {cell_count} cells, "
+                      f"{rate:.1f}% abnormal{settled} - {self.policy.image_status(rate)}")
+
+        if aggregate.image_rows is None:
+            print(f"\n CELL MEASUREMENTS")
+            for name, summary in aggregate.distributions().items():
+                print(f"    > {name}: mean {summary['mean']:.2f}, std {summary['std']:.2f}, "
+                      f"median {summary['p50']:.2f} (5-95%: {summary['p5']:.2f}-{summary['p95']:.2f})")
+
+        print("RECOMMENDATION")
+        print(self.policy.recommendation(percentage_abnormality))
+        if triaged and self.policy.recommendation(high) != self.policy.recommendation(low):
+            # every image's own verdicts are settled, but the dataset's rate mixes images from both sides
+            print(f"(triaged images leave the dataset rate between {low:.1f}% and {high:.1f}%, "
+                  f"rerun without --triage for a definite recommendation)")
+        print("-"*70)
+
+    def complete_analysis(self):
+        print("ANALYSIS INITIATED...")
+
+        # selecting multiple images
+        image_paths = self.select_images()
+        if not image_paths:
+            print("Error! No images selected")
+            return
+        print(f"Selected {len(image_paths)} images for analysis")
+
+        # Analyzing each one of the images, the next ones load while a figure is open
+        loaded = self.loader.prefetch(image_paths, decode='color')
+        for i, (image_path, data, image) in enumerate(loaded):
+            print(f"\nAnalyzing..{i+1}/{len(image_paths)}: {os.path.basename(image_path)}")
+
+            result = self.analyze_single_image(image_path, intermediates=True, data=data, image=image)
+            if result:
+                # shown before the retention policy may drop the intermediate images
+                self.visualize_results({image_path: result}, image_path)
+                self.results[image_path] = self.store.retain(image_path, result)
+                print(f"{os.path.basename(image_path)} analysis complete")
+
+        # generate final summary
+        if self.results:
+            self.generate_report(self.results)
+            if self.metrics.enabled:
+                self.metrics.report()
+            print(f"Analysis complete!! Analyzed {len(self.results)} Images")
+        else:
+            print("No images were analyzed")
+
+    def finish_result(self, image_path, result, render_dir=None):
+        # optional off-screen figure, then the record the retention policy keeps
+        if result and render_dir:
+            with self.metrics.stage(image_path, 'render'):
+                result['figure_path'] = self.render_results(result, image_path, render_dir)
+        return self.store.retain(image_path, result)
+
+    def iter_batch_results(self, image_paths, workers=None, render_dir=None):
+        # yields (image_path, result) in completion order, result is None when the image failed
+        workers = workers or os.cpu_count() or 1
+        intermediates = True if render_dir else None
+        if workers == 1:
+            # the next images are read and decoded on the loader's threads while this one is analyzed;
+            # with a cache only the bytes are prefetched, since hits need no decode
+            gray = self.loader.gray_decode and not render_dir and self.store.retention == 'slim'
+            decode = None if self.cache else ('gray' if gray else 'color')
+            for image_path, data, image in self.loader.prefetch(image_paths, decode):
+                try:
+                    result = self.analyze_single_image(image_path, intermediates, data=data, image=image)
+                    yield image_path, self.finish_result(image_path, result, render_dir)
+                except Exception as error:
+                    print(f"ANALYSIS FAILED: {image_path} ({error})")
+                    yield image_path, None
+            return
+
+        # the parent reads files ahead on the loader's threads and ships the encoded bytes, workers decode;
+        # at most two images per worker are in flight, which bounds memory on large datasets
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(self.worker_config(),)) as pool:
+            loaded = self.loader.prefetch(image_paths)
+            pending = {}
+            while True:
+                for image_path, data, _ in islice(loaded, 2 * workers - len(pending)):
+                    pending[pool.submit(_analyze_in_worker, image_path, render_dir, data)] = image_path
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image_path = pending.pop(future)
+                    try:
+                        result, records = future.result()
+                        self.metrics.merge(records)
+                        yield image_path, result
+                    except Exception as error:
+                        print(f"ANALYSIS FAILED: {image_path} ({error})")
+                        yield image_path, None
+
+    def tiled_batch_analysis(self, inputs, tile_size=2048, overlap=64, workers=None, recursive=False):
+        # one slide at a time, each spread over all workers tile by tile; results go to self.sink when one is set
+        image_paths = collect_image_paths(inputs, recursive)
+        for image_path in image_paths:
+            result = self.analyze_tiled(image_path, tile_size, overlap, workers)
+            if result:
+                if self.sink:
+                    self.sink.add(image_path, result)
+                else:
+                    self.results[image_path] = result
+
+        analyzed = self.sink.aggregate.images if self.sink else len(self.results)
+        if self.sink:
+            self.sink.close()
+        if analyzed:
+            if self.sink:
+                self.print_report(self.sink.aggregate, self.sink.images_path)
+                print(f"Per-cell features written to {self.sink.cells_path}")
+            else:
+                self.generate_report(self.results)
+            if self.metrics.enabled:
+                self.metrics.report()
+        else:
+            print("No images were analyzed")
+        return self.results
+
+    def parameter_sweep(self, inputs, space, samples=None, workers=None, recursive=False, output_csv=None):
+        # runs every combination of space ({param: [values]}), or `samples` random ones, over the images;
+        # returns the per-configuration summary, per-image rows go to output_csv
+        image_paths = collect_image_paths(inputs, recursive)
+        if not image_paths:
+            print("Error! No images found")
+            return []
+        configs = random_configs(space, samples) if samples else grid_configs(space)
+        print(f"PARAMETER SWEEP: {len(configs)} configurations x {len(image_paths)} images")
+        rows = parameter_sweep(self, image_paths, configs, workers=workers)
+        summary = summarize_sweep(rows, configs)
+
+        if output_csv:
+            columns = list(dict.fromkeys(name for row in rows for name in row))
+            with open(output_csv, 'w', newline='') as handle:
+                writer = csv.DictWriter(handle, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(rows)
+            print(f"Sweep results written to {output_csv}")
+
+        print("\n" + "-"*70)
+        print("PARAMETER SWEEP SUMMARY")
+        print("-"*70)
+        for entry in summary:
+            settings = ", ".join(f"{name}={entry[name]}" for name in space)
+            print(f"    > {settings}: {entry.get('cells', 0)} cells ({entry.get('abnormal_cells', 0)} abnormal), "
+                  f"{entry.get('contour_count', 0)} contours, {entry.get('edge_count', 0)} boundaries, "
+                  f"{entry.get('seconds', 0):.2f} s" + (f", {entry['errors']} failed" if entry['errors'] else ""))
+        print("-"*70)
+        return summary
+
+    def batch_analysis(self, inputs, workers=None, recursive=False, render_dir=None):
+        # headless counterpart of complete_analysis: no dialog, images spread over a process pool,
+        # figures optionally rendered off-screen to render_dir
+        print("BATCH ANALYSIS INITIATED...")
+
+        image_paths = collect_image_paths(inputs, recursive)
+        if not image_paths:
+            print("Error! No images found")
+            return self.results
+        workers = workers or os.cpu_count() or 1
+        print(f"Found {len(image_paths)} images, analyzing on {workers} worker(s)")
+
+        results = self.iter_batch_results(image_paths, workers, render_dir)
+        for done, (image_path, result) in enumerate(results, 1):
+            if result:
+                if self.sink:
+                    self.sink.add(image_path, result)
+                else:
+                    self.results[image_path] = result
+                print(f"[{done}/{len(image_paths)}] {os.path.basename(image_path)} analysis complete")
+
+        analyzed = self.sink.aggregate.images if self.sink else len(self.results)
+        if self.sink:
+            self.sink.close()
+        if analyzed:
+            if self.sink:
+                self.print_report(self.sink.aggregate, self.sink.images_path)
+                print(f"Per-cell features written to {self.sink.cells_path}")
+            else:
+                self.generate_report(self.results)
+            if self.metrics.enabled:
+                self.metrics.report()
+            print(f"Analysis complete!! Analyzed {analyzed} Images")
+        else:
+            print("No images were analyzed")
+        return self.results
+
+    def rescore_report(self, report_dirs, chunk_rows=65536):
+        # re-classifies the per-cell tables ReportSink runs wrote to report_dirs under this analyzer's policy,
+        # without reading a single image; re-scored tables go to self.sink when one is set
+        print(f"RESCORING {len(report_dirs)} report(s) under {self.policy.rule!r}")
+        aggregate = DatasetAggregate(keep_images=self.sink is None, image_threshold=self.policy.image_threshold)
+        target = self.sink or aggregate
+        start = time.perf_counter()
+        cells = 0
+        for report_dir in report_dirs:
+            if self.sink and os.path.abspath(report_dir) == os.path.abspath(self.sink.output_dir):
+                raise ValueError(f"re-scored report would overwrite its source {report_dir}")
+            cells += rescore_report(report_dir, self.policy, self.params, target, chunk_rows,
+                                    keep_columns=self.sink is not None)
+        elapsed = time.perf_counter() - start
+        if self.sink:
+            self.sink.close()
+            aggregate = self.sink.aggregate
+        print(f"Re-classified {cells} cells of {aggregate.images} images in {elapsed:.1f} s")
+        if aggregate.images:
+            self.print_report(aggregate, self.sink.images_path if self.sink else None)
+            if self.sink:
+                print(f"Re-scored features written to {self.sink.cells_path}")
+        return aggregate
+
+    def stream_analysis(self, source, workers=2, queue_size=4, policy=None, latency_budget=None, skip=1,
+                        track=False, templates=False, pace=False, max_frames=None):
+        # analyzes a video file or capture device frame by frame (see video_stream.py), printing each frame's
+        # counts as it is done; returns the stream's frame and latency statistics, None when the source cannot
+        # be opened
+        stream = VideoStream(self, source, workers, queue_size, policy, latency_budget, skip, track, templates, pace)
+        print(f"STREAM ANALYSIS INITIATED: {source} ({stream.queue.policy}, {workers} worker(s))")
+        try:
+            frames = stream.frames()
+        except IOError as error:
+            print(error)
+            return None
+        if workers > 1 and self.metrics.enabled and self.metrics.trace_memory:
+            print("Peak memory is not traced per stage with more than one worker thread")
+        for done, result in enumerate(frames, 1):
+            if 'error' in result:
+                print(f"    > frame {result['frame']}: ANALYSIS FAILED ({result['error']})")
+            else:
+                rate = abnormality_rate(result['abnormal_cells'], result['cell_count'])
+                print(f"    > frame {result['frame']}: {result['cell_count']} cells, {rate:.1f}% abnormal "
+                      f"({result['latency'] * 1000:.0f} ms)")
+                if self.sink:
+                    self.sink.add(f"{source}#{result['frame']}", result)
+            if max_frames and done >= max_frames:
+                break
+
+        stats = stream.stats.summary()
+        if self.sink:
+            self.sink.close()
+            if self.sink.aggregate.images:
+                self.print_report(self.sink.aggregate, self.sink.images_path)
+        print("\n" + "-"*70)
+        print("STREAM STATISTICS")
+        print("-"*70)
+        print(f"    > Frames read: {stats['frames_read']}, analyzed: {stats['frames_processed']}, "
+              f"skipped: {stats['frames_skipped']}, dropped: {stats['frames_dropped']}, "
+              f"over latency budget: {stats['frames_late']}, failed: {stats['frames_failed']}")
+        print(f"    > Throughput: {stats['fps']:.1f} frames/s")
+        print(f"    > Latency: mean {stats['latency_mean_s'] * 1000:.0f} ms, p50 <= {stats['latency_p50_s'] * 1000:.0f} ms, "
+              f"p95 <= {stats['latency_p95_s'] * 1000:.0f} ms, max {stats['latency_max_s'] * 1000:.0f} ms")
+        print("-"*70)
+        if self.metrics.enabled:
+            self.metrics.report()
+        return stats
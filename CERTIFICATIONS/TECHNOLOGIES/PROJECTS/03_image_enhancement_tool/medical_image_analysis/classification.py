@@ -0,0 +1,212 @@
+# Cell and patient classification, kept apart from the measurements.
+# A CellRule decides which cells of a feature table are Normal with vectorized comparisons over its columns;
+# a ClassificationPolicy pairs one with the patient thresholds of the report. The analyzer applies its policy to
+# every table it measures, and rescore_report applies any policy to the per-cell tables a ReportSink persisted,
+# so a policy change re-scores a whole archive without segmenting a single image again.
+import ast
+from functools import reduce
+
+import numpy as np
+
+from .report_sink import image_status, read_table, recommendation, report_tables
+
+# the original rule; names are feature columns or, failing that, analyzer parameters
+DEFAULT_RULE = "Circularity > normal_min_circularity and normal_min_area < Area < normal_max_area"
+# its limits when no parameters are given
+RULE_PARAMS = {'normal_min_circularity': 0.7, 'normal_min_area': 50, 'normal_max_area': 1000}
+
+_COMPARISONS = {ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less, ast.LtE: np.less_equal,
+                ast.Eq: np.equal, ast.NotEq: np.not_equal}
+_ARITHMETIC = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide,
+               ast.Pow: np.power, ast.Mod: np.mod}
+_FUNCTIONS = {'abs': np.abs, 'sqrt': np.sqrt, 'log': np.log, 'exp': np.exp,
+              'minimum': np.minimum, 'maximum': np.maximum}
+
+# DEFAULT_RULE as parsed, to recognise it written another way
+_DEFAULT_TREE = ast.dump(ast.parse(DEFAULT_RULE, mode='eval').body)
+
+class CellRule:
+    def __init__(self, rule=None):
+        # rule: an expression such as "Circularity > 0.8 and Eccentricity < 0.6 and Mean_Intensity > 90"
+        # (and / or / not, comparisons, + - * / ** %, abs, sqrt, log, exp, minimum, maximum), or a function
+        # (table, params) -> boolean array, defined at module level so worker processes can unpickle it;
+        # None is DEFAULT_RULE
+        self.rule = DEFAULT_RULE if rule is None else rule
+        self._tree = None
+        # feature columns and parameters the rule reads, None when it is a function
+        self.names = None
+        if not callable(self.rule):
+            self._tree = ast.parse(self.rule, mode='eval').body
+            self._check(self._tree)
+            self.names = {node.id for node in ast.walk(self._tree) if isinstance(node, ast.Name)} - set(_FUNCTIONS)
+
+    def __reduce__(self):
+        return CellRule, (self.rule,)
+
+    def __repr__(self):
+        return f"CellRule({self.rule!r})"
+
+    @property
+    def area_decides(self):
+        # True when every cell outside the Normal area range is Abnormal whatever its shape (see triage.py):
+        # the rule parses to DEFAULT_RULE's expression, however it is spaced or parenthesised
+        return self._tree is not None and ast.dump(self._tree) == _DEFAULT_TREE
+
+    def _check(self, node):
+        if isinstance(node, ast.BoolOp) or (isinstance(node, ast.UnaryOp)
+                                            and isinstance(node.op, (ast.Not, ast.USub, ast.UAdd))):
+            children = node.values if isinstance(node, ast.BoolOp) else [node.operand]
+        elif isinstance(node, ast.Compare) and all(type(op) in _COMPARISONS for op in node.ops):
+            children = [node.left, *node.comparators]
+        elif isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+            children = [node.left, node.right]
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS
+              and not node.keywords):
+            children = node.args
+        elif isinstance(node, ast.Name) or (isinstance(node, ast.Constant)
+                                            and isinstance(node.value, (int, float))):
+            children = []
+        else:
+            raise ValueError(f"unsupported expression in cell rule {self.rule!r}: {ast.unparse(node)}")
+        for child in children:
+            self._check(child)
+
+    def _evaluate(self, node, table, params):
+        if isinstance(node, ast.BoolOp):
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return reduce(combine, (self._evaluate(value, table, params) for value in node.values))
+        if isinstance(node, ast.UnaryOp):
+            operand = self._evaluate(node.operand, table, params)
+            if isinstance(node.op, ast.Not):
+                return np.logical_not(operand)
+            return np.negative(operand) if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.Compare):
+            # a < b < c is (a < b) and (b < c)
+            values = [self._evaluate(value, table, params) for value in (node.left, *node.comparators)]
+            return reduce(np.logical_and, (_COMPARISONS[type(op)](left, right)
+                                           for op, left, right in zip(node.ops, values, values[1:])))
+        if isinstance(node, ast.BinOp):
+            return _ARITHMETIC[type(node.op)](self._evaluate(node.left, table, params),
+                                              self._evaluate(node.right, table, params))
+        if isinstance(node, ast.Call):
+            return _FUNCTIONS[node.func.id](*(self._evaluate(arg, table, params) for arg in node.args))
+        if isinstance(node, ast.Name):
+            if node.id in table:
+                return np.asarray(table[node.id])
+            if node.id in params:
+                return params[node.id]
+            raise ValueError(f"cell rule {self.rule!r}: {node.id!r} is neither a feature column nor a parameter")
+        return node.value
+
+    def undecided(self, table, params=None):
+        # boolean array of the rows the rule cannot judge: a column it reads (every float column for a function)
+        # is NaN, as for the cells triage measured by area alone. Under the default rule a cell outside the Normal
+        # area range is Abnormal whatever its shape, so only the unmeasured cells inside the range stay undecided
+        columns = [name for name in (table if self.names is None else self.names) if name in table]
+        rows = np.zeros(len(table['Cell_ID']), bool)
+        for name in columns:
+            values = np.asarray(table[name])
+            if values.dtype.kind == 'f':
+                rows |= np.isnan(values)
+        if self.area_decides:
+            params = {**RULE_PARAMS, **(params or {})}
+            area = np.asarray(table['Area'])
+            rows &= (area > params['normal_min_area']) & (area < params['normal_max_area'])
+        return rows
+
+    def normal(self, table, params=None):
+        # boolean array, one entry per row of table; comparisons with NaN (unmeasured cells) are False
+        params = {**RULE_PARAMS, **(params or {})}
+        rows = len(table['Cell_ID'])
+        if self._tree is None:
+            return np.broadcast_to(np.asarray(self.rule(table, params), bool), (rows,))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.broadcast_to(np.asarray(self._evaluate(self._tree, table, params), bool), (rows,))
+
+class ClassificationPolicy:
+    def __init__(self, rule=None, image_threshold=15, moderate_threshold=10, high_threshold=20):
+        # rule: a CellRule or what CellRule takes; an image is flagged above image_threshold percent abnormal
+        # cells, the dataset recommendation changes above moderate_threshold and high_threshold
+        self.rule = rule if isinstance(rule, CellRule) else CellRule(rule)
+        self.image_threshold = image_threshold
+        self.moderate_threshold = moderate_threshold
+        self.high_threshold = high_threshold
+
+    @property
+    def thresholds(self):
+        return tuple(sorted({self.moderate_threshold, self.image_threshold, self.high_threshold}))
+
+    def classify(self, table, params=None):
+        # the table with its Diagnosis column (re)computed; rows the rule cannot judge for lack of measurements
+        # (see CellRule.undecided) are Uncertain
+        diagnosis = np.where(self.rule.normal(table, params), 'Normal', 'Abnormal')
+        diagnosis = np.where(self.rule.undecided(table, params), 'Uncertain', diagnosis)
+        return {**{name: values for name, values in table.items() if name != 'Diagnosis'}, 'Diagnosis': diagnosis}
+
+    def image_status(self, rate):
+        return image_status(rate, self.image_threshold)
+
+    def recommendation(self, rate):
+        return recommendation(rate, self.moderate_threshold, self.high_threshold)
+
+def _image_result(features, row):
+    # result-shaped record of one re-classified image, for DatasetAggregate.add / ReportSink.add
+    diagnosis = features['Diagnosis']
+    uncertain = int(np.count_nonzero(diagnosis == 'Uncertain'))
+    result = {
+        'features': features,
+        'template_matching_results': {'templates': int(row.get('template_detections', 0))},
+        'cell_count': int(row['cell_count']),
+        'normal_cells': int(np.count_nonzero(diagnosis == 'Normal')),
+        'abnormal_cells': int(np.count_nonzero(diagnosis == 'Abnormal')),
+        'uncertain_cells': uncertain,
+    }
+    if uncertain:
+        result['triage'] = {'escalated': False}
+    return result
+
+# cell columns a re-scored report needs besides those the rule reads: grouping, counts and the aggregate's sketches
+_REPORT_COLUMNS = {'image', 'Cell_ID', 'Area', 'Circularity'}
+
+def rescore_report(report_dir, policy, params, target, chunk_rows=65536, keep_columns=True):
+    # re-classifies every cell of a ReportSink report under policy and adds each image's result to target
+    # (a DatasetAggregate or another ReportSink); cells are streamed and classified a chunk at a time, only the
+    # per-image summary rows are held in memory. keep_columns=False parses just the columns the rule and the
+    # report need, for a target that writes no tables. Returns the number of cells re-classified.
+    cells_path, images_path = report_tables(report_dir)
+    images = {}
+    for chunk in read_table(images_path, chunk_rows):
+        for index, name in enumerate(chunk['image']):
+            images[name] = {column: values[index] for column, values in chunk.items()}
+
+    columns = None if keep_columns or policy.rule.names is None else _REPORT_COLUMNS | policy.rule.names
+    cells = 0
+    carry = empty = None
+
+    def add(table):
+        row = images.pop(table['image'][0], None)
+        if row is not None:
+            target.add(table['image'][0], _image_result({name: values for name, values in table.items()
+                                                         if name != 'image'}, row))
+
+    for chunk in read_table(cells_path, chunk_rows, columns):
+        cells += len(chunk['image'])
+        chunk = policy.classify(chunk, params)
+        if carry is not None:
+            chunk = {name: np.concatenate([carry[name], values]) for name, values in chunk.items()}
+        # a ReportSink writes each image's cells together; the last image may continue in the next chunk
+        names = chunk['image']
+        starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]])
+        for start, stop in zip(starts[:-1], starts[1:]):
+            add({name: values[start:stop] for name, values in chunk.items()})
+        carry = {name: values[starts[-1]:] for name, values in chunk.items()}
+        empty = {name: values[:0] for name, values in chunk.items() if name != 'image'}
+    if carry is not None:
+        add(carry)
+
+    # images without a cell above the area cut-off have no rows in the cells table
+    for name, row in images.items():
+        features = empty or {'Cell_ID': np.zeros(0, np.int64), 'Area': np.zeros(0, np.int64),
+                             'Circularity': np.zeros(0), 'Diagnosis': np.zeros(0, str)}
+        target.add(name, _image_result(features, row))
+    return cells
@@ -0,0 +1,183 @@
+# Command line of the analysis pipeline: python -m medical_image_analysis [inputs] [options],
+# or the "Image enhancement pipeline.py" script next to the package.
+import argparse
+import ast
+
+from .analyzer import DEFAULT_PARAMS, medical_image_analyzer
+from .classification import DEFAULT_RULE, ClassificationPolicy
+from .loader import ImageLoader
+from .metrics import StageMetrics
+from .report_sink import OUTPUT_FORMATS, ReportSink
+from .result_cache import ResultCache
+from .result_store import RETENTION_POLICIES, ResultStore
+from .stage_graph import COMMON_PARAMS
+from .triage import TriagePolicy
+from .video_stream import DROP_POLICIES
+
+def _sweep_space(parser, items, params):
+    # {param: [values]} from the --sweep items; every name must be one of params, the analyzer's parameters,
+    # or the sweep would run identical configurations under a misspelt name
+    space = {}
+    for item in items:
+        name, separator, values = item.partition('=')
+        name = name.strip()
+        if not separator:
+            parser.error(f"--sweep {item!r}: expected PARAM=V1,V2,...")
+        if name not in params:
+            parser.error(f"--sweep {item!r}: unknown parameter {name!r} (one of {', '.join(params)})")
+        try:
+            space[name] = list(ast.literal_eval(f"[{values}]"))
+        except (SyntaxError, ValueError):
+            parser.error(f"--sweep {item!r}: values must be Python literals separated by commas")
+        if not space[name]:
+            parser.error(f"--sweep {item!r}: no values")
+    return space
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Medical image analysis pipeline")
+    parser.add_argument('inputs', nargs='*',
+                        help="image files, directories or glob patterns (opens a file dialog when omitted)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="number of worker processes (default: one per CPU core)")
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help="search directories and ** patterns recursively")
+    parser.add_argument('--render-dir', default=None,
+                        help="save each image's analysis figure as a PNG in this directory")
+    parser.add_argument('--retention', choices=RETENTION_POLICIES, default='full',
+                        help="keep all intermediate images (full), only counts and features (slim), "
+                             "or spill intermediates to --spill-dir (spill)")
+    parser.add_argument('--spill-dir', default=None,
+                        help="directory for spilled intermediate arrays")
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help="process each image in tiles of this many pixels (whole-slide mode); .npy slides are "
+                             "memory-mapped, other formats are decoded once into a temporary .npy the workers share")
+    parser.add_argument('--overlap', type=int, default=64,
+                        help="tile overlap in pixels, at least the largest cell diameter")
+    parser.add_argument('--cache-dir', default=None,
+                        help="reuse stage results stored here for unchanged images and parameters")
+    parser.add_argument('--cache-size-mb', type=int, default=2048,
+                        help="evict least recently used cache entries beyond this size")
+    parser.add_argument('--extra-stages', nargs='+', default=(),
+                        help="also compute these stages for every image, e.g. contour_count edge_count, "
+                             "sharing the grayscale and threshold images with the watershed analysis")
+    parser.add_argument('--gray-decode', action='store_true',
+                        help="decode straight to grayscale when no colour image is kept (slim retention, "
+                             "no --render-dir); PNG grey levels may differ by one from a colour decode")
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help="number of images read ahead of the analysis")
+    parser.add_argument('--sweep', action='append', default=[], metavar='PARAM=V1,V2,...',
+                        help="sweep a parameter over these values (repeatable), e.g. canny_low=20,30,40 or "
+                             "clahe_tile_grid=(8,8),(16,16); prints counts and timings per configuration")
+    parser.add_argument('--sweep-samples', type=int, default=None,
+                        help="run this many random configurations instead of the full grid")
+    parser.add_argument('--sweep-output', default=None, help="write per-image sweep rows to this CSV file")
+    parser.add_argument('--serve', default=None, metavar='[HOST:]PORT',
+                        help="run as a local HTTP analysis service (POST /analyze, GET /metrics)")
+    parser.add_argument('--max-queue', type=int, default=64,
+                        help="requests the service queues before answering 503 busy")
+    parser.add_argument('--batch-size', type=int, default=8, help="requests the service sends to a worker at once")
+    parser.add_argument('--batch-wait-ms', type=float, default=5,
+                        help="how long the service collects requests into one batch")
+    parser.add_argument('--video', default=None, metavar='SOURCE',
+                        help="analyze a video file or capture device index frame by frame instead of still images")
+    parser.add_argument('--drop-policy', choices=DROP_POLICIES, default=None,
+                        help="what to do with new frames while the queue is full "
+                             "(default: block for files, drop_oldest for devices)")
+    parser.add_argument('--queue-size', type=int, default=4, help="frames buffered between reader and workers")
+    parser.add_argument('--latency-budget', type=float, default=None,
+                        help="skip frames that waited longer than this many seconds")
+    parser.add_argument('--frame-skip', type=int, default=1, help="analyze every n-th frame")
+    parser.add_argument('--track', action='store_true',
+                        help="give each cell a Track_ID carried over from the cell it overlaps in the previous frame "
+                             "(labels only: the segmentation is unchanged and no faster)")
+    parser.add_argument('--pace', action='store_true', help="play video files back at their frame rate")
+    parser.add_argument('--max-frames', type=int, default=None, help="stop after this many analyzed frames")
+    parser.add_argument('--report-dir', default=None,
+                        help="stream per-cell features and per-image summaries to files in this directory instead "
+                             "of keeping every result in memory (best with --retention slim)")
+    parser.add_argument('--report-format', choices=OUTPUT_FORMATS, default='csv',
+                        help="file format of --report-dir (parquet needs pyarrow)")
+    parser.add_argument('--report-chunk-rows', type=int, default=65536,
+                        help="cell rows buffered between writes to --report-dir")
+    parser.add_argument('--cell-rule', default=None, metavar='EXPR',
+                        help="when a cell is Normal, over feature columns (Area, Perimeter, Circularity, Eccentricity, "
+                             "Mean_Intensity, ...) and parameters, e.g. \"Circularity > 0.8 and Eccentricity < 0.6\" "
+                             f"(default: {DEFAULT_RULE})")
+    parser.add_argument('--image-threshold', type=float, default=15,
+                        help="percentage of abnormal cells above which an image needs immediate attention")
+    parser.add_argument('--moderate-threshold', type=float, default=10,
+                        help="dataset abnormality percentage above which the patient needs close supervision")
+    parser.add_argument('--high-threshold', type=float, default=20,
+                        help="dataset abnormality percentage above which further investigation is recommended")
+    parser.add_argument('--rescore', nargs='+', default=None, metavar='REPORT_DIR',
+                        help="re-classify the cells of earlier --report-dir runs under --cell-rule and the thresholds "
+                             "without reading any image (re-scored tables go to --report-dir)")
+    parser.add_argument('--triage', action='store_true',
+                        help="settle each image's verdicts from its segmentation when the rate is clearly away from "
+                             "the 10/15/20%% thresholds, full analysis only for the others (needs --retention slim)")
+    parser.add_argument('--triage-margin', type=float, default=1.0,
+                        help="percentage points the estimated rate has to clear every threshold by")
+    parser.add_argument('--triage-min-cells', type=int, default=20,
+                        help="images with fewer cells always get the full analysis")
+    parser.add_argument('--metrics', action='store_true',
+                        help="record per-stage timings and sizes and print a summary at the end")
+    parser.add_argument('--metrics-jsonl', default=None,
+                        help="append one JSON line per image and stage to this file (implies --metrics)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="also record each stage's peak allocation (slower, implies --metrics)")
+    args = parser.parse_args(argv)
+
+    # triage settles results without intermediate images, which only slim batch runs and the service produce
+    if args.triage and (args.retention != 'slim' or args.render_dir or args.video is not None or args.tile_size
+                        or args.sweep or args.rescore):
+        parser.error("--triage needs --retention slim and applies to batch runs and --serve "
+                     "(not with --render-dir, --video, --tile-size, --sweep or --rescore)")
+
+    # tiles are segmented in worker processes from a shared .npy: there is no whole-slide figure to draw,
+    # no image digest to key a cache on and no stage graph for extra stages
+    if args.tile_size and (args.render_dir or args.cache_dir or args.extra_stages):
+        parser.error("--tile-size does not support --render-dir, --cache-dir or --extra-stages")
+
+    space = _sweep_space(parser, args.sweep, {**COMMON_PARAMS, **DEFAULT_PARAMS}) if args.sweep else None
+
+    try:
+        policy = ClassificationPolicy(args.cell_rule, args.image_threshold, args.moderate_threshold,
+                                      args.high_threshold)
+    except (SyntaxError, ValueError) as error:
+        parser.error(f"--cell-rule: {error}")
+
+    cache = ResultCache(args.cache_dir, args.cache_size_mb << 20) if args.cache_dir else None
+    metrics = None
+    if args.metrics or args.metrics_jsonl or args.trace_memory:
+        metrics = StageMetrics(args.metrics_jsonl, args.trace_memory)
+    analyzer = medical_image_analyzer(store=ResultStore(args.retention, args.spill_dir), cache=cache,
+                                      metrics=metrics, extra_stages=args.extra_stages,
+                                      loader=ImageLoader(prefetch=args.prefetch, gray_decode=args.gray_decode),
+                                      sink=ReportSink(args.report_dir, args.report_format, args.report_chunk_rows,
+                                                      policy.image_threshold)
+                                      if args.report_dir else None,
+                                      triage=TriagePolicy(args.triage_margin, args.triage_min_cells, policy.thresholds)
+                                      if args.triage else None,
+                                      policy=policy)
+    if args.rescore:
+        analyzer.rescore_report(args.rescore, args.report_chunk_rows)
+    elif args.serve:
+        from .analysis_service import serve
+        host, _, port = args.serve.rpartition(':')
+        serve(analyzer, host or '127.0.0.1', int(port), args.workers, args.max_queue, args.batch_size,
+              args.batch_wait_ms / 1000)
+    elif args.video is not None:
+        analyzer.stream_analysis(args.video, args.workers or 2, args.queue_size, args.drop_policy,
+                                 args.latency_budget, args.frame_skip, args.track, pace=args.pace,
+                                 max_frames=args.max_frames)
+    elif args.inputs and args.sweep:
+        analyzer.parameter_sweep(args.inputs, space, args.sweep_samples, args.workers, args.recursive,
+                                 args.sweep_output)
+    elif args.inputs and args.tile_size:
+        analyzer.tiled_batch_analysis(args.inputs, args.tile_size, args.overlap, args.workers, args.recursive)
+    elif args.inputs:
+        analyzer.batch_analysis(args.inputs, workers=args.workers, recursive=args.recursive,
+                                render_dir=args.render_dir)
+    else:
+        analyzer.complete_analysis()
+    analyzer.metrics.close()
@@ -0,0 +1,24 @@
+# Contour analysis of the medical image analysis pipeline (project 01): threshold and edge objects from the
+# shared stage table, with the outlines for drawing only when an overlay is wanted.
+from .stage_graph import StageGraph, common_stages
+
+# adaptive 11/2 threshold opened with a 2x2 kernel, CLAHE 2.0/8x8, Canny 30/100, contours above 20/25 px
+CONTOUR_STAGES = common_stages()
+
+def contour_analysis(original_image, graph=None, overlay=True):
+    # graph: a StageGraph already holding this image's intermediates, e.g. from medical_image_analyzer.stage_graph;
+    # counts come from connected-component statistics, the contours for drawing only when overlay is set
+    graph = graph if graph is not None else StageGraph(CONTOUR_STAGES, image=original_image)
+    analysis = {
+        'gray_cell': graph['gray'],
+        'adaptive_binary': graph['adaptive'],
+        'clahe_enhanced': graph['clahe'],
+        'edges': graph['edges'],
+        'cell_objects': graph['cell_objects'][0],
+        'edge_objects': graph['edge_objects'][0],
+        'cell_count': graph['contour_count'],
+        'edge_count': graph['edge_count'],
+    }
+    if overlay:
+        analysis.update({'cell_contours': graph['cell_contours'], 'edge_contours': graph['edge_contours']})
+    return analysis
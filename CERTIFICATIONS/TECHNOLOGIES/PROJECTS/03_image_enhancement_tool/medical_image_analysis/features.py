@@ -0,0 +1,179 @@
+# Columnar region features for watershed label images.
+# Every kernel works on all labels at once (bincount over pixels) and can be restricted to a window,
+# so partial results from image tiles can be summed into exact whole-image features.
+import cv2
+import numpy as np
+
+FEATURE_COLUMNS = ('Cell_ID', 'Area', 'Perimeter', 'Circularity', 'Eccentricity', 'Diagnosis')
+
+# weights skimage.measure.perimeter gives each 4-connected border pixel configuration
+_PERIMETER_WEIGHTS = np.zeros(50)
+_PERIMETER_WEIGHTS[[5, 7, 15, 17, 25, 27]] = 1
+_PERIMETER_WEIGHTS[[21, 33]] = np.sqrt(2)
+_PERIMETER_WEIGHTS[[13, 23]] = (1 + np.sqrt(2)) / 2
+
+def _in_window(rows, cols, window):
+    row0, row1, col0, col1 = window
+    return (rows >= row0) & (rows < row1) & (cols >= col0) & (cols < col1)
+
+def label_perimeters(markers, n_labels, window=None):
+    # perimeter of every label in one pass, same values as regionprops(...).perimeter;
+    # with window=(row0, row1, col0, col1) only border pixels inside the window are counted
+    height, width = markers.shape
+    padded = np.pad(markers, 1)
+    center = padded[1:-1, 1:-1]
+
+    # border pixels are labelled pixels with a 4-neighbour outside their own label
+    interior = center > 0
+    for dy, dx in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+        interior &= padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width] == center
+    border = (center > 0) & ~interior
+    rows, cols = np.nonzero(border)
+    if window is not None:
+        inside = _in_window(rows, cols, window)
+        rows, cols = rows[inside], cols[inside]
+    labels = center[rows, cols]
+    del interior
+
+    # encode each border pixel's same-label border neighbours like skimage's [[10, 2, 10], [2, 1, 2], [10, 2, 10]] kernel
+    border = np.pad(border, 1)
+    rows += 1
+    cols += 1
+    codes = np.ones(len(labels), np.intp)
+    for dy, dx, weight in ((-1, 0, 2), (1, 0, 2), (0, -1, 2), (0, 1, 2),
+                           (-1, -1, 10), (-1, 1, 10), (1, -1, 10), (1, 1, 10)):
+        neighbour = (rows + dy, cols + dx)
+        codes += weight * (border[neighbour] & (padded[neighbour] == labels))
+    return np.bincount(labels, weights=_PERIMETER_WEIGHTS[codes], minlength=n_labels)
+
+def label_moment_sums(markers, n_labels, window=None, origin=(0, 0)):
+    # pixel count, mean position and centred second-order sums of every label;
+    # positions are shifted by origin so tiles report image coordinates
+    rows, cols = np.nonzero(markers)
+    if window is not None:
+        inside = _in_window(rows, cols, window)
+        rows, cols = rows[inside], cols[inside]
+    labels = markers[rows, cols]
+
+    counts = np.bincount(labels, minlength=n_labels)
+    safe_counts = np.maximum(counts, 1)
+    mean_rows = np.bincount(labels, weights=rows, minlength=n_labels) / safe_counts
+    mean_cols = np.bincount(labels, weights=cols, minlength=n_labels) / safe_counts
+    rows = rows - mean_rows[labels]
+    cols = cols - mean_cols[labels]
+    return {
+        'count': counts,
+        'mean_row': mean_rows + origin[0],
+        'mean_col': mean_cols + origin[1],
+        'm2_rr': np.bincount(labels, weights=rows * rows, minlength=n_labels),
+        'm2_cc': np.bincount(labels, weights=cols * cols, minlength=n_labels),
+        'm2_rc': np.bincount(labels, weights=rows * cols, minlength=n_labels),
+    }
+
+def combine_moment_sums(groups, sums, n_groups):
+    # merges partial moment sums (one entry per element of groups) into n_groups totals,
+    # using the parallel-axis form so the result equals a single pass over all pixels
+    counts = np.bincount(groups, weights=sums['count'], minlength=n_groups)
+    safe_counts = np.maximum(counts, 1)
+    mean_rows = np.bincount(groups, weights=sums['count'] * sums['mean_row'], minlength=n_groups) / safe_counts
+    mean_cols = np.bincount(groups, weights=sums['count'] * sums['mean_col'], minlength=n_groups) / safe_counts
+    d_rows = sums['mean_row'] - mean_rows[groups]
+    d_cols = sums['mean_col'] - mean_cols[groups]
+    return {
+        'count': counts.astype(np.int64),
+        'mean_row': mean_rows,
+        'mean_col': mean_cols,
+        'm2_rr': np.bincount(groups, weights=sums['m2_rr'] + sums['count'] * d_rows * d_rows, minlength=n_groups),
+        'm2_cc': np.bincount(groups, weights=sums['m2_cc'] + sums['count'] * d_cols * d_cols, minlength=n_groups),
+        'm2_rc': np.bincount(groups, weights=sums['m2_rc'] + sums['count'] * d_rows * d_cols, minlength=n_groups),
+    }
+
+def moment_eccentricities(sums):
+    # eccentricity from the eigenvalues of the inertia tensor, as regionprops computes it
+    safe_counts = np.maximum(sums['count'], 1)
+    mu20 = sums['m2_rr'] / safe_counts
+    mu02 = sums['m2_cc'] / safe_counts
+    mu11 = sums['m2_rc'] / safe_counts
+
+    half_trace = (mu20 + mu02) / 2
+    spread = np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+    major = np.clip(half_trace + spread, 0, None)
+    minor = np.clip(half_trace - spread, 0, None)
+    return np.sqrt(1 - np.divide(minor, major, out=np.ones_like(major), where=major > 0))
+
+def label_moments(markers, areas):
+    # centroid and eccentricity of every label from its first and second-order moments
+    sums = label_moment_sums(markers, len(areas))
+    return sums['mean_row'], sums['mean_col'], moment_eccentricities(sums)
+
+def build_feature_table(areas, perimeters, centroid_rows, centroid_cols, eccentricities, params=None,
+                        intensity_sums=None):
+    # per-label arrays (indexed by label value) -> feature table of the labels regionprops would report, without
+    # the Diagnosis column, which is the classification stage's (see classification.py);
+    # params may override the area filter; intensity_sums: grey-level sum of every label, for Mean_Intensity
+    params = params or {}
+    labels = np.flatnonzero(areas)
+    labels = labels[labels > 0]
+    cell_ids = np.arange(1, len(labels) + 1)
+
+    keep = areas[labels] > params.get('min_cell_area', 50)
+    labels, cell_ids = labels[keep], cell_ids[keep]
+    area = areas[labels]
+    perimeter = perimeters[labels]
+    circularity = np.divide(4 * np.pi * area, perimeter ** 2,
+                            out=np.zeros(len(labels)), where=perimeter > 0)
+
+    return {
+        'Label': labels,
+        'Cell_ID': cell_ids,
+        'Area': area,
+        'Perimeter': perimeter,
+        'Circularity': circularity,
+        'Eccentricity': eccentricities[labels],
+        'Centroid_Row': centroid_rows[labels],
+        'Centroid_Col': centroid_cols[labels],
+        'Mean_Intensity': (intensity_sums[labels] / area if intensity_sums is not None
+                           else np.full(len(labels), np.nan)),
+    }
+
+def feature_records(table):
+    # list-of-dicts view of a feature table, one dict per cell
+    columns = [table[name].tolist() for name in FEATURE_COLUMNS]
+    return [dict(zip(FEATURE_COLUMNS, values)) for values in zip(*columns)]
+
+def fill_holes(binary):
+    # foreground plus every background region not reachable from the image border
+    padded = cv2.copyMakeBorder((binary > 0).astype(np.uint8), 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    outside = padded.copy()
+    cv2.floodFill(outside, None, (0, 0), 1)
+    return ((padded > 0) | (outside == 0))[1:-1, 1:-1].astype(np.uint8)
+
+def binary_objects(binary, min_area=0):
+    # one row per object findContours(RETR_EXTERNAL) would outline: 8-connected components with holes filled.
+    # Area is the area of that outline polygon (what cv2.contourArea reports), from the 2x2 pixel blocks with
+    # at least three foreground corners: full blocks count 1, three-corner blocks are cut diagonally and count 1/2.
+    # Returns the table of the objects larger than min_area and the label image (labels of all objects).
+    filled = fill_holes(binary)
+    n_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(filled, connectivity=8)
+
+    corners = filled[:-1, :-1] + filled[:-1, 1:] + filled[1:, :-1] + filled[1:, 1:]
+    rows, cols = np.nonzero(corners >= 3)
+    # every foreground corner of such a block belongs to the same object
+    block_labels = np.maximum(np.maximum(labels[rows, cols], labels[rows, cols + 1]),
+                              np.maximum(labels[rows + 1, cols], labels[rows + 1, cols + 1]))
+    weights = np.where(corners[rows, cols] == 4, 1.0, 0.5)
+    areas = np.bincount(block_labels, weights=weights, minlength=n_labels)
+
+    keep = np.flatnonzero(areas[1:] > min_area) + 1
+    table = {
+        'Label': keep,
+        'Area': areas[keep],
+        'Pixel_Area': stats[keep, cv2.CC_STAT_AREA],
+        'BBox_Row': stats[keep, cv2.CC_STAT_TOP],
+        'BBox_Col': stats[keep, cv2.CC_STAT_LEFT],
+        'BBox_Height': stats[keep, cv2.CC_STAT_HEIGHT],
+        'BBox_Width': stats[keep, cv2.CC_STAT_WIDTH],
+        'Centroid_Row': centroids[keep, 1],
+        'Centroid_Col': centroids[keep, 0],
+    }
+    return table, labels
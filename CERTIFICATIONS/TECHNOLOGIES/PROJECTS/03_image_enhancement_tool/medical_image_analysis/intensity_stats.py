@@ -0,0 +1,132 @@
+# Mergeable intensity statistics for 8-bit images.
+# Each image is binned once into 256 integer counts per stage (gray, equalized, CLAHE, ...); mean, variance
+# and percentiles all come from the counts, so partial results from workers or earlier runs add up exactly
+# and plots are drawn from the bins without touching the pixels again.
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from .loader import ImageLoader
+from .stage_graph import StageGraph, common_stages
+
+LEVELS = np.arange(256)
+# calcHist counts in float32, exact up to 2**24 per bin, so larger images are binned in row blocks
+_MAX_BLOCK_PIXELS = 1 << 24
+
+def image_histogram(image):
+    # 256-bin int64 histogram of a 2-D uint8 image
+    rows_per_block = max(1, _MAX_BLOCK_PIXELS // image.shape[1])
+    counts = np.zeros(256, np.int64)
+    for row in range(0, image.shape[0], rows_per_block):
+        block = np.ascontiguousarray(image[row:row + rows_per_block])
+        counts += cv2.calcHist([block], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+    return counts
+
+class IntensityStats:
+    def __init__(self):
+        # stage name -> 256 counts summed over all images
+        self.histograms = {}
+        self.images = 0
+
+    def add_histograms(self, histograms):
+        # one image's {stage: counts}
+        for name, counts in histograms.items():
+            if name in self.histograms:
+                self.histograms[name] += counts
+            else:
+                self.histograms[name] = np.array(counts, np.int64)
+        self.images += 1
+
+    def add_images(self, images):
+        # one image's {stage: uint8 array}
+        self.add_histograms({name: image_histogram(image) for name, image in images.items()})
+
+    def merge(self, other):
+        for name, counts in other.histograms.items():
+            if name in self.histograms:
+                self.histograms[name] += counts
+            else:
+                self.histograms[name] = counts.copy()
+        self.images += other.images
+        return self
+
+    def count(self, name):
+        return int(self.histograms[name].sum())
+
+    def mean(self, name):
+        counts = self.histograms[name]
+        return float(counts @ LEVELS / max(counts.sum(), 1))
+
+    def variance(self, name):
+        counts = self.histograms[name]
+        return float(counts @ (LEVELS - self.mean(name)) ** 2 / max(counts.sum(), 1))
+
+    def percentile(self, name, q):
+        # nearest-rank percentile(s), q in 0-100
+        cumulative = np.cumsum(self.histograms[name])
+        ranks = np.ceil(np.asarray(q, np.float64) / 100 * cumulative[-1]).clip(1, None)
+        return np.searchsorted(cumulative, ranks)
+
+    def summary(self, percentiles=(5, 50, 95)):
+        return {
+            name: {
+                'pixels': self.count(name),
+                'mean': self.mean(name),
+                'std': self.variance(name) ** 0.5,
+                **{f'p{q}': int(value) for q, value in zip(percentiles, self.percentile(name, percentiles))},
+            }
+            for name in self.histograms
+        }
+
+    def save(self, path):
+        np.savez(path, images=self.images, **self.histograms)
+
+    @classmethod
+    def load(cls, path):
+        stats = cls()
+        with np.load(path) as data:
+            stats.images = int(data['images'])
+            stats.histograms = {name: data[name].astype(np.int64) for name in data.files if name != 'images'}
+        return stats
+
+    def plot(self, ax, name, color='black', **kwargs):
+        # histogram panel drawn from the stored bins
+        ax.stairs(self.histograms[name], np.arange(257), fill=True, color=color, **kwargs)
+        ax.set_xlim(0, 256)
+
+_worker_stages = None
+
+def _init_stats_worker():
+    global _worker_stages
+    cv2.setNumThreads(1)
+    _worker_stages = common_stages()
+
+def _chunk_stats(image_paths, stage_names, gray_decode):
+    # IntensityStats of one chunk of images
+    stages = _worker_stages or common_stages()
+    stats = IntensityStats()
+    for _, _, image in ImageLoader(threads=2).prefetch(image_paths, 'gray' if gray_decode else 'color'):
+        if image is None:
+            continue
+        graph = StageGraph(stages, image=image)
+        stats.add_images({name: graph[name] for name in stage_names})
+    return stats
+
+def collect_intensity_stats(image_paths, stage_names=('gray', 'equalized', 'clahe'), workers=None,
+                            chunk_size=64, gray_decode=True, stats=None):
+    # dataset-wide histograms of the given stages, chunks of images spread over a process pool and merged
+    # into stats (a running aggregate, e.g. loaded from an earlier run) as they finish
+    stats = stats if stats is not None else IntensityStats()
+    chunks = [image_paths[start:start + chunk_size] for start in range(0, len(image_paths), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for chunk in chunks:
+            stats.merge(_chunk_stats(chunk, stage_names, gray_decode))
+        return stats
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_stats_worker) as pool:
+        futures = [pool.submit(_chunk_stats, chunk, stage_names, gray_decode) for chunk in chunks]
+        for future in as_completed(futures):
+            stats.merge(future.result())
+    return stats
@@ -0,0 +1,65 @@
+# Prefetching image loader.
+# Files are read (and optionally decoded) on a small thread pool a bounded number of images ahead of the
+# consumer, so disk or network reads overlap with analysis. Decoding can go straight to grayscale and/or a
+# 1/2, 1/4 or 1/8 resolution (libjpeg scales while decoding), skipping the full BGR decode and conversion.
+# OpenCV releases the GIL while decoding, so threads are enough here.
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import cv2
+import numpy as np
+
+# reduction factor -> (colour flag, grayscale flag)
+_DECODE_FLAGS = {
+    1: (cv2.IMREAD_COLOR, cv2.IMREAD_GRAYSCALE),
+    2: (cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    4: (cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    8: (cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+}
+
+class ImageLoader:
+    def __init__(self, threads=4, prefetch=8, gray_decode=False, reduction=1):
+        # gray_decode: decode to grayscale whenever the caller needs no colour image; JPEGs come out identical
+        # to converting a colour decode, other formats may differ by one grey level
+        if reduction not in _DECODE_FLAGS:
+            raise ValueError(f"reduction must be one of {tuple(_DECODE_FLAGS)}, got {reduction!r}")
+        self.threads = threads
+        self.prefetch_size = prefetch
+        self.gray_decode = gray_decode
+        self.reduction = reduction
+
+    def config(self):
+        return self.threads, self.prefetch_size, self.gray_decode, self.reduction
+
+    def read(self, path):
+        # encoded file bytes, None when the file cannot be read
+        try:
+            return np.fromfile(path, np.uint8)
+        except OSError:
+            return None
+
+    def decode(self, data, gray=False):
+        if data is None or not len(data):
+            return None
+        return cv2.imdecode(data, _DECODE_FLAGS[self.reduction][1 if gray else 0])
+
+    def load(self, path, gray=False):
+        return self.decode(self.read(path), gray)
+
+    def prefetch(self, paths, decode=None):
+        # yields (path, data, image) in input order, reading at most `prefetch` images ahead;
+        # decode: None to only read the bytes, 'color' or 'gray' to decode them on the pool as well
+        def job(path):
+            data = self.read(path)
+            image = self.decode(data, decode == 'gray') if decode else None
+            return path, data, image
+
+        paths = iter(paths)
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            queue = deque(pool.submit(job, path) for path in islice(paths, self.prefetch_size))
+            while queue:
+                loaded = queue.popleft().result()
+                for path in islice(paths, 1):
+                    queue.append(pool.submit(job, path))
+                yield loaded
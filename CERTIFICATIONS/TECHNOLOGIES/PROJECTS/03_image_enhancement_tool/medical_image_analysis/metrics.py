@@ -0,0 +1,214 @@
+# Per-stage instrumentation of the analysis pipeline.
+# StageMetrics.stage(image, name) wraps one pipeline stage and records its wall time, CPU time and output
+# array sizes, plus the peak Python/NumPy allocation when trace_memory is on. Records are folded into an
+# in-process registry with a latency histogram and the slowest few records per stage, so memory stays flat on
+# long runs, and can also be appended to a JSON-lines file.
+# With metrics off the analyzer uses NO_METRICS, whose stages are no-ops.
+import heapq
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+# histogram bucket upper edges in seconds, 0.1 ms doubling up to about 100 s; one overflow bucket above
+HISTOGRAM_EDGES = np.array([1e-4 * 2 ** i for i in range(21)])
+
+class _Span:
+    __slots__ = ('metrics', 'image', 'stage', 'shapes', 'output_bytes', '_wall', '_cpu', '_traced')
+
+    def __init__(self, metrics, image, stage):
+        self.metrics = metrics
+        self.image = image
+        self.stage = stage
+        self.shapes = []
+        self.output_bytes = 0
+
+    def output(self, *arrays):
+        # arrays the stage produced, their shapes and sizes go into the record
+        for array in arrays:
+            self.shapes.append(list(array.shape))
+            self.output_bytes += int(array.nbytes)
+
+    def __enter__(self):
+        if self.metrics.trace_memory:
+            self._traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        peak = tracemalloc.get_traced_memory()[1] - self._traced if self.metrics.trace_memory else None
+        self.metrics.add({
+            'image': self.image,
+            'stage': self.stage,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'peak_bytes': peak,
+            'output_bytes': self.output_bytes,
+            'shapes': self.shapes,
+            'failed': exc_type is not None,
+            'pid': os.getpid(),
+            'time': time.time(),
+        })
+        return False
+
+class _NullSpan:
+    def output(self, *arrays):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+class _NullMetrics:
+    enabled = False
+    _span = _NullSpan()
+
+    def stage(self, image, stage):
+        return self._span
+
+    def config(self):
+        return None
+
+    def drain(self):
+        return []
+
+    def merge(self, records):
+        pass
+
+    def close(self):
+        pass
+
+NO_METRICS = _NullMetrics()
+
+class StageMetrics:
+    enabled = True
+
+    def __init__(self, jsonl_path=None, trace_memory=False, keep_records=False, worker=False, keep_slowest=5):
+        # keep_records: also keep every record in self.records (grows with the run, for short interactive use);
+        # worker: buffer records until drain() ships them to the parent process
+        self.jsonl_path = jsonl_path
+        self.trace_memory = trace_memory
+        self.keep_records = keep_records
+        self.worker = worker
+        self.keep_slowest = keep_slowest
+        self.records = []
+        # stage -> running totals and latency histogram
+        self.stages = {}
+        # stage -> min-heap of (wall_s, sequence, record), the keep_slowest slowest records
+        self._slowest = {}
+        self._sequence = 0
+        # records not yet handed back by drain(), in worker processes only
+        self._pending = []
+        self._handle = None
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def config(self):
+        # what a worker process needs; workers ship their records back instead of writing the file
+        return {'trace_memory': self.trace_memory}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(trace_memory=config['trace_memory'], worker=True, keep_slowest=0) if config else NO_METRICS
+
+    def stage(self, image, stage):
+        return _Span(self, image, stage)
+
+    def add(self, record):
+        if self.worker:
+            self._pending.append(record)
+        self._store(record)
+
+    def _store(self, record):
+        totals = self.stages.get(record['stage'])
+        if totals is None:
+            totals = self.stages[record['stage']] = {
+                'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'max_wall_s': 0.0, 'max_peak_bytes': None,
+                'output_bytes': 0, 'histogram': np.zeros(len(HISTOGRAM_EDGES) + 1, np.int64),
+            }
+        totals['count'] += 1
+        totals['wall_s'] += record['wall_s']
+        totals['cpu_s'] += record['cpu_s']
+        totals['max_wall_s'] = max(totals['max_wall_s'], record['wall_s'])
+        totals['output_bytes'] += record['output_bytes']
+        if record['peak_bytes'] is not None:
+            totals['max_peak_bytes'] = max(totals['max_peak_bytes'] or 0, record['peak_bytes'])
+        totals['histogram'][np.searchsorted(HISTOGRAM_EDGES, record['wall_s'])] += 1
+
+        if self.keep_slowest:
+            slowest = self._slowest.setdefault(record['stage'], [])
+            self._sequence += 1
+            entry = (record['wall_s'], self._sequence, record)
+            if len(slowest) < self.keep_slowest:
+                heapq.heappush(slowest, entry)
+            elif entry[0] > slowest[0][0]:
+                heapq.heapreplace(slowest, entry)
+        if self.keep_records:
+            self.records.append(record)
+        if self.jsonl_path:
+            if self._handle is None:
+                self._handle = open(self.jsonl_path, 'a')
+            self._handle.write(json.dumps(record) + '\n')
+            self._handle.flush()
+
+    def drain(self):
+        pending, self._pending = self._pending, []
+        return pending
+
+    def merge(self, records):
+        # records from a worker process
+        for record in records:
+            self._store(record)
+
+    def percentile(self, stage, q):
+        # upper bucket edge below which q (0-1) of the stage's wall times fall
+        totals = self.stages[stage]
+        position = np.searchsorted(np.cumsum(totals['histogram']), q * totals['count'])
+        return float(HISTOGRAM_EDGES[min(position, len(HISTOGRAM_EDGES) - 1)])
+
+    def summary(self):
+        return {
+            stage: {
+                'count': totals['count'],
+                'mean_wall_s': totals['wall_s'] / totals['count'],
+                'p50_wall_s': self.percentile(stage, 0.5),
+                'p95_wall_s': self.percentile(stage, 0.95),
+                'max_wall_s': totals['max_wall_s'],
+                'total_wall_s': totals['wall_s'],
+                'total_cpu_s': totals['cpu_s'],
+                'max_peak_bytes': totals['max_peak_bytes'],
+                'mean_output_bytes': totals['output_bytes'] / totals['count'],
+            }
+            for stage, totals in self.stages.items()
+        }
+
+    def slowest(self, stage, n=5):
+        # the n images this stage took longest on (at most keep_slowest)
+        return [record for _, _, record in heapq.nlargest(n, self._slowest.get(stage, []))]
+
+    def report(self):
+        summary = self.summary()
+        total = sum(stage['total_wall_s'] for stage in summary.values()) or 1
+        print("\n" + "-"*70)
+        print("STAGE METRICS")
+        print("-"*70)
+        for stage, values in sorted(summary.items(), key=lambda item: -item[1]['total_wall_s']):
+            peak = values['max_peak_bytes']
+            peak_text = f", peak {peak / 2**20:.1f} MB" if peak is not None else ""
+            print(f"    > {stage}: {values['count']} runs, mean {values['mean_wall_s'] * 1e3:.1f} ms, "
+                  f"p95 <= {values['p95_wall_s'] * 1e3:.1f} ms, cpu {values['total_cpu_s']:.2f} s, "
+                  f"{100 * values['total_wall_s'] / total:.0f}% of time{peak_text}")
+        print("-"*70)
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
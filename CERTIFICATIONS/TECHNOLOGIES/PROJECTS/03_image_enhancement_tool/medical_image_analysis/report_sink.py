@@ -0,0 +1,304 @@
+# Streaming report output.
+# A ReportSink takes each image's result as it finishes, appends its per-cell feature rows and a per-image
+# summary row to columnar files (chunked CSV, or Parquet row groups when pyarrow is installed) and folds it
+# into a DatasetAggregate: totals, abnormality percentages and area / circularity moments and binned
+# sketches, all of fixed size. Nothing of the result is kept, so the memory use does not grow with the run.
+# read_table streams such files back in column chunks, e.g. to re-classify them (see classification.py).
+import csv
+import os
+from itertools import islice
+
+import numpy as np
+
+OUTPUT_FORMATS = ('csv', 'parquet')
+
+# per-image summary columns
+IMAGE_COLUMNS = ('image', 'cell_count', 'normal_cells', 'abnormal_cells', 'abnormality_rate', 'status',
+                 'template_detections', 'uncertain_cells')
+
+# columns read back as text and as integers, every other column as floats
+TEXT_COLUMNS = ('image', 'status', 'Diagnosis')
+INTEGER_COLUMNS = ('Label', 'Cell_ID', 'Area', 'cell_count', 'normal_cells', 'abnormal_cells', 'template_detections',
+                   'uncertain_cells')
+
+# abnormality percentages the verdicts change at by default: recommendation (10, 20) and image_status (15)
+REPORT_THRESHOLDS = (10, 15, 20)
+
+def abnormality_rate(abnormal, cells):
+    return (abnormal / cells * 100) if cells > 0 else 0
+
+def image_status(rate, threshold=15):
+    return "PATIENT NEEDS IMMEDIATE ATTENTION" if rate > threshold else "PATIENT IS NORMAL"
+
+def recommendation(rate, moderate=10, high=20):
+    if rate > high:
+        return "ABNORMALLY HIGH!\nPatient recommended for further investigation"
+    if rate > moderate:
+        return "MODERATE ABNORMALITY\nPatient needs close supervision"
+    return "PATIENT IS NORMAL"
+
+class StreamingMoments:
+    # count, mean, variance, min and max of a stream of values, updated one batch at a time
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values):
+        values = np.asarray(values, np.float64)
+        if not len(values):
+            return
+        other = StreamingMoments()
+        other.count, other.mean = len(values), float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min, other.max = float(values.min()), float(values.max())
+        self.merge(other)
+
+    def merge(self, other):
+        # parallel variance update (Chan et al.), exact for any split of the stream
+        count = self.count + other.count
+        if other.count:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+            self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        self.count = count
+        return self
+
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.mean, 'std': self.variance() ** 0.5,
+                'min': self.min if self.count else 0.0, 'max': self.max if self.count else 0.0}
+
+class BinnedSketch:
+    # fixed bins over [edges[0], edges[-1]] (values outside go to the first / last bin);
+    # quantiles are interpolated inside a bin, so they are exact to within one bin width
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, np.float64)
+        self.counts = np.zeros(len(self.edges) - 1, np.int64)
+
+    def add(self, values):
+        bins = np.searchsorted(self.edges, np.asarray(values, np.float64), side='right') - 1
+        self.counts += np.bincount(bins.clip(0, len(self.counts) - 1), minlength=len(self.counts))
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+    def quantile(self, q):
+        # q in 0-1
+        cumulative = np.cumsum(self.counts)
+        if not cumulative[-1]:
+            return 0.0
+        rank = q * cumulative[-1]
+        index = min(int(np.searchsorted(cumulative, rank)), len(self.counts) - 1)
+        before = cumulative[index - 1] if index else 0
+        fraction = (rank - before) / self.counts[index] if self.counts[index] else 0.0
+        return float(self.edges[index] + fraction * (self.edges[index + 1] - self.edges[index]))
+
+# sketch bins: areas on a log scale (about 2.3% wide) from 1 to 10**6 pixels, circularity in steps of 0.01
+AREA_EDGES = np.geomspace(1, 1e6, 601)
+CIRCULARITY_EDGES = np.linspace(0, 2, 201)
+
+class DatasetAggregate:
+    def __init__(self, keep_images=True, image_threshold=15):
+        # keep_images: also keep (name, cells, abnormal) per image for the printed per-image list;
+        # off for streamed runs, whose per-image rows are in the sink's images file;
+        # image_threshold: abnormality percentage above which an image is flagged
+        self.image_threshold = image_threshold
+        self.images = 0
+        self.cells = 0
+        self.normal = 0
+        self.abnormal = 0
+        self.flagged_images = 0
+        # cells of triaged images left unclassified (see triage.py) and the images settled that way
+        self.uncertain = 0
+        self.triaged_images = 0
+        self.area = StreamingMoments()
+        self.circularity = StreamingMoments()
+        self.area_sketch = BinnedSketch(AREA_EDGES)
+        self.circularity_sketch = BinnedSketch(CIRCULARITY_EDGES)
+        self.image_rows = [] if keep_images else None
+
+    def add(self, image_name, result):
+        rate = abnormality_rate(result['abnormal_cells'], result['cell_count'])
+        self.images += 1
+        self.cells += result['cell_count']
+        self.normal += result['normal_cells']
+        self.abnormal += result['abnormal_cells']
+        self.flagged_images += rate > self.image_threshold
+        uncertain = result.get('uncertain_cells', 0)
+        self.uncertain += uncertain
+        self.triaged_images += 'triage' in result and not result['triage']['escalated']
+        features = result['features']
+        # triaged cells have no circularity
+        circularity = features['Circularity'][np.isfinite(features['Circularity'])]
+        self.area.add(features['Area'])
+        self.circularity.add(circularity)
+        self.area_sketch.add(features['Area'])
+        self.circularity_sketch.add(circularity)
+        if self.image_rows is not None:
+            self.image_rows.append((image_name, result['cell_count'], result['abnormal_cells'], uncertain))
+        return rate
+
+    def merge(self, other):
+        self.images += other.images
+        self.cells += other.cells
+        self.normal += other.normal
+        self.abnormal += other.abnormal
+        self.flagged_images += other.flagged_images
+        self.uncertain += other.uncertain
+        self.triaged_images += other.triaged_images
+        self.area.merge(other.area)
+        self.circularity.merge(other.circularity)
+        self.area_sketch.merge(other.area_sketch)
+        self.circularity_sketch.merge(other.circularity_sketch)
+        if self.image_rows is not None and other.image_rows is not None:
+            self.image_rows.extend(other.image_rows)
+        return self
+
+    def abnormality_rate(self):
+        return abnormality_rate(self.abnormal, self.cells)
+
+    def abnormality_range(self):
+        # lowest and highest rate the triaged cells allow
+        return self.abnormality_rate(), abnormality_rate(self.abnormal + self.uncertain, self.cells)
+
+    def distributions(self, quantiles=(0.05, 0.5, 0.95)):
+        # moments plus sketch quantiles of the per-cell area and circularity
+        return {
+            name: {**moments.summary(),
+                   **{f'p{round(q * 100)}': sketch.quantile(q) for q in quantiles}}
+            for name, moments, sketch in (('Area', self.area, self.area_sketch),
+                                          ('Circularity', self.circularity, self.circularity_sketch))
+        }
+
+class _CsvTable:
+    def __init__(self, path, columns):
+        self.handle = open(path, 'w', newline='')
+        self.writer = csv.writer(self.handle)
+        self.writer.writerow(columns)
+
+    def write(self, columns):
+        self.writer.writerows(zip(*(np.asarray(values).tolist() for values in columns.values())))
+
+    def close(self):
+        self.handle.close()
+
+class _ParquetTable:
+    def __init__(self, path, columns):
+        self.path = path
+        self.writer = None
+
+    def write(self, columns):
+        # one row group per chunk; the schema comes from the first chunk
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table({name: np.asarray(values) for name, values in columns.items()})
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+class ReportSink:
+    def __init__(self, output_dir, output_format='csv', chunk_rows=65536, image_threshold=15):
+        # writes output_dir/cells.<ext> (one row per cell) and output_dir/images.<ext> (one row per image),
+        # buffering at most chunk_rows cell rows between writes; image_threshold decides the status column
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}, got {output_format!r}")
+        if output_format == 'parquet':
+            try:
+                import pyarrow.parquet  # noqa: F401
+            except ImportError:
+                raise ImportError("Parquet output needs pyarrow (pip install pyarrow), or use output_format='csv'")
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.chunk_rows = chunk_rows
+        self.image_threshold = image_threshold
+        self.aggregate = DatasetAggregate(keep_images=False, image_threshold=image_threshold)
+        self.cells_path = os.path.join(output_dir, f'cells.{output_format}')
+        self.images_path = os.path.join(output_dir, f'images.{output_format}')
+        self._table_type = _ParquetTable if output_format == 'parquet' else _CsvTable
+        self._cells = None
+        self._images = self._table_type(self.images_path, IMAGE_COLUMNS)
+        self._cell_chunks, self._image_rows = [], []
+        self._buffered = 0
+
+    def add(self, image_path, result):
+        rate = self.aggregate.add(image_path, result)
+        features = result['features']
+        cells = len(features['Cell_ID'])
+        if cells:
+            self._cell_chunks.append({'image': np.full(cells, image_path), **features})
+            self._buffered += cells
+        self._image_rows.append((image_path, result['cell_count'], result['normal_cells'], result['abnormal_cells'],
+                                 rate, image_status(rate, self.image_threshold), sum(result['template_matching_results'].values()),
+                                 result.get('uncertain_cells', 0)))
+        if self._buffered >= self.chunk_rows or len(self._image_rows) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if self._cell_chunks:
+            columns = {name: np.concatenate([chunk[name] for chunk in self._cell_chunks])
+                       for name in self._cell_chunks[0]}
+            if self._cells is None:
+                self._cells = self._table_type(self.cells_path, list(columns))
+            self._cells.write(columns)
+        if self._image_rows:
+            self._images.write(dict(zip(IMAGE_COLUMNS, map(list, zip(*self._image_rows)))))
+        self._cell_chunks, self._image_rows = [], []
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        if self._cells is not None:
+            self._cells.close()
+        self._images.close()
+
+def report_tables(report_dir):
+    # (cells path, images path) of the report a ReportSink wrote to report_dir
+    for output_format in OUTPUT_FORMATS:
+        images_path = os.path.join(report_dir, f'images.{output_format}')
+        if os.path.isfile(images_path):
+            return os.path.join(report_dir, f'cells.{output_format}'), images_path
+    raise FileNotFoundError(f"no images.csv or images.parquet report in {report_dir}")
+
+def _typed(name, column):
+    if name in INTEGER_COLUMNS and (column == np.round(column)).all():
+        return column.astype(np.int64)
+    return column
+
+def read_table(path, chunk_rows=65536, columns=None):
+    # yields the columns of a ReportSink file as {name: array}, at most chunk_rows rows at a time;
+    # columns: only parse these (all by default), the other ones are skipped
+    if not os.path.isfile(path):
+        return
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield {name: _typed(name, column.to_numpy(zero_copy_only=False))
+                   for name, column in zip(batch.schema.names, batch.columns)}
+        return
+    with open(path, newline='') as handle:
+        header = next(csv.reader([handle.readline()]), None)
+        if not header:
+            return
+        names = [name for name in header if columns is None or name in columns]
+        usecols = [header.index(name) for name in names]
+        # whole lines at a time through NumPy's C parser; no field of these files spans lines
+        while True:
+            lines = list(islice(handle, chunk_rows))
+            if not lines:
+                break
+            width = max(map(len, lines))
+            dtype = [(name, f'U{width}' if name in TEXT_COLUMNS else np.float64) for name in names]
+            rows = np.loadtxt(lines, dtype, delimiter=',', quotechar='"', usecols=usecols, comments=None, ndmin=1)
+            yield {name: _typed(name, rows[name]) for name in names}
@@ -0,0 +1,111 @@
+# Persistent, content-addressed cache of per-stage analysis results.
+# An entry's key is the hash of the image file bytes plus a fingerprint of the parameters of its stage
+# and of every stage upstream of it, so changing a parameter only misses the stages that depend on it.
+# Entries are written atomically (temp file + rename), which makes the cache safe to share between
+# worker processes, and the least recently used entries are evicted once the cache outgrows max_bytes.
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import zlib
+
+# bump when the layout of cached entries changes
+CACHE_VERSION = 1
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def data_digest(data):
+    # same digest as file_digest, for file bytes already in memory
+    return hashlib.sha256(data).hexdigest()
+
+def fingerprint(params):
+    # stable hash of a parameter dict (tuples and lists hash alike)
+    text = json.dumps(params, sort_keys=True, default=repr)
+    return hashlib.sha256(f"{CACHE_VERSION}:{text}".encode('utf-8')).hexdigest()
+
+class ResultCache:
+    def __init__(self, cache_dir, max_bytes=2 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # bytes this process wrote since it last checked the cache size
+        self._written = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def config(self):
+        return self.cache_dir, self.max_bytes
+
+    def key(self, image_digest, stage, stage_fingerprint):
+        return hashlib.sha256(f"{image_digest}:{stage}:{stage_fingerprint}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.pkl.z')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as handle:
+                value = pickle.loads(zlib.decompress(handle.read()))
+        except (FileNotFoundError, zlib.error, pickle.UnpicklingError, EOFError):
+            # missing, evicted meanwhile by another process, or damaged: all count as a miss
+            return None
+        try:
+            # mtime doubles as the last-used time for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._written += len(data)
+        if self._written > self.max_bytes // 10:
+            self.evict()
+
+    def entries(self):
+        # (mtime, size, path) of every finished entry
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.pkl.z'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        # drops least recently used entries until the cache is back under 90% of max_bytes
+        self._written = 0
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
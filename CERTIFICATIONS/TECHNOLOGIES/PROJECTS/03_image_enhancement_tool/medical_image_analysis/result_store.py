@@ -0,0 +1,79 @@
+# Retention policy for per-image analysis results.
+#   full  - keep every intermediate array in memory (the original behaviour)
+#   slim  - keep only counts, feature tables and template results
+#   spill - write the intermediate arrays to .npy files and reload them memory-mapped on demand
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+# the full-size arrays analyze_single_image produces
+INTERMEDIATE_KEYS = ('image', 'grayCell', 'adaptive', 'cleaned', 'markers', 'dist_transform')
+RETENTION_POLICIES = ('full', 'slim', 'spill')
+
+class ResultStore:
+    def __init__(self, retention='full', spill_dir=None, cache_size=8):
+        if retention not in RETENTION_POLICIES:
+            raise ValueError(f"retention must be one of {RETENTION_POLICIES}, got {retention!r}")
+        if retention == 'spill' and not spill_dir:
+            raise ValueError("retention='spill' needs a spill_dir")
+        self.retention = retention
+        self.spill_dir = spill_dir
+        self.cache_size = cache_size
+        # image_path -> {key: memory-mapped array}, least recently used first
+        self._cache = OrderedDict()
+
+    def config(self):
+        # constructor arguments, so worker processes can build an identical store
+        return self.retention, self.spill_dir, self.cache_size
+
+    def spill_path(self, image_path):
+        # one directory per image; the hash keeps equal basenames from different folders apart
+        digest = hashlib.sha1(os.path.abspath(image_path).encode('utf-8')).hexdigest()[:12]
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(self.spill_dir, f"{name}_{digest}")
+
+    def retain(self, image_path, result):
+        # returns the record to keep in memory for this image
+        if result is None or self.retention == 'full':
+            return result
+
+        record = {key: value for key, value in result.items() if key not in INTERMEDIATE_KEYS}
+        if self.retention == 'spill':
+            spill_path = self.spill_path(image_path)
+            os.makedirs(spill_path, exist_ok=True)
+            for key in INTERMEDIATE_KEYS:
+                if key in result:
+                    np.save(os.path.join(spill_path, key + '.npy'), result[key])
+            record['spill_path'] = spill_path
+            self._cache.pop(image_path, None)
+        return record
+
+    def has_intermediates(self, record):
+        return all(key in record for key in INTERMEDIATE_KEYS) or 'spill_path' in record
+
+    def load(self, image_path, record):
+        # full result for visualisation; spilled arrays come back memory-mapped through a small LRU cache
+        if 'spill_path' not in record:
+            if not self.has_intermediates(record):
+                raise KeyError(f"{os.path.basename(image_path)} was kept slim, its intermediate images are gone")
+            return record
+
+        if image_path in self._cache:
+            self._cache.move_to_end(image_path)
+            arrays = self._cache[image_path]
+        else:
+            arrays = {key: np.load(os.path.join(record['spill_path'], key + '.npy'), mmap_mode='r')
+                      for key in INTERMEDIATE_KEYS}
+            self._cache[image_path] = arrays
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return {**record, **arrays}
+
+    def clear(self):
+        # drops the cache and every spilled file
+        self._cache.clear()
+        if self.retention == 'spill' and os.path.isdir(self.spill_dir):
+            shutil.rmtree(self.spill_dir)
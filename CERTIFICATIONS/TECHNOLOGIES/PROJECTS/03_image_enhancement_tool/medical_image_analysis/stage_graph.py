@@ -0,0 +1,131 @@
+# Named, memoized pipeline stages shared by the three analysis scripts.
+# A stage table maps a stage name to (dependency names, function); a StageGraph holds one image's
+# intermediates and computes a stage, and whatever it depends on, the first time it is asked for.
+# Contour counts and watershed features requested from the same graph therefore share one grayscale,
+# CLAHE and adaptive threshold image instead of each script recomputing its own.
+import cv2
+import numpy as np
+
+from .features import binary_objects
+from .metrics import NO_METRICS
+
+# parameters of the shared stages, the values the original scripts used
+COMMON_PARAMS = {
+    'adaptive_block_size': 11,
+    'adaptive_c': 2,
+    'clahe_clip_limit': 2.0,
+    'clahe_tile_grid': (8, 8),
+    'canny_low': 30,
+    'canny_high': 100,
+    'open_kernel_size': 2,
+    'min_contour_area': 20,
+    'min_edge_area': 25,
+}
+
+# parameters each shared stage reads itself (upstream stages' parameters not included)
+COMMON_STAGE_PARAMS = {
+    'clahe': ('clahe_clip_limit', 'clahe_tile_grid'),
+    'edges': ('canny_low', 'canny_high'),
+    'adaptive': ('adaptive_block_size', 'adaptive_c'),
+    'opened': ('open_kernel_size',),
+    'cell_objects': ('min_contour_area',),
+    'edge_objects': ('min_edge_area',),
+}
+
+def stage_keys(stages, stage_params, params):
+    # stage -> values of every parameter the stage depends on, directly or through upstream stages;
+    # two configurations with the same key for a stage produce the same result for it
+    names = {}
+
+    def upstream(stage):
+        if stage not in names:
+            found = set(stage_params.get(stage, ()))
+            for dependency in stages.get(stage, ((), None))[0]:
+                found |= upstream(dependency)
+            names[stage] = found
+        return names[stage]
+
+    return {stage: tuple((name, repr(params[name])) for name in sorted(upstream(stage))) for stage in stages}
+
+def external_contours(binary):
+    # outlines for drawing overlays; counting and measuring goes through the *_objects stages
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+def object_outlines(objects):
+    # outlines of the objects kept in an object table, for drawing
+    table, labels = objects
+    return external_contours(np.isin(labels, table['Label']).astype(np.uint8))
+
+def object_centroids(objects):
+    # (x, y) centroids of an object table as an (n, 2) array
+    table, _ = objects
+    return np.column_stack([table['Centroid_Col'], table['Centroid_Row']])
+
+def common_stages(params=None):
+    # stage table of the grayscale, enhancement, threshold, edge and contour steps of the scripts
+    params = {**COMMON_PARAMS, **(params or {})}
+    clahe = cv2.createCLAHE(clipLimit=params['clahe_clip_limit'], tileGridSize=tuple(params['clahe_tile_grid']))
+    open_kernel = np.ones((params['open_kernel_size'],) * 2, np.uint8)
+    return {
+        'gray': (('image',), lambda image: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image),
+        'equalized': (('gray',), cv2.equalizeHist),
+        'clahe': (('gray',), clahe.apply),
+        'edges': (('clahe',), lambda enhanced: cv2.Canny(enhanced, params['canny_low'], params['canny_high'])),
+        'adaptive': (('gray',), lambda gray: cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+            params['adaptive_block_size'], params['adaptive_c'])),
+        'opened': (('adaptive',), lambda binary: cv2.morphologyEx(binary, cv2.MORPH_OPEN, open_kernel)),
+        # object tables (count, contour area, bounding box, centroid) from connected-component statistics
+        'cell_objects': (('opened',), lambda binary: binary_objects(binary, params['min_contour_area'])),
+        'edge_objects': (('edges',), lambda edges: binary_objects(edges, params['min_edge_area'])),
+        'contour_count': (('cell_objects',), lambda objects: len(objects[0]['Label'])),
+        'edge_count': (('edge_objects',), lambda objects: len(objects[0]['Label'])),
+        'contour_centroids': (('cell_objects',), object_centroids),
+        'edge_centroids': (('edge_objects',), object_centroids),
+        # only computed when an overlay is drawn
+        'cell_contours': (('opened',), external_contours),
+        'edge_contours': (('edges',), external_contours),
+    }
+
+class StageGraph:
+    def __init__(self, stages, name=None, metrics=NO_METRICS, shared=None, keys=None, **values):
+        # values: source images (usually image=...) and any stage results already known, e.g. from a cache;
+        # shared / keys: a dict of results shared between graphs of the same image under different parameters,
+        # and the stage_keys of this graph's parameters, so a result is reused wherever its inputs are equal
+        self.stages = stages
+        self.name = name
+        self.metrics = metrics
+        self.shared = shared
+        self.keys = keys
+        self.values = values
+
+    def __getitem__(self, stage):
+        if stage in self.values:
+            return self.values[stage]
+        if stage not in self.stages:
+            raise KeyError(f"unknown stage {stage!r}")
+        shared_key = None
+        if self.shared is not None:
+            shared_key = (stage, self.keys[stage])
+            if shared_key in self.shared:
+                self.values[stage] = self.shared[shared_key]
+                return self.values[stage]
+
+        dependencies, function = self.stages[stage]
+        inputs = [self[dependency] for dependency in dependencies]
+        with self.metrics.stage(self.name, stage) as span:
+            value = function(*inputs)
+            if isinstance(value, np.ndarray):
+                span.output(value)
+        self.values[stage] = value
+        if shared_key is not None:
+            self.shared[shared_key] = value
+        return value
+
+    def __contains__(self, stage):
+        # computed (or given) already
+        return stage in self.values
+
+    def update(self, **values):
+        self.values.update(values)
@@ -0,0 +1,133 @@
+# Parameter sweeps over an image set.
+# Every image is one task on a process pool: it is decoded once and run through all configurations,
+# with a stage result shared by every configuration whose parameters upstream of that stage are equal
+# (one grayscale and CLAHE image for all Canny settings, one threshold image for all area cutoffs, ...).
+# Configurations are ordered so configurations sharing upstream results run back to back, and each shared
+# result is dropped after the last configuration that needs it.
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+# stages a sweep reports per image and configuration by default
+DEFAULT_OUTPUTS = ('features', 'watershed_count', 'contour_count', 'edge_count')
+
+def grid_configs(space):
+    # every combination of {param: [values]}
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+def random_configs(space, n, seed=0):
+    # n distinct random combinations of {param: [values]} (fewer when the grid is smaller)
+    rng = np.random.default_rng(seed)
+    names = list(space)
+    total = int(np.prod([len(space[name]) for name in names]))
+    configs = {}
+    while len(configs) < min(n, total):
+        values = tuple(space[name][rng.integers(len(space[name]))] for name in names)
+        configs.setdefault(values, dict(zip(names, values)))
+    return list(configs.values())
+
+# per worker process: analyzer type and its configuration, shared by every sweep task
+_sweep_analyzer = None
+
+def _init_sweep_worker(analyzer_type, analyzer_config):
+    global _sweep_analyzer
+    cv2.setNumThreads(1)
+    _sweep_analyzer = (analyzer_type, analyzer_config)
+
+def _result_columns(stage, value):
+    if stage == 'features':
+        cells = len(value['Cell_ID'])
+        normal = int(np.count_nonzero(value['Diagnosis'] == 'Normal'))
+        return {'cells': cells, 'normal_cells': normal, 'abnormal_cells': cells - normal}
+    if stage == 'templates':
+        return {f'template_{name}': count for name, count in value.items()}
+    return {stage: value}
+
+def _sweep_image(image_path, configs, outputs, analyzer_setup=None):
+    analyzer_type, analyzer_config = analyzer_setup or _sweep_analyzer
+    image = cv2.imread(image_path)
+    if image is None:
+        return [{'image': image_path, 'config': index, 'error': 'LOADING FAILED'} for index in range(len(configs))]
+
+    analyzers = [analyzer_type.from_worker_config({**analyzer_config,
+                                                    'params': {**analyzer_config['params'], **config}})
+                 for config in configs]
+    shared = {}
+    graphs = [analyzer.stage_graph(image, image_path, shared=shared) for analyzer in analyzers]
+
+    # last configuration that needs each shared result, so it can be freed right after
+    last_use = {}
+    for index, graph in enumerate(graphs):
+        needed, stack = set(), list(outputs)
+        while stack:
+            stage = stack.pop()
+            if stage in graph.stages and stage not in needed:
+                needed.add(stage)
+                stack.extend(graph.stages[stage][0])
+        for stage in needed:
+            last_use[(stage, graph.keys[stage])] = index
+
+    rows = []
+    for index, (config, graph) in enumerate(zip(configs, graphs)):
+        row = {'image': image_path, 'config': index, **config}
+        start = time.perf_counter()
+        try:
+            for stage in outputs:
+                row.update(_result_columns(stage, graph[stage]))
+        except Exception as error:
+            row['error'] = str(error)
+        # time of the work this configuration did not share with an earlier one
+        row['seconds'] = time.perf_counter() - start
+        rows.append(row)
+        for key in [key for key, last in last_use.items() if last == index]:
+            shared.pop(key, None)
+    return rows
+
+def _order(configs, analyzer):
+    # upstream parameters first, so configurations that share early stages are adjacent
+    names = [name for name in analyzer.params if any(name in config for config in configs)]
+    return sorted(range(len(configs)),
+                  key=lambda index: [repr(configs[index].get(name, analyzer.params[name])) for name in names])
+
+def parameter_sweep(analyzer, image_paths, configs, outputs=DEFAULT_OUTPUTS, workers=None):
+    # tidy rows, one per image and configuration: image, config index, the swept parameters,
+    # result counts and the seconds of unshared work; images run in parallel, configurations within a task
+    order = _order(configs, analyzer)
+    ordered = [configs[index] for index in order]
+    workers = workers or os.cpu_count() or 1
+    initargs = (type(analyzer), analyzer.worker_config())
+
+    rows = []
+    if workers == 1:
+        for image_path in image_paths:
+            rows.extend(_sweep_image(image_path, ordered, outputs, initargs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker, initargs=initargs) as pool:
+            futures = [pool.submit(_sweep_image, image_path, ordered, outputs) for image_path in image_paths]
+            for done, future in enumerate(as_completed(futures), 1):
+                rows.extend(future.result())
+                print(f"Sweep: {done}/{len(image_paths)} images")
+
+    # config indices refer to the caller's list
+    for row in rows:
+        row['config'] = order[row['config']]
+    return sorted(rows, key=lambda row: (row['config'], row['image']))
+
+def summarize_sweep(rows, configs):
+    # one row per configuration: its parameters, counts and seconds summed over all images
+    summary = [{'config': index, **config, 'images': 0, 'errors': 0} for index, config in enumerate(configs)]
+    for row in rows:
+        entry = summary[row['config']]
+        entry['images'] += 1
+        if 'error' in row:
+            entry['errors'] += 1
+            continue
+        for name, value in row.items():
+            if name not in ('image', 'config') and name not in configs[row['config']]:
+                entry[name] = entry.get(name, 0) + value
+    return summary
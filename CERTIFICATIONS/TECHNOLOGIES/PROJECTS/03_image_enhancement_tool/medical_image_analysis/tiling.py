@@ -0,0 +1,254 @@
+# Tiled execution of the analysis pipeline for images too large to segment in one piece.
+# The slide is cut into tiles whose cores partition it; every tile is processed with an overlap margin
+# so the threshold, morphology, distance transform and template responses are exact inside the core.
+# Watershed labels are stitched across tile seams with a union-find over the seed components, and
+# features are summed from per-tile partial moments, so a cell on a seam is counted once and whole.
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from .features import build_feature_table, combine_moment_sums, label_moment_sums, label_perimeters, moment_eccentricities
+
+def tile_windows(shape, tile_size):
+    # core windows (row0, row1, col0, col1) covering the image without overlap
+    height, width = shape[:2]
+    return [(row, min(row + tile_size, height), col, min(col + tile_size, width))
+            for row in range(0, height, tile_size) for col in range(0, width, tile_size)]
+
+def _grow(window, margin, shape):
+    row0, row1, col0, col1 = window
+    return (max(row0 - margin, 0), min(row1 + margin, shape[0]),
+            max(col0 - margin, 0), min(col1 + margin, shape[1]))
+
+def open_source(source):
+    # .npy slides are memory-mapped so a tile read touches only that tile; other formats are decoded whole
+    if isinstance(source, np.ndarray):
+        return source
+    if source.lower().endswith('.npy'):
+        return np.load(source, mmap_mode='r')
+    image = cv2.imread(source, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise IOError(f"LOADING FAILED: {source}")
+    return image
+
+def shared_source(source, scratch_dir):
+    # path of a .npy the workers memory-map: .npy slides as they are; JPEG, PNG, TIFF and in-memory arrays are
+    # decoded once here and written to scratch_dir, so the workers share one copy through the page cache
+    # instead of each decoding the whole slide
+    if isinstance(source, str) and source.lower().endswith('.npy'):
+        return source
+    path = os.path.join(scratch_dir, 'slide.npy')
+    np.save(path, open_source(source))
+    return path
+
+# per worker process: analyzer for the stage functions and the opened slide
+_tile_analyzer = None
+_tile_source = None
+
+def _init_tile_worker(analyzer_type, analyzer_config, source):
+    global _tile_analyzer, _tile_source
+    cv2.setNumThreads(1)
+    _tile_analyzer = analyzer_type.from_worker_config(analyzer_config)
+    _tile_source = open_source(source)
+
+def _tile_gray(window):
+    row0, row1, col0, col1 = window
+    tile = np.ascontiguousarray(_tile_source[row0:row1, col0:col1])
+    if tile.ndim == 3:
+        tile = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
+    return tile
+
+def _cleaned_tile(window):
+    gray = _tile_gray(window)
+    cleaned = _tile_analyzer.morphological_op(_tile_analyzer.adaptive_threshold(gray))
+    return gray, cleaned
+
+def _tile_distance_max(core, ext):
+    # first pass: largest distance-transform value inside the core, for the slide-wide sure-foreground level
+    _, cleaned = _cleaned_tile(ext)
+    _, binary = cv2.threshold(cleaned, 127, 255, cv2.THRESH_BINARY)
+    distance = cv2.distanceTransform(binary, cv2.DIST_L2, 5)
+    row0, col0 = core[0] - ext[0], core[2] - ext[2]
+    return float(distance[row0:row0 + core[1] - core[0], col0:col0 + core[3] - core[2]].max(initial=0))
+
+def _segment_tile(core, ext, sure_fg_threshold, scratch_path):
+    # second pass: segment the extended tile, keep statistics of the core only.
+    # Local nodes: 1 is the shared uncertain-foreground label, 2.. are the seed components of the core.
+    gray, cleaned = _cleaned_tile(ext)
+    markers, distance = _tile_analyzer.watershed_segmentation(cleaned, sure_fg_threshold)
+    markers = markers.astype(np.int32, copy=False)
+    row0, col0 = core[0] - ext[0], core[2] - ext[2]
+    height, width = core[1] - core[0], core[3] - core[2]
+    core_window = (row0, row0 + height, col0, col0 + width)
+    core_markers = markers[row0:row0 + height, col0:col0 + width]
+
+    # seed components restricted to the core, numbered from 2 like watershed_segmentation does
+    sure_core = (distance[row0:row0 + height, col0:col0 + width] > sure_fg_threshold).astype(np.uint8)
+    n_seeds, seeds = cv2.connectedComponents(sure_core)
+    seeds[sure_core > 0] += 1
+
+    # map every extended-tile label to a local node; labels whose seed lies outside the core get fresh nodes
+    n_labels = int(markers.max()) + 1
+    node_of_label = np.zeros(n_labels, np.int64)
+    node_of_label[1:2] = 1
+    node_of_label[core_markers[sure_core > 0]] = seeds[sure_core > 0]
+    unseeded = np.setdiff1d(np.unique(core_markers[core_markers > 1]), np.unique(core_markers[sure_core > 0]))
+    node_of_label[unseeded] = n_seeds + 1 + np.arange(len(unseeded))
+    n_nodes = n_seeds + 1 + len(unseeded)
+
+    # additive per-node statistics of the core pixels
+    label_sums = label_moment_sums(markers, n_labels, core_window, origin=(ext[0], ext[2]))
+    present = label_sums['count'] > 0
+    node_sums = combine_moment_sums(node_of_label[present], {key: value[present] for key, value in label_sums.items()},
+                                    n_nodes)
+    perimeters = np.bincount(node_of_label, weights=label_perimeters(markers, n_labels, core_window),
+                             minlength=n_nodes)
+    intensities = np.bincount(node_of_label[core_markers.ravel()],
+                              weights=gray[row0:row0 + height, col0:col0 + width].ravel(), minlength=n_nodes)
+
+    # position of each node's first seed in the order cv2.connectedComponents meets them on the whole
+    # slide (it scans 2x2 blocks, row pair by row pair), so stitched labels number like a full-frame pass
+    seed_rows, seed_cols = np.nonzero(sure_core)
+    block_keys = ((seed_rows + core[0]) // 2).astype(np.int64) * ((_tile_source.shape[1] + 1) // 2) \
+        + (seed_cols + core[2]) // 2
+    order = np.argsort(block_keys, kind='stable')
+    nodes, first = np.unique(seeds[seed_rows, seed_cols][order], return_index=True)
+    first_pixel = np.full(n_nodes, np.iinfo(np.int64).max)
+    first_pixel[nodes] = block_keys[order][first]
+
+    # seed pixels on the edge of the core, for stitching with the neighbouring tiles
+    edge = np.zeros_like(sure_core, dtype=bool)
+    edge[[0, -1], :] = True
+    edge[:, [0, -1]] = True
+    edge_rows, edge_cols = np.nonzero(edge & (sure_core > 0))
+    edge_pixels = ((edge_rows + core[0]).astype(np.int64) * _tile_source.shape[1] + edge_cols + core[2],
+                   seeds[edge_rows, edge_cols].astype(np.int64))
+
+    # template detections whose top-left corner falls in the core
+    detections = {}
+    for name, found in _tile_analyzer.template_bank.detect(gray).items():
+        found = found.copy()
+        found[:, 0] += ext[2]
+        found[:, 1] += ext[0]
+        owned = (found[:, 0] >= core[2]) & (found[:, 0] < core[3]) & (found[:, 1] >= core[0]) & (found[:, 1] < core[1])
+        detections[name] = found[owned]
+
+    if scratch_path:
+        np.save(scratch_path, node_of_label[core_markers].astype(np.int32))
+    return {'n_nodes': n_nodes, 'sums': node_sums, 'perimeters': perimeters, 'intensities': intensities,
+            'first_pixel': first_pixel,
+            'edge_pixels': edge_pixels, 'detections': detections}
+
+def _stitch(tiles, width, n_pixels):
+    # global label (1 for uncertain foreground, 2.. for cells) of every (tile, local node)
+    from scipy import sparse
+    from scipy.sparse import csgraph
+    offsets = np.cumsum([0] + [tile['n_nodes'] for tile in tiles])
+    n_nodes = int(offsets[-1])
+    pixels = np.concatenate([tile['edge_pixels'][0] for tile in tiles])
+    nodes = np.concatenate([tile['edge_pixels'][1] + offset for tile, offset in zip(tiles, offsets)])
+
+    # 8-adjacent seed pixels belong to the same component, whichever tiles they came from
+    order = np.argsort(pixels)
+    pixels, nodes = pixels[order], nodes[order]
+    sources, targets = [], []
+    for d_row in (-1, 0, 1):
+        for d_col in (-1, 0, 1):
+            if (d_row == 0 and d_col == 0) or len(pixels) == 0:
+                continue
+            cols = pixels % width
+            neighbours = pixels + d_row * width + d_col
+            valid = (cols + d_col >= 0) & (cols + d_col < width) & (neighbours >= 0) & (neighbours < n_pixels)
+            position = np.clip(np.searchsorted(pixels, neighbours), 0, len(pixels) - 1)
+            found = valid & (pixels[position] == neighbours)
+            sources.append(nodes[found])
+            targets.append(nodes[position[found]])
+    # every tile's node 1 is the same uncertain-foreground label
+    sources.append(offsets[:-1] + 1)
+    targets.append(np.full(len(tiles), 1))
+    sources, targets = np.concatenate(sources), np.concatenate(targets)
+    graph = sparse.coo_matrix((np.ones(len(sources)), (sources, targets)), shape=(n_nodes, n_nodes))
+    _, components = csgraph.connected_components(graph, directed=False)
+
+    # number components by their first seed block, label 1 stays label 1
+    first_pixel = np.concatenate([tile['first_pixel'] for tile in tiles])
+    component_first = np.full(components.max() + 1, np.iinfo(np.int64).max)
+    np.minimum.at(component_first, components, first_pixel)
+    uncertain = components[1]
+    component_first[uncertain] = -1
+    # node 0 of every tile is background
+    background = components[offsets[:-1]]
+    component_first[background] = np.iinfo(np.int64).max
+    ranking = np.argsort(component_first, kind='stable')
+    label_of_component = np.zeros(len(component_first), np.int64)
+    label_of_component[ranking] = np.arange(1, len(ranking) + 1)
+    label_of_component[background] = 0
+    return label_of_component[components], offsets
+
+def tiled_analysis(analyzer, source, tile_size=2048, overlap=64, workers=None, markers_path=None):
+    # overlap must cover the largest cell diameter and the template size, so every core pixel sees
+    # the same neighbourhood as in a full-frame pass
+    scratch_dir = tempfile.mkdtemp(prefix='tiles_')
+    try:
+        return _tiled_analysis(analyzer, source, tile_size, overlap, workers, markers_path, scratch_dir)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+def _tiled_analysis(analyzer, source, tile_size, overlap, workers, markers_path, scratch_dir):
+    slide_path = shared_source(source, scratch_dir)
+    shape = np.load(slide_path, mmap_mode='r').shape[:2]
+    cores = tile_windows(shape, tile_size)
+    extended = [_grow(core, overlap, shape) for core in cores]
+    workers = workers or os.cpu_count() or 1
+    print(f"Tiled analysis: {shape[0]}x{shape[1]} image, {len(cores)} tiles of {tile_size} px "
+          f"(overlap {overlap}), {workers} worker(s)")
+
+    initargs = (type(analyzer), analyzer.worker_config(), slide_path)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_tile_worker, initargs=initargs) as pool:
+        maxima = pool.map(_tile_distance_max, cores, extended)
+        sure_fg_threshold = analyzer.params['sure_fg_ratio'] * max(maxima, default=0)
+
+        futures = {pool.submit(_segment_tile, core, ext, sure_fg_threshold,
+                               os.path.join(scratch_dir, f"tile_{index}.npy") if markers_path else None): index
+                   for index, (core, ext) in enumerate(zip(cores, extended))}
+        tiles = [None] * len(cores)
+        for done, future in enumerate(as_completed(futures), 1):
+            tiles[futures[future]] = future.result()
+            print(f"Tile {done}/{len(cores)} segmented")
+
+    labels_of_nodes, offsets = _stitch(tiles, shape[1], shape[0] * shape[1])
+    n_labels = int(labels_of_nodes.max()) + 1
+    sums = combine_moment_sums(labels_of_nodes, {key: np.concatenate([tile['sums'][key] for tile in tiles])
+                                                 for key in tiles[0]['sums']}, n_labels)
+    perimeters = np.bincount(labels_of_nodes, weights=np.concatenate([tile['perimeters'] for tile in tiles]),
+                             minlength=n_labels)
+    intensities = np.bincount(labels_of_nodes, weights=np.concatenate([tile['intensities'] for tile in tiles]),
+                              minlength=n_labels)
+    features = analyzer.classify_cells(build_feature_table(sums['count'], perimeters, sums['mean_row'],
+                                                           sums['mean_col'], moment_eccentricities(sums),
+                                                           analyzer.params, intensities))
+
+    result = {
+        'features': features,
+        'template_matching_results': {name: int(sum(len(tile['detections'][name]) for tile in tiles))
+                                      for name in tiles[0]['detections']},
+        'cell_count': int(np.count_nonzero(sums['count'][1:])),
+        'normal_cells': int(np.count_nonzero(features['Diagnosis'] == 'Normal')),
+        'abnormal_cells': int(np.count_nonzero(features['Diagnosis'] == 'Abnormal')),
+        'image_shape': shape,
+    }
+
+    if markers_path:
+        # stitched label image written tile by tile into a memory-mapped .npy
+        markers = np.lib.format.open_memmap(markers_path, mode='w+', dtype=np.int32, shape=shape)
+        for index, (row0, row1, col0, col1) in enumerate(cores):
+            local = np.load(os.path.join(scratch_dir, f"tile_{index}.npy"))
+            markers[row0:row1, col0:col1] = labels_of_nodes[offsets[index] + local]
+        markers.flush()
+        del markers
+        result['markers_path'] = markers_path
+    return result
@@ -0,0 +1,67 @@
+# Coarse-to-fine triage.
+# The report's verdicts only depend on an image's abnormality rate, and most of that is known right after the
+# segmentation: the cell count, and every cell's area from one bincount of the label image. A cell whose area
+# lies outside the Normal range is Abnormal whatever its shape, so only the cells inside it need a perimeter
+# (circularity) to be classified. Their count bounds the rate from both sides; when that range clears every
+# report threshold by a margin the verdicts are settled without perimeters, moments or template matching,
+# otherwise the image escalates to the full analysis, which reuses the segmentation already computed.
+import numpy as np
+
+from .report_sink import REPORT_THRESHOLDS, abnormality_rate
+
+class TriagePolicy:
+    def __init__(self, margin=1.0, min_cells=20, thresholds=REPORT_THRESHOLDS):
+        # margin: percentage points the rate range has to clear each threshold by;
+        # min_cells: images with fewer cells always escalate, one cell moves their rate by several percent
+        self.margin = margin
+        self.min_cells = min_cells
+        self.thresholds = tuple(thresholds)
+
+    def config(self):
+        return (self.margin, self.min_cells, self.thresholds)
+
+    def assess(self, cell_count, abnormal, uncertain):
+        # abnormal: cells abnormal by area alone, uncertain: cells whose shape decides;
+        # returns the triage entry of the image's result
+        low = abnormality_rate(abnormal, cell_count)
+        high = abnormality_rate(abnormal + uncertain, cell_count)
+        reason = None
+        if cell_count < self.min_cells:
+            reason = f"only {cell_count} cells"
+        else:
+            for threshold in self.thresholds:
+                if not (low > threshold + self.margin or high <= threshold - self.margin):
+                    reason = f"{low:.1f}-{high:.1f}% abnormal is near {threshold}%"
+                    break
+        return {'escalated': reason is not None, 'abnormality_range': (low, high), 'reason': reason}
+
+def estimate_table(markers, params, area_decides=True):
+    # feature table with the rows build_feature_table would give, from the label areas alone:
+    # Diagnosis is Abnormal for cells outside the Normal area range and Uncertain inside it,
+    # the perimeter, moment and intensity columns are NaN; area_decides=False (a cell rule other than the
+    # default, see classification.py) leaves every cell Uncertain
+    areas = np.bincount(markers.ravel())
+    labels = np.flatnonzero(areas)
+    labels = labels[labels > 0]
+    cell_ids = np.arange(1, len(labels) + 1)
+
+    keep = areas[labels] > params['min_cell_area']
+    labels, cell_ids = labels[keep], cell_ids[keep]
+    area = areas[labels]
+    uncertain = (area > params['normal_min_area']) & (area < params['normal_max_area'])
+    if not area_decides:
+        uncertain[:] = True
+    unknown = np.full(len(labels), np.nan)
+
+    return {
+        'Label': labels,
+        'Cell_ID': cell_ids,
+        'Area': area,
+        'Perimeter': unknown,
+        'Circularity': unknown,
+        'Eccentricity': unknown,
+        'Centroid_Row': unknown,
+        'Centroid_Col': unknown,
+        'Mean_Intensity': unknown,
+        'Diagnosis': np.where(uncertain, 'Uncertain', 'Abnormal'),
+    }
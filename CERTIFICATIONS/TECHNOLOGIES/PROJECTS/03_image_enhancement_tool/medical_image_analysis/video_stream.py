@@ -0,0 +1,268 @@
+# Live video / time-lapse analysis.
+# A reader thread grabs frames from a video file or capture device into a fixed set of preallocated buffers
+# and hands them to a bounded queue; a small pool of worker threads (OpenCV releases the GIL) analyzes them,
+# each with its own analyzer, so the CLAHE object, stage table and template bank are built once per worker
+# and reused for every frame. When the queue is full the drop policy decides which frame goes, and frames
+# older than the latency budget by the time a worker gets to them are skipped rather than analyzed late.
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from .metrics import HISTOGRAM_EDGES
+
+# block: the reader waits for a free slot, nothing is dropped (recorded files);
+# drop_oldest: the oldest queued frame makes room for the new one (live feeds);
+# drop_newest: the new frame is discarded while the queue is full
+DROP_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+class FrameQueue:
+    # bounded queue of (index, capture time, buffer) whose put applies the drop policy
+    def __init__(self, maxsize, policy):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"policy must be one of {DROP_POLICIES}, got {policy!r}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.frames = deque()
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, frame):
+        # returns the frame that was dropped to honour the policy, if any
+        with self.condition:
+            while self.policy == 'block' and len(self.frames) >= self.maxsize and not self.closed:
+                self.condition.wait()
+            dropped = None
+            if len(self.frames) >= self.maxsize:
+                if self.policy == 'drop_newest':
+                    return frame
+                dropped = self.frames.popleft()
+            self.frames.append(frame)
+            self.condition.notify_all()
+            return dropped
+
+    def get(self):
+        # next frame, None once the queue is closed and empty
+        with self.condition:
+            while not self.frames and not self.closed:
+                self.condition.wait()
+            frame = self.frames.popleft() if self.frames else None
+            self.condition.notify_all()
+            return frame
+
+    def close(self, discard=False):
+        # discard: also empty the queue, returns the frames taken out
+        with self.condition:
+            self.closed = True
+            discarded = list(self.frames) if discard else []
+            if discard:
+                self.frames.clear()
+            self.condition.notify_all()
+            return discarded
+
+class BufferPool:
+    # frame buffers allocated once and recycled; enough for a full queue, every worker and the reader
+    def __init__(self, count):
+        self.free = deque([None] * count)
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while not self.free:
+                self.condition.wait()
+            return self.free.popleft()
+
+    def release(self, buffer):
+        with self.condition:
+            self.free.append(buffer)
+            self.condition.notify()
+
+class StreamStats:
+    # frame counters and a latency histogram (capture to result), fixed size however long the stream runs
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.read = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.late = 0
+        self.processed = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.histogram = np.zeros(len(HISTOGRAM_EDGES) + 1, np.int64)
+        self.started = time.perf_counter()
+
+    def count(self, name, n=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def add_latency(self, latency):
+        with self.lock:
+            self.processed += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.histogram[np.searchsorted(HISTOGRAM_EDGES, latency)] += 1
+
+    def percentile(self, q):
+        # upper edge of the histogram bucket holding the q-th percentile latency
+        cumulative = np.cumsum(self.histogram)
+        if not cumulative[-1]:
+            return 0.0
+        position = int(np.searchsorted(cumulative, q / 100 * cumulative[-1]))
+        return min(float(HISTOGRAM_EDGES[min(position, len(HISTOGRAM_EDGES) - 1)]), self.latency_max)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'frames_read': self.read, 'frames_skipped': self.skipped, 'frames_dropped': self.dropped,
+            'frames_late': self.late, 'frames_processed': self.processed, 'frames_failed': self.failed,
+            'fps': self.processed / elapsed if elapsed > 0 else 0.0,
+            'latency_mean_s': self.latency_total / self.processed if self.processed else 0.0,
+            'latency_p50_s': self.percentile(50), 'latency_p95_s': self.percentile(95),
+            'latency_max_s': self.latency_max,
+        }
+
+class VideoStream:
+    def __init__(self, analyzer, source, workers=2, queue_size=4, policy=None, latency_budget=None, skip=1,
+                 track=False, templates=False, pace=False):
+        # source: video file path, or a capture device index (int or digit string);
+        # policy: one of DROP_POLICIES, default block for files and drop_oldest for devices;
+        # latency_budget: seconds a frame may wait before it is skipped, None to analyze every frame taken;
+        # skip: analyze every skip-th frame; track: give every cell a Track_ID carried over from the cell it
+        # overlaps in the previous frame the same worker analyzed (the previous frame when workers=1). Tracking
+        # only labels the cells, the segmentation is the same and no faster;
+        # templates: also run template matching per frame; pace: play files back at their frame rate
+        self.analyzer = analyzer
+        self.source = int(source) if str(source).isdigit() else source
+        self.live = isinstance(self.source, int)
+        self.workers = workers
+        self.queue = FrameQueue(queue_size, policy or ('drop_oldest' if self.live else 'block'))
+        self.buffers = BufferPool(queue_size + workers + 1)
+        self.latency_budget = latency_budget
+        self.skip = max(1, skip)
+        self.track = track
+        self.templates = templates
+        self.pace = pace and not self.live
+        self.stats = StreamStats()
+        self.results = deque()
+        self.results_ready = threading.Condition()
+        self.stopped = threading.Event()
+        # every worker records stage metrics into its own StageMetrics, merged into the analyzer's under this lock
+        self.metrics_lock = threading.Lock()
+
+    def _read_frames(self, capture):
+        interval = 1 / (capture.get(cv2.CAP_PROP_FPS) or 25) if self.pace else 0
+        next_time = time.perf_counter()
+        index = -1
+        try:
+            while not self.stopped.is_set():
+                buffer = self.buffers.acquire()
+                grabbed, frame = capture.read(buffer) if buffer is not None else capture.read()
+                if not grabbed:
+                    self.buffers.release(buffer)
+                    break
+                index += 1
+                self.stats.count('read')
+                if interval:
+                    next_time += interval
+                    time.sleep(max(0.0, next_time - time.perf_counter()))
+                if index % self.skip:
+                    self.stats.count('skipped')
+                    self.buffers.release(frame)
+                    continue
+                dropped = self.queue.put((index, time.perf_counter(), frame))
+                if dropped is not None:
+                    self.stats.count('dropped')
+                    self.buffers.release(dropped[2])
+        finally:
+            self.queue.close()
+
+    def _analyze_frames(self):
+        # one analyzer per worker thread, reused for every frame it takes, with its own StageMetrics: the
+        # registry is not thread-safe, so records are drained after each frame and merged like a worker process's.
+        # tracemalloc peaks are process-wide and cannot be told apart between threads analyzing at once
+        analyzer = type(self.analyzer).from_worker_config(self.analyzer.worker_config())
+        if self.workers > 1 and analyzer.metrics.enabled:
+            analyzer.metrics.trace_memory = False
+        previous = None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            index, captured, frame = item
+            try:
+                if self.latency_budget is not None and time.perf_counter() - captured > self.latency_budget:
+                    self.stats.count('late')
+                    continue
+                result = self.analyze_frame(analyzer, frame, index, previous)
+                if self.track:
+                    previous = result.pop('track')
+                result.update({'frame': index, 'latency': time.perf_counter() - captured})
+                self.stats.add_latency(result['latency'])
+            except Exception as error:
+                self.stats.count('failed')
+                result = {'frame': index, 'error': str(error)}
+            finally:
+                self.buffers.release(frame)
+                records = analyzer.metrics.drain()
+                if records:
+                    with self.metrics_lock:
+                        self.analyzer.metrics.merge(records)
+            with self.results_ready:
+                self.results.append(result)
+                self.results_ready.notify()
+
+    def analyze_frame(self, analyzer, frame, index, previous=None):
+        # counts and feature table of one frame; with track on, a Track_ID column and, for the next frame,
+        # the markers and their IDs (previous: those of the frame before)
+        graph = analyzer.stage_graph(frame, f"{self.source}#{index}")
+        features = graph['features']
+        if self.track:
+            ids = analyzer.carry_track_ids(graph['markers'], *(previous or (None, None)))
+            features = {'Track_ID': ids[features['Label']], **features}
+        normal = int(np.count_nonzero(features['Diagnosis'] == 'Normal'))
+        result = {'features': features, 'cell_count': graph['watershed_count'], 'normal_cells': normal,
+                  'abnormal_cells': len(features['Cell_ID']) - normal}
+        result['template_matching_results'] = graph['templates'] if self.templates else {}
+        if self.track:
+            result['track'] = (graph['markers'], ids)
+        return result
+
+    def frames(self):
+        # opens the source (IOError when it cannot) and returns an iterator over each frame's result as soon as it
+        # is ready (in completion order when workers > 1): frame index, counts, feature table and latency in
+        # seconds, or frame index and error
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise IOError(f"cannot open video source {self.source!r}")
+        return self._frames(capture)
+
+    def _frames(self, capture):
+        reader = threading.Thread(target=self._read_frames, args=(capture,), daemon=True)
+        workers = [threading.Thread(target=self._analyze_frames, daemon=True) for _ in range(self.workers)]
+        reader.start()
+        for worker in workers:
+            worker.start()
+        try:
+            while True:
+                with self.results_ready:
+                    while not self.results and any(worker.is_alive() for worker in workers):
+                        self.results_ready.wait(0.1)
+                    if not self.results:
+                        break
+                    result = self.results.popleft()
+                yield result
+        finally:
+            self.stop()
+            reader.join()
+            for worker in workers:
+                worker.join()
+            capture.release()
+
+    def stop(self):
+        # stops reading and drops the frames still queued; frames being analyzed finish
+        self.stopped.set()
+        for _, _, frame in self.queue.close(discard=True):
+            self.buffers.release(frame)
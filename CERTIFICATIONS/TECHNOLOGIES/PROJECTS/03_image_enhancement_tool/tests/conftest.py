@@ -0,0 +1,27 @@
+# Shared fixtures. pytest puts the tool's directory on the path (see pyproject.toml), so the tests import
+# the medical_image_analysis package and benchmark.py from it, installed or not.
+import cv2
+import pytest
+
+from benchmark import synthetic_smear
+
+@pytest.fixture(scope='session')
+def smear():
+    # 120 separate cells of about 450 pixels, plus 30 touching ones
+    image, _, _ = synthetic_smear((600, 700), 150, overlap=0.2, seed=3)
+    return image
+
+@pytest.fixture
+def smear_path(tmp_path, smear):
+    path = str(tmp_path / 'smear.png')
+    cv2.imwrite(path, smear)
+    return path
+
+@pytest.fixture(scope='session')
+def image_dir(tmp_path_factory):
+    # a folder of two smears: cells of Normal size, and cells many of which segment too large to be Normal
+    # whatever their shape, so triage settles that image without perimeters
+    folder = tmp_path_factory.mktemp('images')
+    cv2.imwrite(str(folder / 'large.png'), synthetic_smear(800, 25, radius=40, seed=5)[0])
+    cv2.imwrite(str(folder / 'normal.png'), synthetic_smear(512, 60, seed=4)[0])
+    return str(folder)
@@ -0,0 +1,97 @@
+# Local HTTP analysis service: statuses, batching and the workers' stage metrics.
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import cv2
+import pytest
+
+from medical_image_analysis.analysis_service import AnalysisService, _handler, _Server
+from medical_image_analysis.analyzer import medical_image_analyzer
+from medical_image_analysis.metrics import StageMetrics
+from medical_image_analysis.result_store import ResultStore
+from medical_image_analysis.triage import TriagePolicy
+
+def _serve(analyzer):
+    service = AnalysisService(analyzer, workers=1, batch_size=4, batch_wait=0.05)
+    service.start()
+    server = _Server(('127.0.0.1', 0), _handler(service, timeout=60))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield service, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+@pytest.fixture(scope='module')
+def service():
+    yield from _serve(medical_image_analyzer(metrics=StageMetrics()))
+
+@pytest.fixture(scope='module')
+def triage_service():
+    yield from _serve(medical_image_analyzer(store=ResultStore('slim'), triage=TriagePolicy()))
+
+def _strict(constant):
+    raise ValueError(f"{constant} is not JSON")
+
+def _request(url, data=None, headers=None):
+    # responses are parsed as strictly as any JSON client would: no NaN or Infinity
+    request = urllib.request.Request(url, data=data, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read(), parse_constant=_strict)
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read(), parse_constant=_strict)
+
+def _paths(paths):
+    return json.dumps({'paths': paths}).encode(), {'Content-Type': 'application/json'}
+
+def test_upload_is_analyzed(service, smear):
+    _, url = service
+    status, body = _request(url + '/analyze?features=0', cv2.imencode('.png', smear)[1].tobytes())
+    assert status == 200
+    assert body['cell_count'] > 100 and 'features' not in body
+
+def test_undecodable_upload_is_a_client_error(service):
+    _, url = service
+    status, body = _request(url + '/analyze', b'not an image')
+    assert status == 422 and body['error'] == 'LOADING FAILED'
+
+def test_paths_are_batched_with_per_image_status(service, smear_path):
+    _, url = service
+    status, body = _request(url + '/analyze?features=0', *_paths([smear_path, smear_path + '.missing']))
+    assert status == 422
+    assert [item['status'] for item in body] == [200, 422]
+
+def test_path_lists_that_cannot_be_queued_are_refused(service, smear_path):
+    _, url = service
+    assert _request(url + '/analyze', *_paths([]))[0] == 400
+    assert _request(url + '/analyze', *_paths([smear_path] * 65))[0] == 413
+
+def test_requests_are_queued_whole_or_not_at_all():
+    # not started: nothing takes requests off the queue
+    service = AnalysisService(medical_image_analyzer(), workers=1, max_queue=3)
+    assert len(service.submit(['a', 'b'])) == 2
+    assert service.submit(['c', 'd']) is None
+    assert service.requests.qsize() == 2
+    assert service.counters['received'] == 2 and service.counters['rejected'] == 2
+    assert len(service.submit(['c'])) == 1
+
+def test_metrics_include_the_workers_stages(service, smear_path):
+    _, url = service
+    _request(url + '/analyze', json.dumps({'path': smear_path}).encode(), {'Content-Type': 'application/json'})
+    status, metrics = _request(url + '/metrics')
+    assert status == 200
+    assert metrics['completed'] >= 1 and metrics['batches'] >= 1
+    assert metrics['stages']['markers']['count'] >= 1
+
+def test_triage_settled_results_are_valid_json(triage_service, image_dir):
+    _, url = triage_service
+    with open(os.path.join(image_dir, 'large.png'), 'rb') as handle:
+        status, body = _request(url + '/analyze', handle.read())
+    assert status == 200
+    assert not body['triage']['escalated'] and body['uncertain_cells'] > 0
+    # unmeasured columns come back as null, measured ones as numbers
+    assert set(body['features']['Circularity']) == {None}
+    assert all(isinstance(area, int) for area in body['features']['Area'])
@@ -0,0 +1,60 @@
+# BCCD scoring helpers of the blood cell analyzer script: VOC annotations and one-to-one detection matching.
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '02_blood_cell_analyzer',
+                      'Blood cell analyze.py')
+
+@pytest.fixture(scope='module')
+def bccd():
+    # the script's name has spaces, so it is loaded from its path; importing it runs nothing but definitions
+    spec = importlib.util.spec_from_file_location('blood_cell_analyze', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+ANNOTATION = """<annotation>
+    <filename>BloodImage_00000.jpg</filename>
+    <object><name>WBC</name><bndbox><xmin>260</xmin><ymin>177</ymin><xmax>491</xmax><ymax>376</ymax></bndbox></object>
+    <object><name>RBC</name><bndbox><xmin>78</xmin><ymin>336</ymin><xmax>184</xmax><ymax>435</ymax></bndbox></object>
+    <object><name> RBC </name><bndbox><xmin>63.5</xmin><ymin>237</ymin><xmax>169</xmax><ymax>336</ymax></bndbox></object>
+    <object><name>Platelets</name><bndbox><xmin>1</xmin><ymin>2</ymin><xmax>30</xmax><ymax>31</ymax></bndbox></object>
+</annotation>"""
+
+def test_parse_voc_annotation(bccd, tmp_path):
+    path = tmp_path / 'BloodImage_00000.xml'
+    path.write_text(ANNOTATION)
+    boxes = bccd.parse_voc_annotation(str(path))
+    np.testing.assert_array_equal(boxes, [[260, 177, 491, 376], [78, 336, 184, 435], [63.5, 237, 169, 336],
+                                          [1, 2, 30, 31]])
+    np.testing.assert_array_equal(bccd.parse_voc_annotation(str(path), {'RBC'}), boxes[1:3])
+    assert bccd.parse_voc_annotation(str(path), {'Neutrophil'}).shape == (0, 4)
+
+def test_each_box_and_detection_is_matched_once(bccd):
+    boxes = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [100, 100, 110, 110]], np.float64)
+    # two detections inside the overlapping boxes, each box gets the one closest to its centre
+    assert bccd.match_detections(np.array([[5.0, 5.0], [10.0, 5.0]]), boxes) == 2
+    # a second detection in a box already taken does not count again
+    assert bccd.match_detections(np.array([[105.0, 105.0], [106.0, 104.0]]), boxes) == 1
+    # edges count as inside, points outside every box match nothing
+    assert bccd.match_detections(np.array([[110.0, 110.0], [50.0, 50.0]]), boxes) == 1
+    assert bccd.match_detections(np.zeros((0, 2)), boxes) == 0
+    assert bccd.match_detections(np.array([[5.0, 5.0]]), np.zeros((0, 4))) == 0
+
+def test_detection_scores(bccd):
+    assert bccd.detection_scores(8, 10, 16) == (0.8, 0.5)
+    assert bccd.detection_scores(0, 0, 0) == (0.0, 0.0)
+
+def test_score_image_scores_both_detectors(bccd):
+    boxes = np.array([[0, 0, 10, 10], [20, 0, 30, 10]], np.float64)
+    result = {'cell_count': 3, 'edge_count': 1, 'edge_centroids': np.array([[25.0, 5.0]]),
+              'features': {'Centroid_Col': np.array([5.0, 6.0, 50.0]), 'Centroid_Row': np.array([5.0, 5.0, 5.0])}}
+    row = bccd.score_image(result, boxes)
+    assert row['annotated'] == 2
+    assert (row['watershed_detections'], row['watershed_tp'], row['watershed_count']) == (3, 1, 3)
+    assert (row['watershed_precision'], row['watershed_recall']) == (1 / 3, 0.5)
+    assert (row['contour_detections'], row['contour_tp']) == (1, 1)
+    assert (row['contour_precision'], row['contour_recall']) == (1.0, 0.5)
@@ -0,0 +1,15 @@
+# The benchmark's synthetic smears and its ground-truth check.
+import benchmark
+
+def test_separable_smear_counts_its_cells():
+    results = benchmark.run_suite([512], [30], [0.0], [8.0], repeats=1, measure_memory=False)
+    case = results['cases'][0]
+    assert case['separate_cells'] == case['ground_truth_cells'] == 30
+    assert case['counts']['feature_cells'] == 30
+    assert benchmark.count_errors(results) == []
+
+def test_count_errors_flags_wrong_counts_of_separable_scenes_only():
+    separable = {'size': 512, 'cells': 30, 'overlap': 0.0, 'noise': 8.0, 'seed': 0, 'ground_truth_cells': 30,
+                 'separate_cells': 30, 'counts': {'feature_cells': 1}}
+    touching = {**separable, 'overlap': 0.3, 'separate_cells': 24}
+    assert len(benchmark.count_errors({'cases': [separable, touching]})) == 1
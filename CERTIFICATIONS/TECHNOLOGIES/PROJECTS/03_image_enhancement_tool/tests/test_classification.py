@@ -0,0 +1,104 @@
+# Cell rules and re-scoring: safe parsing, vectorized evaluation, and re-classified reports that match a fresh run.
+import pickle
+
+import numpy as np
+import pytest
+
+from medical_image_analysis.analyzer import medical_image_analyzer
+from medical_image_analysis.classification import ClassificationPolicy, CellRule
+from medical_image_analysis.report_sink import ReportSink, read_table, report_tables
+from medical_image_analysis.result_store import ResultStore
+from medical_image_analysis.triage import TriagePolicy
+
+def _table(rows=500, seed=0):
+    rng = np.random.default_rng(seed)
+    return {'Cell_ID': np.arange(1, rows + 1), 'Area': rng.integers(20, 1500, rows),
+            'Circularity': rng.uniform(0.3, 1.0, rows), 'Eccentricity': rng.uniform(0.0, 1.0, rows)}
+
+def _wide_rule(table, params):
+    return table['Eccentricity'] < 0.5
+
+def test_default_rule_is_the_original_criterion():
+    table = _table()
+    expected = (table['Circularity'] > 0.7) & (table['Area'] > 50) & (table['Area'] < 1000)
+    assert np.array_equal(CellRule().normal(table), expected)
+    looser = CellRule().normal(table, {'normal_min_circularity': 0.5})
+    assert np.array_equal(looser, (table['Circularity'] > 0.5) & (table['Area'] > 50) & (table['Area'] < 1000))
+
+@pytest.mark.parametrize('rule, area_decides', [
+    (None, True),
+    ("Circularity>normal_min_circularity and normal_min_area<Area<normal_max_area", True),
+    ("(Circularity > normal_min_circularity) and (normal_min_area < Area < normal_max_area)", True),
+    ("Circularity > 0.7 and 50 < Area < 1000", False),
+    ("Circularity > normal_min_circularity", False),
+    (_wide_rule, False)])
+def test_default_rule_is_recognised_however_it_is_written(rule, area_decides):
+    assert CellRule(rule).area_decides == area_decides
+
+def test_rule_expressions_evaluate_over_columns():
+    table = _table()
+    chained = CellRule("50 < Area <= 1000 and not Eccentricity > 0.8")
+    assert np.array_equal(chained.normal(table), (table['Area'] > 50) & (table['Area'] <= 1000)
+                          & ~(table['Eccentricity'] > 0.8))
+    arithmetic = CellRule("sqrt(Area) * Circularity > 20 or abs(Eccentricity - 0.5) < 0.1")
+    assert np.array_equal(arithmetic.normal(table), (np.sqrt(table['Area']) * table['Circularity'] > 20)
+                          | (np.abs(table['Eccentricity'] - 0.5) < 0.1))
+    assert chained.names == {'Area', 'Eccentricity'}
+    assert np.array_equal(CellRule(_wide_rule).normal(table), table['Eccentricity'] < 0.5)
+
+@pytest.mark.parametrize('rule', ["__import__('os').system('true')", "Area.real > 1", "open('x') is None",
+                                  "[Area][0] > 1", "Area > 'large'", "lambda: 1", "Area if Area else 0"])
+def test_unsafe_or_unsupported_rules_are_rejected(rule):
+    with pytest.raises(ValueError):
+        CellRule(rule)
+
+def test_unknown_names_fail_at_evaluation():
+    with pytest.raises(ValueError, match="neither a feature column nor a parameter"):
+        CellRule("Roundness > 0.5").normal(_table())
+
+def test_rules_pickle_for_worker_processes():
+    for rule in (CellRule(), CellRule("Eccentricity < 0.9"), CellRule(_wide_rule)):
+        copy = pickle.loads(pickle.dumps(rule))
+        assert copy.rule == rule.rule and copy.names == rule.names
+        assert np.array_equal(copy.normal(_table()), rule.normal(_table()))
+
+def _report(image_dir, output_dir, triage=None):
+    analyzer = medical_image_analyzer(store=ResultStore('slim'), sink=ReportSink(str(output_dir)), triage=triage)
+    analyzer.batch_analysis([image_dir], workers=1)
+    return str(output_dir)
+
+def _rescore(report_dir, output_dir, rule=None):
+    analyzer = medical_image_analyzer(sink=ReportSink(str(output_dir)), policy=ClassificationPolicy(rule))
+    # small chunks, so images straddle chunk boundaries
+    analyzer.rescore_report([report_dir], chunk_rows=16)
+    return str(output_dir)
+
+def _read(path):
+    chunks = list(read_table(path))
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+@pytest.mark.parametrize('triage', [None, TriagePolicy()], ids=['full', 'triaged'])
+def test_default_rule_rescore_reproduces_the_report(image_dir, tmp_path, triage):
+    original = _report(image_dir, tmp_path / 'original', triage)
+    rescored = _rescore(original, tmp_path / 'rescored')
+    for source, copy in zip(report_tables(original), report_tables(rescored)):
+        with open(source, 'rb') as expected, open(copy, 'rb') as actual:
+            assert actual.read() == expected.read()
+
+def test_rescoring_a_triaged_report_leaves_unmeasured_cells_uncertain(image_dir, tmp_path):
+    original = _report(image_dir, tmp_path / 'original', TriagePolicy())
+    cells = _read(report_tables(original)[0])
+    large = cells['image'] == cells['image'][0]
+    assert np.isnan(cells['Eccentricity'][large]).all()
+    assert set(cells['Diagnosis'][large]) == {'Abnormal', 'Uncertain'}
+
+    # area decided these cells only under the default rule: a shape rule cannot judge any of them
+    rescored = _read(report_tables(_rescore(original, tmp_path / 'shape', "Eccentricity < 0.99"))[0])
+    assert set(rescored['Diagnosis'][large]) == {'Uncertain'}
+    # the escalated image was measured in full and is classified as a fresh run would
+    assert np.array_equal(rescored['Diagnosis'][~large],
+                          np.where(cells['Eccentricity'][~large] < 0.99, 'Normal', 'Abnormal'))
+
+    # a rule on the area alone decides every cell, measured or not
+    rescored = _read(report_tables(_rescore(original, tmp_path / 'area', "Area < 400"))[0])
+    assert np.array_equal(rescored['Diagnosis'], np.where(cells['Area'] < 400, 'Normal', 'Abnormal'))
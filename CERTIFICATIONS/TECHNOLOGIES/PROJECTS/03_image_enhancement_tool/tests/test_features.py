@@ -0,0 +1,78 @@
+# Columnar features against scikit-image's regionprops, label by label, and object tables against the
+# contour path they replaced.
+import cv2
+import numpy as np
+import pytest
+from skimage import measure
+
+from medical_image_analysis.analyzer import medical_image_analyzer
+from medical_image_analysis.features import FEATURE_COLUMNS, binary_objects, feature_records, label_perimeters
+from medical_image_analysis.stage_graph import StageGraph, common_stages
+
+@pytest.fixture(scope='module')
+def segmented(smear):
+    analyzer = medical_image_analyzer()
+    graph = analyzer.stage_graph(smear)
+    return analyzer, graph['markers'], graph['gray']
+
+def test_label_perimeters_match_skimage(segmented):
+    _, markers, _ = segmented
+    perimeters = label_perimeters(markers, int(markers.max()) + 1)
+    for region in measure.regionprops(markers):
+        assert perimeters[region.label] == pytest.approx(region.perimeter, abs=1e-6)
+
+def test_label_perimeters_of_random_labels():
+    markers = np.random.default_rng(0).integers(0, 5, (64, 48))
+    perimeters = label_perimeters(markers, 5)
+    for region in measure.regionprops(markers):
+        assert perimeters[region.label] == pytest.approx(region.perimeter, abs=1e-6)
+
+def test_feature_table_matches_regionprops(segmented):
+    analyzer, markers, gray = segmented
+    table = analyzer.feature_table(markers, gray)
+    regions = {region.label: region for region in measure.regionprops(markers, intensity_image=gray)}
+    assert len(table['Label']) > 100
+    for index, label in enumerate(table['Label']):
+        region = regions[label]
+        assert table['Area'][index] == region.area
+        assert table['Centroid_Row'][index] == pytest.approx(region.centroid[0])
+        assert table['Centroid_Col'][index] == pytest.approx(region.centroid[1])
+        assert table['Eccentricity'][index] == pytest.approx(region.eccentricity, abs=1e-6)
+        assert table['Mean_Intensity'][index] == pytest.approx(region.intensity_mean)
+    # regionprops' order, areas at or below the cut-off left out
+    kept = [label for label, region in regions.items() if region.area > analyzer.params['min_cell_area']]
+    assert list(table['Label']) == kept
+
+def test_feature_records(segmented):
+    analyzer, markers, gray = segmented
+    records = analyzer.feature_extraction(markers, gray)
+    assert set(records[0]) == set(FEATURE_COLUMNS)
+    assert len(records) == len(feature_records(analyzer.classify_cells(analyzer.feature_table(markers, gray))))
+
+def _contour_path(binary, min_area):
+    # what the scripts did before: external contours, filtered and measured one by one
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    kept = [contour for contour in contours if cv2.contourArea(contour) > min_area]
+    return np.array(sorted(cv2.contourArea(contour) for contour in kept)), sorted(map(cv2.boundingRect, kept))
+
+def _binaries(smear):
+    graph = StageGraph(common_stages(), image=smear)
+    rng = np.random.default_rng(0)
+    blobs = cv2.GaussianBlur(rng.random((300, 300)).astype(np.float32), (0, 0), 2) > 0.5
+    # touching diagonals, holes, objects inside holes, single pixels
+    noise = rng.random((200, 200)) > 0.7
+    return [('opened', graph['opened'], 20), ('edges', graph['edges'], 25), ('edges', graph['edges'], 0),
+            ('blobs', blobs.astype(np.uint8) * 255, 0), ('noise', noise.astype(np.uint8) * 255, 0)]
+
+def test_binary_objects_match_the_contour_path(smear):
+    for name, binary, min_area in _binaries(smear):
+        table, _ = binary_objects(binary, min_area)
+        areas, boxes = _contour_path(binary, min_area)
+        assert len(table['Label']) == len(areas), name
+        np.testing.assert_array_equal(np.sort(table['Area']), areas, err_msg=name)
+        assert sorted(zip(table['BBox_Col'], table['BBox_Row'], table['BBox_Width'], table['BBox_Height'])) == boxes
+
+def test_object_counts_of_the_shared_stages(smear):
+    graph = StageGraph(common_stages(), image=smear)
+    assert graph['contour_count'] == len(_contour_path(graph['opened'], 20)[0])
+    assert graph['edge_count'] == len(_contour_path(graph['edges'], 25)[0])
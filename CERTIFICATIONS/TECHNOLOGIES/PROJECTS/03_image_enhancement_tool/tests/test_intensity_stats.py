@@ -0,0 +1,72 @@
+# Intensity statistics merged from tiles, row blocks, chunks and saved runs against one pass over all pixels.
+import cv2
+import numpy as np
+import pytest
+
+from medical_image_analysis import intensity_stats
+from medical_image_analysis.intensity_stats import IntensityStats, collect_intensity_stats, image_histogram
+from medical_image_analysis.stage_graph import StageGraph, common_stages
+
+QUANTILES = [0, 1, 5, 37.5, 50, 95, 100]
+
+def _assert_matches(stats, name, pixels):
+    pixels = np.concatenate([np.ravel(image) for image in pixels])
+    np.testing.assert_array_equal(stats.histograms[name], np.bincount(pixels, minlength=256))
+    assert stats.count(name) == pixels.size
+    assert stats.mean(name) == pytest.approx(pixels.mean(), rel=1e-12)
+    assert stats.variance(name) == pytest.approx(pixels.var(), rel=1e-12)
+    np.testing.assert_array_equal(stats.percentile(name, QUANTILES),
+                                  np.percentile(pixels, QUANTILES, method='inverted_cdf'))
+
+def test_row_blocks_add_up_to_the_whole_image(smear, monkeypatch):
+    gray = cv2.cvtColor(smear, cv2.COLOR_BGR2GRAY)
+    whole = image_histogram(gray)
+    # blocks of a few rows, the last one short
+    monkeypatch.setattr(intensity_stats, '_MAX_BLOCK_PIXELS', 7 * gray.shape[1] + 3)
+    np.testing.assert_array_equal(image_histogram(gray), whole)
+    np.testing.assert_array_equal(whole, np.bincount(gray.ravel(), minlength=256))
+
+def test_merged_tiles_match_one_pass(smear):
+    gray = cv2.cvtColor(smear, cv2.COLOR_BGR2GRAY)
+    # uneven tiles, each its own partial result, merged in an arbitrary order
+    tiles = [gray[rows, cols] for rows in (slice(0, 250), slice(250, None))
+             for cols in (slice(0, 333), slice(333, 500), slice(500, None))]
+    parts = []
+    for tile in tiles:
+        part = IntensityStats()
+        part.add_images({'gray': tile})
+        parts.append(part)
+    merged = IntensityStats()
+    for part in parts[::-1]:
+        merged.merge(part)
+    assert merged.images == len(tiles)
+    _assert_matches(merged, 'gray', [gray])
+
+def _dataset(tmp_path, smear):
+    paths = []
+    for index in range(5):
+        path = str(tmp_path / f'image{index}.png')
+        cv2.imwrite(path, np.roll(smear, 40 * index, axis=index % 2)[:, :600 - 50 * index])
+        paths.append(path)
+    return paths
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_collected_chunks_match_one_pass(tmp_path, smear, workers):
+    paths = _dataset(tmp_path, smear)
+    stats = collect_intensity_stats(paths, workers=workers, chunk_size=2, gray_decode=False)
+    assert stats.images == len(paths)
+    graphs = [StageGraph(common_stages(), image=cv2.imread(path)) for path in paths]
+    for name in ('gray', 'equalized', 'clahe'):
+        _assert_matches(stats, name, [graph[name] for graph in graphs])
+
+def test_saved_runs_resume_into_the_same_aggregate(tmp_path, smear):
+    paths = _dataset(tmp_path, smear)
+    first = collect_intensity_stats(paths[:2], workers=1, gray_decode=False)
+    first.save(str(tmp_path / 'stats.npz'))
+    resumed = collect_intensity_stats(paths[2:], workers=1, gray_decode=False,
+                                      stats=IntensityStats.load(str(tmp_path / 'stats.npz')))
+    whole = collect_intensity_stats(paths, workers=1, gray_decode=False)
+    assert resumed.images == whole.images
+    assert resumed.summary() == whole.summary()
+    for name, counts in whole.histograms.items():
+        np.testing.assert_array_equal(resumed.histograms[name], counts)
@@ -0,0 +1,65 @@
+# Prefetching loader: input order whatever order reads finish in, a bounded read-ahead, and the decode modes.
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from medical_image_analysis.loader import ImageLoader
+
+class _SlowLoader(ImageLoader):
+    # reads take a path-dependent time and are counted, so the test sees what is in flight
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.lock = threading.Lock()
+        self.started = 0
+
+    def read(self, path):
+        with self.lock:
+            self.started += 1
+        time.sleep((hash(path) % 5) / 500)
+        return np.frombuffer(path.encode(), np.uint8)
+
+def test_images_come_back_in_input_order():
+    paths = [f'image{index}.png' for index in range(40)]
+    loaded = [(path, bytes(data).decode()) for path, data, _ in _SlowLoader(threads=6, prefetch=5).prefetch(paths)]
+    assert loaded == list(zip(paths, paths))
+
+def test_read_ahead_is_bounded():
+    loader = _SlowLoader(threads=4, prefetch=3)
+    pulled = []
+    def paths():
+        for index in range(20):
+            pulled.append(index)
+            yield f'image{index}.png'
+
+    stream = loader.prefetch(paths())
+    for consumed in range(1, 21):
+        next(stream)
+        # the consumer's image plus at most `prefetch` more have been read or are being read
+        assert loader.started <= consumed + 3
+        assert len(pulled) <= consumed + 3
+        time.sleep(0.01)
+    assert loader.started == 20
+    assert next(stream, None) is None
+
+def test_decode_modes(tmp_path, smear):
+    path = str(tmp_path / 'smear.jpg')
+    cv2.imwrite(path, smear)
+    height, width = smear.shape[:2]
+    color = ImageLoader().load(path)
+    assert color.shape == (height, width, 3)
+    # JPEG grayscale decodes equal converting the colour decode
+    np.testing.assert_array_equal(ImageLoader().load(path, gray=True), cv2.cvtColor(color, cv2.COLOR_BGR2GRAY))
+    for reduction in (2, 4, 8):
+        loaded = list(ImageLoader(reduction=reduction).prefetch([path], 'gray'))
+        assert loaded[0][2].shape == (-(-height // reduction), -(-width // reduction))
+
+def test_unreadable_files_give_none(tmp_path):
+    empty = tmp_path / 'empty.png'
+    empty.write_bytes(b'')
+    loaded = list(ImageLoader().prefetch([str(tmp_path / 'missing.png'), str(empty)], 'color'))
+    assert [(data is None or not len(data), image) for _, data, image in loaded] == [(True, None), (True, None)]
+    with pytest.raises(ValueError):
+        ImageLoader(reduction=3)
@@ -0,0 +1,31 @@
+# Stage metrics stay flat in the parent process; workers buffer their records until drained.
+from medical_image_analysis.metrics import StageMetrics
+
+def _run(metrics, stages=1000):
+    for index in range(stages):
+        with metrics.stage(f"image{index}", 'segment') as span:
+            span.shapes.append([index])
+
+def test_parent_keeps_totals_not_records():
+    metrics = StageMetrics()
+    _run(metrics)
+    assert metrics.summary()['segment']['count'] == 1000
+    assert metrics.records == [] and metrics.drain() == []
+    assert len(metrics.slowest('segment', 10)) == 5
+
+def test_worker_records_travel_to_the_parent():
+    worker = StageMetrics.from_config(StageMetrics().config())
+    parent = StageMetrics()
+    _run(worker, 10)
+    records = worker.drain()
+    assert len(records) == 10 and worker.drain() == []
+    parent.merge(records)
+    assert parent.summary()['segment']['count'] == 10
+
+def test_slowest_and_kept_records():
+    metrics = StageMetrics(keep_records=True)
+    for wall in (0.3, 0.1, 0.5, 0.2):
+        metrics.add({'image': str(wall), 'stage': 'segment', 'wall_s': wall, 'cpu_s': 0.0, 'peak_bytes': None,
+                     'output_bytes': 0})
+    assert [record['wall_s'] for record in metrics.slowest('segment', 2)] == [0.5, 0.3]
+    assert len(metrics.records) == 4
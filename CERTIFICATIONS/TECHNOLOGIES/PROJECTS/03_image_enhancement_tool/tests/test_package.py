@@ -0,0 +1,44 @@
+# Importing the package is cheap: heavy modules load only when the code that needs them runs.
+# Each check runs in a fresh interpreter, since this one has imported everything already.
+import ast
+import os
+import subprocess
+import sys
+
+import pytest
+
+import medical_image_analysis
+
+TOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY = ('cv2', 'numpy', 'scipy', 'matplotlib', 'tkinter', 'pyarrow', 'skimage')
+
+def _loaded_after(code):
+    # heavy modules imported once code has run, and what it printed
+    script = f"import sys\n{code}\nprint(sorted(name for name in {HEAVY!r} if name in sys.modules))"
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([TOOL_DIR, os.environ.get('PYTHONPATH', '')])}
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, env=env,
+                            check=True).stdout.splitlines()
+    return ast.literal_eval(output[-1]), output[:-1]
+
+def test_import_loads_nothing_heavy_and_prints_nothing():
+    assert _loaded_after("import medical_image_analysis") == ([], [])
+
+def test_exports_load_opencv_and_numpy_only():
+    loaded, _ = _loaded_after("import medical_image_analysis as package\n"
+                              "for name in package.__all__:\n"
+                              "    getattr(package, name)")
+    assert loaded == ['cv2', 'numpy']
+
+def test_scipy_loads_with_the_fft_match():
+    loaded, _ = _loaded_after("import numpy as np\n"
+                              "from medical_image_analysis import TemplateBank\n"
+                              "TemplateBank(method='fft').detect(np.zeros((64, 64), np.uint8))")
+    assert 'scipy' in loaded and 'matplotlib' not in loaded
+
+def test_exports_resolve_to_their_modules():
+    for name in medical_image_analysis.__all__:
+        value = getattr(medical_image_analysis, name)
+        assert value is getattr(sys.modules[f'medical_image_analysis.{medical_image_analysis._EXPORTS[name]}'], name)
+    assert set(medical_image_analysis.__all__) <= set(dir(medical_image_analysis))
+    with pytest.raises(AttributeError):
+        medical_image_analysis.MedicalImageAnalyzer
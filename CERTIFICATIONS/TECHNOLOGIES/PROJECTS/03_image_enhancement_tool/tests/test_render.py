@@ -0,0 +1,24 @@
+# Off-screen figures: one file per input image, whatever the names.
+import os
+
+import cv2
+
+from medical_image_analysis.analyzer import figure_path, medical_image_analyzer
+
+def test_figure_paths_are_unique_per_image():
+    names = ['a/img1.jpg', 'a/img1.png', 'b/img1.jpg']
+    paths = {figure_path('out', name) for name in names}
+    assert len(paths) == len(names)
+    assert all(os.path.basename(path).startswith('img1_') for path in paths)
+
+def test_render_batch_writes_one_figure_per_image(tmp_path, smear):
+    (tmp_path / 'a').mkdir()
+    names = [str(tmp_path / 'a' / 'img1.jpg'), str(tmp_path / 'a' / 'img1.png')]
+    analyzer = medical_image_analyzer()
+    results = {}
+    for name in names:
+        cv2.imwrite(name, smear)
+        results[name] = analyzer.analyze_single_image(name, intermediates=True)
+    figures = analyzer.render_batch(results, str(tmp_path / 'figures'), workers=1)
+    assert len(set(figures.values())) == 2
+    assert sorted(os.listdir(tmp_path / 'figures')) == sorted(os.path.basename(path) for path in figures.values())
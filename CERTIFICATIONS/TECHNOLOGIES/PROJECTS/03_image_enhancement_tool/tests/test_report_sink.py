@@ -0,0 +1,109 @@
+# Streamed reports against the in-memory batch they replace, and the fixed-size aggregates against numpy.
+import numpy as np
+import pytest
+
+from medical_image_analysis.analyzer import medical_image_analyzer
+from medical_image_analysis.report_sink import (AREA_EDGES, DatasetAggregate, ReportSink, StreamingMoments,
+                                                abnormality_rate, read_table, report_tables)
+
+def _read(path):
+    chunks = list(read_table(path, chunk_rows=7))
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+def _aggregate_fields(aggregate):
+    return (aggregate.images, aggregate.cells, aggregate.normal, aggregate.abnormal, aggregate.flagged_images,
+            aggregate.uncertain, aggregate.triaged_images)
+
+def _assert_same_distributions(actual, expected):
+    for name, summary in expected.items():
+        assert actual[name] == pytest.approx(summary, rel=1e-12), name
+
+def test_streamed_report_matches_the_in_memory_batch(image_dir, tmp_path, capsys):
+    in_memory = medical_image_analyzer().batch_analysis([image_dir], workers=1)
+    # small chunks, so both tables are written in several pieces
+    sink = ReportSink(str(tmp_path / 'report'), chunk_rows=16)
+    streamed = medical_image_analyzer(sink=sink)
+    assert streamed.batch_analysis([image_dir], workers=1) == {}
+    assert "Per-cell features written to" in capsys.readouterr().out
+
+    expected = DatasetAggregate()
+    for image_path, result in in_memory.items():
+        expected.add(image_path, result)
+    assert _aggregate_fields(sink.aggregate) == _aggregate_fields(expected)
+    _assert_same_distributions(sink.aggregate.distributions(), expected.distributions())
+
+    cells_path, images_path = report_tables(str(tmp_path / 'report'))
+    images, cells = _read(images_path), _read(cells_path)
+    assert sorted(images['image']) == sorted(in_memory)
+    for row, image_path in enumerate(images['image']):
+        result = in_memory[image_path]
+        assert images['cell_count'][row] == result['cell_count']
+        assert images['abnormal_cells'][row] == result['abnormal_cells']
+        assert images['abnormality_rate'][row] == abnormality_rate(result['abnormal_cells'], result['cell_count'])
+        assert images['template_detections'][row] == sum(result['template_matching_results'].values())
+        # every cell row, in order, with the values kept in memory
+        mine = cells['image'] == image_path
+        for name, values in result['features'].items():
+            np.testing.assert_array_equal(cells[name][mine], values, err_msg=name)
+
+def test_distributions_match_numpy():
+    rng = np.random.default_rng(0)
+    areas = [rng.lognormal(6, 0.8, size).round() + 1 for size in (1, 5000, 20000, 300)]
+    circularity = [rng.beta(8, 2, len(values)) for values in areas]
+    aggregate = DatasetAggregate()
+    for index, (area, circ) in enumerate(zip(areas, circularity)):
+        aggregate.add(f'image{index}', {'cell_count': len(area), 'normal_cells': len(area), 'abnormal_cells': 0,
+                                        'features': {'Area': area, 'Circularity': circ}})
+    summary = aggregate.distributions()
+    for name, values, bin_width in (('Area', np.concatenate(areas), None),
+                                    ('Circularity', np.concatenate(circularity), 0.01)):
+        assert summary[name]['count'] == len(values)
+        assert summary[name]['mean'] == pytest.approx(values.mean(), rel=1e-12)
+        assert summary[name]['std'] == pytest.approx(values.std(), rel=1e-9)
+        assert (summary[name]['min'], summary[name]['max']) == (values.min(), values.max())
+        for q in (0.05, 0.5, 0.95):
+            expected = np.quantile(values, q)
+            if bin_width is None:
+                # log bins: within one bin's ratio
+                assert abs(np.log(summary[name][f'p{round(q * 100)}'] / expected)) <= np.log(AREA_EDGES[1])
+            else:
+                assert summary[name][f'p{round(q * 100)}'] == pytest.approx(expected, abs=bin_width)
+
+def _result(rng, cells, abnormal, triaged=False):
+    circularity = rng.uniform(0.3, 1.0, cells)
+    if triaged:
+        circularity[:] = np.nan
+    result = {'cell_count': cells, 'normal_cells': cells - abnormal, 'abnormal_cells': abnormal,
+              'features': {'Area': rng.integers(20, 1500, cells), 'Circularity': circularity}}
+    if triaged:
+        result.update(uncertain_cells=cells - abnormal, triage={'escalated': False})
+    return result
+
+def test_merged_parts_equal_the_whole():
+    rng = np.random.default_rng(1)
+    results = [(f'image{index}', _result(rng, cells, abnormal, triaged=index % 3 == 0))
+               for index, (cells, abnormal) in enumerate([(40, 2), (0, 0), (120, 30), (75, 5), (9, 9), (300, 12)])]
+    whole = DatasetAggregate()
+    for name, result in results:
+        whole.add(name, result)
+    parts = [DatasetAggregate(), DatasetAggregate(), DatasetAggregate()]
+    for index, (name, result) in enumerate(results):
+        parts[index % 3].add(name, result)
+    merged = parts[2].merge(parts[0]).merge(parts[1])
+
+    assert _aggregate_fields(merged) == _aggregate_fields(whole)
+    _assert_same_distributions(merged.distributions(), whole.distributions())
+    np.testing.assert_array_equal(merged.area_sketch.counts, whole.area_sketch.counts)
+    assert sorted(merged.image_rows) == sorted(whole.image_rows)
+
+@pytest.mark.parametrize('splits', [[10000], [1, 9999], [3000, 3000, 4000], [5] * 2000])
+def test_streaming_moments_do_not_depend_on_the_split(splits):
+    values = np.random.default_rng(2).normal(1e4, 3, sum(splits))
+    moments = StreamingMoments()
+    for chunk in np.split(values, np.cumsum(splits)[:-1]):
+        moments.add(chunk)
+    moments.add([])
+    assert moments.count == len(values)
+    assert moments.mean == pytest.approx(values.mean(), rel=1e-14)
+    assert moments.variance() == pytest.approx(values.var(), rel=1e-8)
+    assert (moments.min, moments.max) == (values.min(), values.max())
@@ -0,0 +1,64 @@
+# On-disk cache of stage results: hits reproduce the analysis, parameters that change a stage miss.
+import os
+
+import numpy as np
+
+from medical_image_analysis.analyzer import medical_image_analyzer
+from medical_image_analysis.classification import ClassificationPolicy
+from medical_image_analysis.loader import ImageLoader
+from medical_image_analysis.result_cache import ResultCache
+
+def _counts(result):
+    return result['cell_count'], result['normal_cells'], result['abnormal_cells'], result['template_matching_results']
+
+def test_cached_result_matches_fresh_analysis(tmp_path, smear_path, capsys):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    fresh = medical_image_analyzer(cache=cache).analyze_single_image(smear_path, intermediates=False)
+    cached = medical_image_analyzer(cache=cache).analyze_single_image(smear_path, intermediates=False)
+    assert "Cached result reused" in capsys.readouterr().out
+    assert _counts(cached) == _counts(fresh)
+    for name, values in fresh['features'].items():
+        np.testing.assert_array_equal(cached['features'][name], values)
+
+def test_classification_reuses_cached_measurements(tmp_path, smear_path, capsys):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    assert medical_image_analyzer(cache=cache).analyze_single_image(smear_path, intermediates=False)['normal_cells']
+    capsys.readouterr()
+    # the measurements do not depend on the rule, a new one only re-classifies them
+    strict = medical_image_analyzer(cache=cache, policy=ClassificationPolicy("Circularity > 2"))
+    result = strict.analyze_single_image(smear_path, intermediates=False)
+    assert "Cached result reused" in capsys.readouterr().out
+    assert result['normal_cells'] == 0
+
+def test_segmentation_parameters_miss(tmp_path, smear_path, capsys):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    medical_image_analyzer(cache=cache).analyze_single_image(smear_path, intermediates=False)
+    capsys.readouterr()
+    medical_image_analyzer(cache=cache, params={'sure_fg_ratio': 0.6}).analyze_single_image(smear_path,
+                                                                                          intermediates=False)
+    assert "Cached result reused" not in capsys.readouterr().out
+
+def test_decode_settings_miss(tmp_path, smear_path, capsys):
+    # a grayscale or reduced decode gives other pixels, so results cached from a full colour decode must not serve it
+    cache = ResultCache(str(tmp_path / 'cache'))
+    medical_image_analyzer(cache=cache).analyze_single_image(smear_path, intermediates=False)
+    for loader in (ImageLoader(gray_decode=True), ImageLoader(reduction=2)):
+        capsys.readouterr()
+        result = medical_image_analyzer(cache=cache, loader=loader).analyze_single_image(smear_path,
+                                                                                         intermediates=False)
+        assert "Cached result reused" not in capsys.readouterr().out
+        assert _counts(result) == _counts(medical_image_analyzer(loader=loader).analyze_single_image(
+            smear_path, intermediates=False))
+    # and each setting hits its own entries
+    medical_image_analyzer(cache=cache, loader=ImageLoader(reduction=2)).analyze_single_image(smear_path,
+                                                                                             intermediates=False)
+    assert "Cached result reused" in capsys.readouterr().out
+
+def test_eviction_keeps_the_cache_under_its_limit(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=200_000)
+    rng = np.random.default_rng(0)
+    for index in range(20):
+        cache.put(cache.key('image', f'stage{index}', 'params'), rng.integers(0, 255, 40_000, np.uint8))
+    assert cache.size() <= 200_000
+    assert cache.get(cache.key('image', 'stage19', 'params')) is not None
+    assert not any(name.endswith('.tmp') for _, _, files in os.walk(cache.cache_dir) for name in files)
@@ -0,0 +1,61 @@
+# Retention policies: slim and spilled records against the full results they were cut from.
+import os
+
+import numpy as np
+import pytest
+
+from medical_image_analysis.analyzer import medical_image_analyzer
+from medical_image_analysis.result_store import INTERMEDIATE_KEYS, ResultStore
+
+@pytest.fixture(scope='module')
+def full_results(image_dir):
+    return medical_image_analyzer().batch_analysis([image_dir], workers=1)
+
+def _assert_same_record(record, full):
+    for key, value in full.items():
+        if key == 'features':
+            for name, values in value.items():
+                np.testing.assert_array_equal(record[key][name], values, err_msg=name)
+        elif key in INTERMEDIATE_KEYS:
+            np.testing.assert_array_equal(record[key], value, err_msg=key)
+        else:
+            assert record[key] == value, key
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_spilled_arrays_load_back_unchanged(image_dir, tmp_path, full_results, workers):
+    store = ResultStore('spill', str(tmp_path / 'spill'), cache_size=1)
+    analyzer = medical_image_analyzer(store=store)
+    results = analyzer.batch_analysis([image_dir], workers=workers)
+    assert results.keys() == full_results.keys()
+    for image_path, record in results.items():
+        # nothing full-size stays in memory, the arrays are on disk
+        assert not set(record) & set(INTERMEDIATE_KEYS)
+        assert sorted(os.listdir(record['spill_path'])) == sorted(key + '.npy' for key in INTERMEDIATE_KEYS)
+        loaded = store.load(image_path, record)
+        assert isinstance(loaded['markers'], np.memmap)
+        _assert_same_record(loaded, full_results[image_path])
+    # the LRU cache holds at most cache_size images
+    assert len(store._cache) == 1
+    store.clear()
+    assert not os.path.exists(str(tmp_path / 'spill'))
+
+def test_slim_records_keep_the_measurements(image_dir, full_results):
+    store = ResultStore('slim')
+    results = medical_image_analyzer(store=store).batch_analysis([image_dir], workers=1)
+    for image_path, record in results.items():
+        assert not set(record) & set(INTERMEDIATE_KEYS)
+        _assert_same_record(record, {key: value for key, value in full_results[image_path].items()
+                                     if key not in INTERMEDIATE_KEYS})
+        with pytest.raises(KeyError, match="kept slim"):
+            store.load(image_path, record)
+
+def test_full_records_load_as_they_are(full_results):
+    store = ResultStore()
+    for image_path, record in full_results.items():
+        assert store.load(image_path, record) is record
+
+def test_spill_needs_a_directory():
+    with pytest.raises(ValueError):
+        ResultStore('spill')
+    with pytest.raises(ValueError):
+        ResultStore('compressed')
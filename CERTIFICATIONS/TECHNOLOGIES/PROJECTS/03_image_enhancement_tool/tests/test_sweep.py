@@ -0,0 +1,39 @@
+# Parameter sweeps: every configuration's counts match an independent run with that setting.
+import cv2
+import pytest
+
+from medical_image_analysis.analyzer import medical_image_analyzer
+from medical_image_analysis.cli import main
+from medical_image_analysis.sweep import grid_configs, parameter_sweep
+
+# one parameter of the shared stages, one of the segmentation, one of the measurements
+SPACE = {'canny_low': [20, 40], 'sure_fg_ratio': [0.4, 0.6], 'min_cell_area': [50, 200]}
+
+def _independent(image_path, config):
+    graph = medical_image_analyzer(params=config).stage_graph(cv2.imread(image_path), image_path)
+    features = graph['features']
+    cells, normal = len(features['Cell_ID']), int((features['Diagnosis'] == 'Normal').sum())
+    return {'cells': cells, 'normal_cells': normal, 'abnormal_cells': cells - normal,
+            'watershed_count': graph['watershed_count'], 'contour_count': graph['contour_count'],
+            'edge_count': graph['edge_count']}
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_sweep_matches_independent_runs(smear_path, image_dir, workers):
+    image_paths = [smear_path, f"{image_dir}/normal.png"]
+    configs = grid_configs(SPACE)
+    rows = parameter_sweep(medical_image_analyzer(), image_paths, configs, workers=workers)
+    assert len(rows) == len(configs) * len(image_paths)
+    for row in rows:
+        config = configs[row['config']]
+        assert {name: row[name] for name in config} == config
+        expected = _independent(row['image'], config)
+        assert {name: row[name] for name in expected} == expected, (row['image'], config)
+
+@pytest.mark.parametrize('item, message', [('canny_low', "expected PARAM=V1,V2"),
+                                           ('canny_lo=20,30', "unknown parameter 'canny_lo'"),
+                                           ('canny_low=(20', "Python literals"), ('canny_low=', "no values")])
+def test_bad_sweep_items_are_reported(smear_path, item, message, capsys):
+    with pytest.raises(SystemExit) as error:
+        main([smear_path, '--sweep', item])
+    assert error.value.code == 2
+    assert message in capsys.readouterr().err
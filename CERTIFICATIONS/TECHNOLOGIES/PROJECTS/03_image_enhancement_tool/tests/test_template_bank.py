@@ -0,0 +1,51 @@
+# Template bank: one detection per cell after non-maximum suppression, the same detections from both methods.
+import pickle
+
+import cv2
+import numpy as np
+import pytest
+
+from medical_image_analysis.template_bank import TemplateBank
+
+def test_suppression_keeps_the_best_of_overlapping_boxes():
+    bank = TemplateBank(overlap=0.3)
+    # (x, y, width, height, score): the best box, one 2 px and one 8 px to either side of it, one far away
+    candidates = np.array([[10, 10, 20, 20, 0.7], [12, 10, 20, 20, 0.9], [20, 10, 20, 20, 0.8],
+                           [100, 100, 20, 20, 0.65]], np.float64)
+    kept = bank._suppress(candidates)
+    # IoU with the box 8 px away: 12*20 / (800 - 240) = 0.43 > 0.3, suppressed as well
+    np.testing.assert_array_equal(kept[:, 4], [0.9, 0.65])
+    assert len(TemplateBank(overlap=0.5)._suppress(candidates)) == 3
+    assert len(bank._suppress(np.zeros((0, 5)))) == 0
+
+def test_one_detection_per_cell():
+    image = np.full((120, 200), 60, np.uint8)
+    centers = [(30, 30), (100, 40), (160, 90), (50, 95)]
+    for center in centers:
+        cv2.circle(image, center, 8, 200, -1)
+    # several scales match every cell, suppression leaves one box each
+    found = TemplateBank(scales=(0.8, 1.0, 1.2)).detect(image)['Normal_Cell']
+    assert len(found) == len(centers)
+    box_centers = found[:, :2] + found[:, 2:4] / 2
+    for center in centers:
+        assert np.min(np.hypot(*(box_centers - center).T)) < 3
+
+@pytest.mark.parametrize('settings', [{}, {'scales': (0.8, 1.0, 1.2), 'angles': (0, 45, 90)}])
+def test_fft_and_spatial_methods_agree(smear, settings):
+    gray = cv2.cvtColor(smear, cv2.COLOR_BGR2GRAY)
+    spatial = TemplateBank(**settings).detect(gray)
+    fft = TemplateBank(method='fft', **settings).detect(gray)
+    assert sum(map(len, spatial.values())) > 10
+    for name, found in spatial.items():
+        np.testing.assert_array_equal(fft[name][:, :4], found[:, :4])
+        np.testing.assert_allclose(fft[name][:, 4], found[:, 4], atol=1e-5)
+
+def test_fft_spectra_are_kept_for_one_image_size(smear):
+    bank = TemplateBank(method='fft', scales=(0.8, 1.0))
+    gray = cv2.cvtColor(smear, cv2.COLOR_BGR2GRAY)
+    for shape in ((300, 400), (256, 256), (600, 700)):
+        bank.detect(np.ascontiguousarray(gray[:shape[0], :shape[1]]))
+        assert len(bank._spectra) == len(bank)
+    assert bank._spectra_shape == bank._fft_shape(gray.shape)
+    # workers receive the bank without them
+    assert pickle.loads(pickle.dumps(bank))._spectra == {}
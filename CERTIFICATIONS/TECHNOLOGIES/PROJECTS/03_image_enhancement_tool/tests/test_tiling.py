@@ -0,0 +1,57 @@
+# Tiled whole-slide mode against a full-frame pass over the same image.
+import numpy as np
+import pytest
+
+from medical_image_analysis.analyzer import medical_image_analyzer
+from medical_image_analysis.cli import main
+from medical_image_analysis.report_sink import read_table, report_tables
+from medical_image_analysis.tiling import tiled_analysis
+
+@pytest.mark.parametrize('source', ['png', 'array'])
+def test_tiled_matches_full_frame(smear, smear_path, tmp_path, source):
+    analyzer = medical_image_analyzer()
+    full = analyzer.analyze_single_image(smear_path, intermediates=True)
+    markers_path = str(tmp_path / 'markers.npy')
+    # files are decoded once into a shared .npy, arrays are written to one
+    tiled = tiled_analysis(analyzer, full['grayCell'] if source == 'array' else smear_path, tile_size=256,
+                           overlap=64, workers=2, markers_path=markers_path)
+
+    assert tiled['cell_count'] == full['cell_count']
+    assert tiled['template_matching_results'] == full['template_matching_results']
+    for name, values in full['features'].items():
+        if np.asarray(values).dtype.kind == 'f':
+            np.testing.assert_allclose(tiled['features'][name], values, rtol=1e-6, atol=1e-6, err_msg=name)
+        else:
+            np.testing.assert_array_equal(tiled['features'][name], values, err_msg=name)
+    np.testing.assert_array_equal(np.load(markers_path), full['markers'])
+    # the comparison covers cells cut by the tile seams, stitched back into one label each
+    assert _seam_cells(full['markers'], 256) >= 5
+
+def _seam_cells(markers, tile_size):
+    # cell labels found on both sides of a seam between tile cores
+    straddling = set()
+    for seam in range(tile_size, markers.shape[0], tile_size):
+        straddling |= set(np.intersect1d(markers[seam - 1], markers[seam]).tolist())
+    for seam in range(tile_size, markers.shape[1], tile_size):
+        straddling |= set(np.intersect1d(markers[:, seam - 1], markers[:, seam]).tolist())
+    return len(straddling - {-1, 0, 1})
+
+def test_tiled_results_go_to_the_report(smear_path, tmp_path):
+    full = medical_image_analyzer().analyze_single_image(smear_path)
+    report_dir = str(tmp_path / 'report')
+    main([smear_path, '--tile-size', '256', '-w', '2', '--report-dir', report_dir])
+
+    cells_path, images_path = report_tables(report_dir)
+    images = next(read_table(images_path))
+    assert list(images['cell_count']) == [full['cell_count']]
+    assert list(images['abnormal_cells']) == [full['abnormal_cells']]
+    cells = next(read_table(cells_path))
+    np.testing.assert_array_equal(cells['Area'], full['features']['Area'])
+
+@pytest.mark.parametrize('option', [['--render-dir', 'figures'], ['--cache-dir', 'cache'],
+                                    ['--extra-stages', 'contour_count']])
+def test_tiled_mode_rejects_options_it_cannot_honour(smear_path, option, capsys):
+    with pytest.raises(SystemExit) as error:
+        main([smear_path, '--tile-size', '256', *option])
+    assert error.value.code == 2
+    assert "--tile-size does not support" in capsys.readouterr().err
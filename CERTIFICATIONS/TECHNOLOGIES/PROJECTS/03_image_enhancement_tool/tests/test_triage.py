@@ -0,0 +1,51 @@
+# Coarse-to-fine triage: rate bounds from the segmentation, escalation near thresholds, where --triage applies.
+import numpy as np
+import pytest
+
+from medical_image_analysis.analyzer import collect_image_paths, medical_image_analyzer
+from medical_image_analysis.cli import main
+from medical_image_analysis.result_store import ResultStore
+from medical_image_analysis.triage import TriagePolicy, estimate_table
+
+def test_assess_settles_clear_rates_and_escalates_borderline_ones():
+    policy = TriagePolicy(margin=1.0, min_cells=20, thresholds=(10, 15, 20))
+    assert not policy.assess(100, 2, 3)['escalated']
+    assert policy.assess(100, 2, 3)['abnormality_range'] == (2.0, 5.0)
+    assert policy.assess(100, 12, 1)['abnormality_range'] == (12.0, 13.0)
+    assert not policy.assess(100, 12, 1)['escalated']
+    assert policy.assess(100, 9, 2)['reason'] == "9.0-11.0% abnormal is near 10%"
+    assert policy.assess(10, 0, 0)['reason'] == "only 10 cells"
+
+def test_estimate_table_decides_cells_outside_the_normal_area_range():
+    markers = np.ones((60, 60), np.int32)
+    markers[:5, :5] = 2      # 25 px, at the area cut-off: left out
+    markers[10:20, 10:20] = 3  # 100 px, shape decides
+    markers[20:55, 20:55] = 4  # 1225 px, too large to be Normal
+    params = {'min_cell_area': 20, 'normal_min_area': 50, 'normal_max_area': 1000}
+    table = estimate_table(markers, params)
+    assert list(table['Label']) == [1, 2, 3, 4]
+    assert list(table['Diagnosis'][2:]) == ['Uncertain', 'Abnormal']
+    assert np.isnan(table['Circularity']).all()
+    assert set(estimate_table(markers, params, area_decides=False)['Diagnosis']) == {'Uncertain'}
+
+def test_triaged_batch_settles_the_large_cells_and_escalates_the_rest(image_dir):
+    analyzer = medical_image_analyzer(store=ResultStore('slim'), triage=TriagePolicy())
+    results = analyzer.batch_analysis([image_dir], workers=1)
+    large, normal = (results[path] for path in collect_image_paths([image_dir]))
+
+    assert not large['triage']['escalated']
+    diagnosis = large['features']['Diagnosis']
+    assert 0 < large['uncertain_cells'] == np.count_nonzero(diagnosis == 'Uncertain') < len(diagnosis)
+    assert np.isnan(large['features']['Circularity']).all()
+
+    # Normal-sized cells need their shape: full analysis, every cell classified
+    assert normal['triage']['escalated'] and 'uncertain_cells' not in normal
+    assert np.isin(normal['features']['Diagnosis'], ['Normal', 'Abnormal']).all()
+
+@pytest.mark.parametrize('options', [[], ['--retention', 'full'], ['--retention', 'slim', '--tile-size', '512'],
+                                     ['--retention', 'slim', '--render-dir', 'figures']])
+def test_triage_needs_a_slim_batch_run(options, image_dir, capsys):
+    with pytest.raises(SystemExit) as error:
+        main([image_dir, '--triage', *options])
+    assert error.value.code == 2
+    assert "--triage needs --retention slim" in capsys.readouterr().err
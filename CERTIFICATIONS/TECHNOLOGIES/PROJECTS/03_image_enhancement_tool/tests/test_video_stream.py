@@ -0,0 +1,93 @@
+# Video stream mode: drop policies of the frame queue and cell IDs carried across frames.
+import threading
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytest
+
+from medical_image_analysis.analyzer import medical_image_analyzer
+from medical_image_analysis.metrics import StageMetrics
+from medical_image_analysis.video_stream import FrameQueue, VideoStream
+
+def test_drop_oldest_makes_room_for_the_new_frame():
+    frames = FrameQueue(2, 'drop_oldest')
+    assert frames.put('a') is None and frames.put('b') is None
+    assert frames.put('c') == 'a'
+    assert [frames.get(), frames.get()] == ['b', 'c']
+
+def test_drop_newest_discards_the_new_frame():
+    frames = FrameQueue(2, 'drop_newest')
+    frames.put('a')
+    frames.put('b')
+    assert frames.put('c') == 'c'
+    assert [frames.get(), frames.get()] == ['a', 'b']
+
+def test_block_waits_for_a_free_slot():
+    frames = FrameQueue(1, 'block')
+    frames.put('a')
+    writer = threading.Thread(target=frames.put, args=('b',))
+    writer.start()
+    writer.join(0.1)
+    assert writer.is_alive()
+    assert frames.get() == 'a'
+    writer.join(1)
+    assert not writer.is_alive() and frames.get() == 'b'
+    frames.close()
+    assert frames.get() is None
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        FrameQueue(1, 'drop_all')
+
+def test_track_ids_follow_cells_while_labels_stay_compact():
+    analyzer = medical_image_analyzer()
+    markers = np.zeros((40, 60), np.int32)
+    markers[:, :] = 1
+    markers[5:15, 5:15], markers[5:15, 30:40], markers[25:35, 10:20] = 2, 3, 4
+    ids = analyzer.carry_track_ids(markers)
+    # next frame: the cells shift, one disappears and a new one appears, labelled in scan order again
+    moved = np.ones_like(markers)
+    moved[6:16, 32:42], moved[26:36, 11:21], moved[5:15, 50:58] = 2, 3, 4
+    moved_ids = analyzer.carry_track_ids(moved, markers, ids)
+    assert moved_ids[2] == ids[3] and moved_ids[3] == ids[4]
+    assert moved_ids[4] > ids.max()
+    assert len(moved_ids) == moved.max() + 1
+
+def _timelapse(path, smear, frames):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 5, (smear.shape[1], smear.shape[0]))
+    for shift in range(frames):
+        writer.write(np.roll(smear, shift, axis=1))
+    writer.release()
+    return path
+
+def test_tracked_stream(tmp_path, smear):
+    path = _timelapse(str(tmp_path / 'timelapse.avi'), smear, 4)
+    stream = VideoStream(medical_image_analyzer(), path, workers=1, track=True)
+    results = sorted(stream.frames(), key=lambda result: result['frame'])
+    assert len(results) == 4 and not any('error' in result for result in results)
+    first = set(results[0]['features']['Track_ID'].tolist())
+    first_label = results[0]['features']['Label'].max()
+    for result in results[1:]:
+        features = result['features']
+        # most cells keep their ID, while labels stay numbered within the frame instead of rising frame by frame
+        assert len(first & set(features['Track_ID'].tolist())) > 0.9 * len(first)
+        assert features['Label'].max() < 1.1 * first_label
+    assert stream.stats.summary()['frames_processed'] == 4
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_worker_threads_merge_their_stage_metrics(tmp_path, smear, workers):
+    path = _timelapse(str(tmp_path / 'timelapse.avi'), smear, 6)
+    metrics = StageMetrics(trace_memory=True)
+    try:
+        stream = VideoStream(medical_image_analyzer(metrics=metrics), path, workers=workers)
+        assert len(list(stream.frames())) == 6
+    finally:
+        tracemalloc.stop()
+    # every frame counted once, whichever thread analyzed it; peaks only where one thread allocates at a time
+    assert metrics.stages['markers']['count'] == metrics.stages['features']['count'] == 6
+    assert (metrics.stages['markers']['max_peak_bytes'] is None) == (workers > 1)
+
+def test_unopenable_source_is_reported(tmp_path, capsys):
+    assert medical_image_analyzer().stream_analysis(str(tmp_path / 'missing.avi')) is None
+    assert "cannot open video source" in capsys.readouterr().out